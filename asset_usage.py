@@ -0,0 +1,114 @@
+"""
+Счётчики использования активов по сервисам (таблица asset_usage).
+
+Заявка «использует» актив, если он у неё received или given; удалённые
+(is_deleted) не считаются. Счётчики меняются в той же транзакции, что
+и сами заявки: обработчик after_flush сравнивает старые и новые значения
+полей каждой добавленной, изменённой или удалённой Order и делает upsert
+count = count + delta. Поэтому маршрутам main.py ничего вызывать не нужно.
+
+Пересчёт с нуля: flask --app main backfill-asset-usage
+"""
+from collections import Counter
+
+from sqlalchemy import event, inspect, select, union, func, or_, delete
+from sqlalchemy.dialects import postgresql, sqlite
+from sqlalchemy.orm import Session
+
+from models import AssetUsage, Order
+
+TOP_ASSETS = 12
+
+
+def _state(order, old: bool):
+    """(service_id, {asset_id}, is_deleted) заявки до или после изменений."""
+    attrs = inspect(order).attrs
+
+    def value(name):
+        if not old:
+            return getattr(order, name)
+        history = attrs[name].history
+        if history.deleted:
+            return history.deleted[0]
+        return history.unchanged[0] if history.unchanged else getattr(order, name)
+
+    assets = {value("received_asset_id"), value("given_asset_id")} - {None}
+    return value("service_id"), assets, bool(value("is_deleted"))
+
+
+def _apply(deltas: Counter, state, sign: int):
+    service_id, assets, is_deleted = state
+    if service_id is None or is_deleted:
+        return
+    for asset_id in assets:
+        deltas[(service_id, asset_id)] += sign
+
+
+def _upsert(connection, deltas: Counter):
+    rows = [
+        {"service_id": s, "asset_id": a, "count": d}
+        for (s, a), d in deltas.items() if d
+    ]
+    if not rows:
+        return
+    dialect = postgresql if connection.dialect.name == "postgresql" else sqlite
+    stmt = dialect.insert(AssetUsage).values(rows)
+    stmt = stmt.on_conflict_do_update(
+        index_elements=[AssetUsage.service_id, AssetUsage.asset_id],
+        set_={"count": AssetUsage.count + stmt.excluded.count},
+    )
+    connection.execute(stmt)
+
+
+@event.listens_for(Session, "after_flush")
+def _track_orders(session, flush_context):
+    deltas = Counter()
+    for obj in session.new:
+        if isinstance(obj, Order):
+            _apply(deltas, _state(obj, old=False), +1)
+    for obj in session.dirty:
+        if isinstance(obj, Order) and session.is_modified(obj):
+            _apply(deltas, _state(obj, old=True), -1)
+            _apply(deltas, _state(obj, old=False), +1)
+    for obj in session.deleted:
+        if isinstance(obj, Order):
+            _apply(deltas, _state(obj, old=True), -1)
+    if deltas:
+        _upsert(session.connection(), deltas)
+
+
+def usage_source():
+    """(service_id, asset_id, count) по живым заявкам — для пересчёта с нуля."""
+    alive = or_(Order.is_deleted == False, Order.is_deleted.is_(None))
+    sides = union(
+        select(Order.id, Order.service_id, Order.received_asset_id.label("asset_id"))
+        .where(alive, Order.service_id.isnot(None), Order.received_asset_id.isnot(None)),
+        select(Order.id, Order.service_id, Order.given_asset_id.label("asset_id"))
+        .where(alive, Order.service_id.isnot(None), Order.given_asset_id.isnot(None)),
+    ).subquery()
+    return select(sides.c.service_id, sides.c.asset_id, func.count()).group_by(
+        sides.c.service_id, sides.c.asset_id
+    )
+
+
+def backfill(db) -> int:
+    """Пересчитать asset_usage по всей таблице orders. Возвращает число строк."""
+    db.execute(delete(AssetUsage))
+    rows = db.execute(usage_source()).all()
+    if rows:
+        db.execute(
+            AssetUsage.__table__.insert(),
+            [{"service_id": s, "asset_id": a, "count": c} for s, a, c in rows],
+        )
+    db.commit()
+    return len(rows)
+
+
+def top_assets(db, service_id: int | None, limit: int = TOP_ASSETS) -> list[int]:
+    """id самых используемых активов сервиса (без сервиса — по всем сервисам)."""
+    q = select(AssetUsage.asset_id).where(AssetUsage.count > 0)
+    if service_id is not None:
+        q = q.where(AssetUsage.service_id == service_id).order_by(AssetUsage.count.desc())
+    else:
+        q = q.group_by(AssetUsage.asset_id).order_by(func.sum(AssetUsage.count).desc())
+    return list(db.execute(q.order_by(AssetUsage.asset_id).limit(limit)).scalars())
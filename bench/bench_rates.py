@@ -0,0 +1,176 @@
+"""
+Бенчмарк пути курсов против локального симулятора бирж (bench/exchange_sim.py).
+
+Замеряет price_rub_for_symbol, price_rub_for_asset_id и POST /add_order:
+p50 / p95 / p99 в миллисекундах и число HTTP-запросов к «биржам» на операцию.
+
+Запуск:
+  python bench/bench_rates.py                          # холодный кэш, 200 итераций
+  python bench/bench_rates.py --warm                   # кэш курсов не сбрасывается
+  python bench/bench_rates.py --latency binance=150 --down mexc --error-rate binance=0.2
+  python bench/bench_rates.py --stream                 # цены из WebSocket-потока симулятора
+
+База — DATABASE_URL, по умолчанию временная SQLite (таблицы создаются init_db).
+"""
+import argparse
+import itertools
+import os
+import sys
+import tempfile
+import time
+
+sys.path.append(os.path.abspath(os.path.join(os.path.dirname(__file__), "..")))
+
+import exchange_sim  # noqa: E402
+
+
+def percentile(values: list[float], q: float) -> float:
+    values = sorted(values)
+    return values[min(len(values) - 1, int(q * len(values)))]
+
+
+def measure(name: str, op, iterations: int, state, before=None) -> dict:
+    timings = []
+    state.reset()
+    for _ in range(iterations):
+        if before:
+            before()
+        started = time.perf_counter()
+        op()
+        timings.append((time.perf_counter() - started) * 1000)
+    calls = state.stats()["total"]
+    return {
+        "name": name,
+        "p50": percentile(timings, 0.50),
+        "p95": percentile(timings, 0.95),
+        "p99": percentile(timings, 0.99),
+        "calls": calls / iterations,
+    }
+
+
+def seed(SessionLocal):
+    from models import Asset, Service, Shift, User
+
+    db = SessionLocal()
+    service = Service(name="bench")
+    db.add(service)
+    db.flush()
+    user = User(login="bench", password_hash="bench", role="admin", service_id=service.id)
+    db.add(user)
+    db.flush()
+    db.add(Shift(number=1, service_id=service.id, started_by=user.id))
+    assets = [
+        Asset(symbol="SBER_RUB", name="Сбербанк"),
+        Asset(symbol="TETHER_TRC20", name="USDT TRC-20"),
+        Asset(symbol="BTC", name="Bitcoin"),
+        Asset(symbol="ETH", name="Ethereum", pair_symbol="ETHUSDT"),
+        Asset(symbol="VOLET_EUR", name="Volet (€)"),
+        Asset(symbol="ALIPAY_CNY", name="Alipay"),
+    ]
+    db.add_all(assets)
+    db.commit()
+    ids = {a.symbol: a.id for a in assets}
+    user_id, service_id = user.id, service.id
+    db.close()
+    return user_id, service_id, ids
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("-n", "--iterations", type=int, default=200)
+    parser.add_argument("--warm", action="store_true", help="не сбрасывать кэш курсов между операциями")
+    parser.add_argument("--latency", nargs="*", metavar="PROVIDER=MS")
+    parser.add_argument("--error-rate", nargs="*", metavar="PROVIDER=RATE")
+    parser.add_argument("--garbage-rate", nargs="*", metavar="PROVIDER=RATE")
+    parser.add_argument("--down", nargs="*", metavar="PROVIDER", default=[])
+    parser.add_argument("--stream", action="store_true", help="включить потоковые цены (RATES_STREAM=1)")
+    parser.add_argument("--ticks", metavar="FILE", help="записанные тики для потока симулятора")
+    args = parser.parse_args()
+
+    server, state = exchange_sim.start()
+    if args.ticks:
+        state.ticks = exchange_sim.load_ticks(args.ticks)
+    changes = {p: {"hang_s": 5} for p in exchange_sim.PROVIDERS}
+    for p, v in exchange_sim._provider_values(args.latency, float).items():
+        changes[p]["latency_ms"] = v
+    for p, v in exchange_sim._provider_values(args.error_rate, float).items():
+        changes[p]["error_rate"] = v
+    for p, v in exchange_sim._provider_values(args.garbage_rate, float).items():
+        changes[p]["garbage_rate"] = v
+    for p in args.down:
+        changes[p]["down"] = True
+    state.configure(changes)
+
+    # окружение задаём до импорта rates/main — адреса читаются при импорте
+    tmp = tempfile.mkdtemp(prefix="bench_rates_")
+    os.environ.update(exchange_sim.urls(f"http://127.0.0.1:{server.server_address[1]}"))
+    os.environ.setdefault("DATABASE_URL", f"sqlite:///{tmp}/bench.db")
+    os.environ["RATES_STORE_PATH"] = os.path.join(tmp, "rates.bin")  # без воркера rates
+    os.environ["RATES_LKG_PATH"] = os.path.join(tmp, "rates_lkg.jsonl")
+    os.environ["RATES_LIMIT_PATH"] = os.path.join(tmp, "ratelimit.bin")
+    os.environ.setdefault("PAIRS_CACHE_PATH", os.path.join(tmp, "pairs.json"))
+    if args.stream:
+        os.environ["RATES_STREAM"] = "1"
+
+    import logging
+    logging.disable(logging.CRITICAL)
+
+    import main as app_main
+    import rates
+    from db import SessionLocal
+
+    user_id, service_id, ids = seed(SessionLocal)
+    if args.stream:
+        # подписываемся заранее и ждём первых тиков — замеряем уже тёплый поток
+        rates.price_stream.watch(["BTCUSDT", "ETHUSDT", "EURUSDT", "CNYUSDT", "TRXUSDT"])
+        for _ in range(50):
+            if rates.price_stream.price("BTCUSDT"):
+                break
+            time.sleep(0.1)
+    before = None if args.warm else rates.rate_cache.invalidate
+
+    symbols = itertools.cycle(["TETHER_TRC20", "VOLET_EUR", "ALIPAY_CNY", "BTC", "ETH"])
+    asset_ids = itertools.cycle(list(ids.values()))
+
+    def symbol_op():
+        rates.price_rub_for_symbol(next(symbols))
+
+    def asset_op():
+        db = SessionLocal()
+        try:
+            app_main.price_rub_for_asset_id(db, next(asset_ids))
+        except ValueError:
+            pass
+        finally:
+            db.close()
+
+    client = app_main.app.test_client()
+    with client.session_transaction() as session:
+        session["user_id"] = user_id
+        session["role"] = "admin"
+        session["selected_service_id"] = service_id
+
+    def add_order_op():
+        client.post("/add_order", data={
+            "received_asset_id": ids["BTC"],
+            "received_amount": "0.01",
+            "given_asset_id": ids["TETHER_TRC20"],
+            "given_amount": "640",
+        })
+
+    results = [
+        measure("price_rub_for_symbol", symbol_op, args.iterations, state, before),
+        measure("price_rub_for_asset_id", asset_op, args.iterations, state, before),
+        measure("POST /add_order", add_order_op, args.iterations, state, before),
+    ]
+
+    mode = "тёплый" if args.warm else "холодный"
+    print(f"\n{args.iterations} итераций, кэш курсов: {mode}, поток цен: {'да' if args.stream else 'нет'}")
+    print(f"{'операция':<26}{'p50, мс':>10}{'p95, мс':>10}{'p99, мс':>10}{'HTTP/оп':>10}")
+    for r in results:
+        print(f"{r['name']:<26}{r['p50']:>10.2f}{r['p95']:>10.2f}{r['p99']:>10.2f}{r['calls']:>10.2f}")
+    server.shutdown()
+
+
+if __name__ == "__main__":
+    main()
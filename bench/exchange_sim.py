@@ -0,0 +1,326 @@
+"""
+Локальный заменитель ЦБ, Binance и MEXC для проверки rates.py без сети.
+
+Отдаёт:
+  /cbr/daily_json.js
+  /binance/api/v3/ticker/price[?symbol=X]   /binance/api/v3/exchangeInfo
+  /mexc/api/v3/ticker/price[?symbol=X]      /mexc/api/v3/exchangeInfo
+
+  /binance/ws                               — WebSocket mini-ticker поток
+
+Поток отдаёт тики пар из подписки (SUBSCRIBE или ?streams=): по умолчанию
+синтетические раз в TICK_INTERVAL, с --ticks — записанные rate_stream.py
+(JSONL {"dt", "s", "c"}), по кругу.
+
+Для каждого провайдера настраиваются задержка, доля ошибок, доля мусорных
+цен и полный простой (простой binance рвёт и поток). Управление на ходу:
+  GET  /_sim/stats   — число запросов по провайдерам
+  POST /_sim/config  — {"binance": {"latency_ms": 300, "down": true}, ...}
+  POST /_sim/reset   — обнулить счётчики
+
+Запуск: python bench/exchange_sim.py --port 8099 --latency binance=80 --down mexc
+rates.py направляется на него переменными RATES_CBR_URL / RATES_BINANCE_URL /
+RATES_MEXC_URL / RATES_STREAM_URL (см. urls()).
+"""
+import argparse
+import json
+import os
+import random
+import socket
+import sys
+import threading
+import time
+from collections import Counter
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from urllib.parse import parse_qs, urlparse
+
+sys.path.append(os.path.abspath(os.path.join(os.path.dirname(__file__), "..")))
+
+from rate_stream import (  # noqa: E402
+    OP_CLOSE, OP_PING, OP_PONG, OP_TEXT, accept_key, encode_frame, read_frame,
+)
+
+PROVIDERS = ("cbr", "binance", "mexc")
+
+BASE_PRICES = {
+    "BTCUSDT": 65000.0,
+    "ETHUSDT": 3200.0,
+    "BNBUSDT": 580.0,
+    "TRXUSDT": 0.12,
+    "EURUSDT": 1.08,
+    "CNYUSDT": 0.14,
+    "ETHBTC": 0.049,
+}
+USD_RUB = 92.5
+TICK_INTERVAL = 0.5     # сек между синтетическими тиками потока
+
+DEFAULT_CONFIG = {
+    "latency_ms": 20,     # средняя задержка ответа
+    "jitter_ms": 10,      # ± случайный разброс
+    "error_rate": 0.0,    # доля ответов 500
+    "garbage_rate": 0.0,  # доля ответов с ценой 0 / мусором
+    "down": False,        # простой: ответ не приходит дольше таймаута клиента
+    "hang_s": 10,         # сколько «висит» запрос при down
+}
+
+
+class SimState:
+    def __init__(self):
+        self.config = {p: dict(DEFAULT_CONFIG) for p in PROVIDERS}
+        self.requests = Counter()
+        self.streams = 0          # открытых за всё время WebSocket-соединений
+        self.ticks = []           # записанные тики для повтора; пусто — синтетика
+        self.lock = threading.Lock()
+
+    def configure(self, changes: dict):
+        with self.lock:
+            for provider, values in changes.items():
+                self.config[provider].update(values)
+
+    def stats(self) -> dict:
+        with self.lock:
+            return {
+                "requests": dict(self.requests),
+                "total": sum(self.requests.values()),
+                "streams": self.streams,
+            }
+
+    def reset(self):
+        with self.lock:
+            self.requests.clear()
+
+
+def _price(symbol: str) -> float:
+    # небольшое «дыхание» цены, чтобы кэш было чем отличать от живого курса
+    return BASE_PRICES[symbol] * random.uniform(0.999, 1.001)
+
+
+def _garbage():
+    return random.choice(["0", "0.00000000", "NaN", "", "-1"])
+
+
+def load_ticks(path: str) -> list[dict]:
+    with open(path, encoding="utf-8") as f:
+        return [json.loads(line) for line in f if line.strip()]
+
+
+def make_handler(state: SimState):
+    class Handler(BaseHTTPRequestHandler):
+        protocol_version = "HTTP/1.1"   # keep-alive, как у настоящих бирж
+
+        def log_message(self, *args):
+            pass
+
+        def _send(self, code: int, payload):
+            body = json.dumps(payload).encode()
+            self.send_response(code)
+            self.send_header("Content-Type", "application/json")
+            self.send_header("Content-Length", str(len(body)))
+            self.end_headers()
+            self.wfile.write(body)
+
+        def do_POST(self):
+            url = urlparse(self.path)
+            length = int(self.headers.get("Content-Length") or 0)
+            body = json.loads(self.rfile.read(length) or b"{}")
+            if url.path == "/_sim/config":
+                state.configure(body)
+                return self._send(200, state.config)
+            if url.path == "/_sim/reset":
+                state.reset()
+                return self._send(200, {"ok": True})
+            return self._send(404, {"error": "not found"})
+
+        def _stream(self, params: dict):
+            """mini-ticker поток в духе Binance: SUBSCRIBE → тики подписанных пар."""
+            with state.lock:
+                cfg = dict(state.config["binance"])
+            key = self.headers.get("Sec-WebSocket-Key")
+            if cfg["down"] or not key:
+                return self._send(503, {"error": "down"})
+            self.send_response(101)
+            self.send_header("Upgrade", "websocket")
+            self.send_header("Connection", "Upgrade")
+            self.send_header("Sec-WebSocket-Accept", accept_key(key))
+            self.end_headers()
+            self.close_connection = True
+            with state.lock:
+                state.streams += 1
+
+            subscribed = {s.split("@")[0].upper() for s in params.get("streams", "").split("/") if s}
+            stop = threading.Event()
+            send_lock = threading.Lock()
+
+            def send(opcode, payload: bytes):
+                with send_lock:
+                    self.wfile.write(encode_frame(opcode, payload, mask=False))
+                    self.wfile.flush()
+
+            def recv_exact(n):
+                data = self.rfile.read(n)
+                if len(data) < n:
+                    raise EOFError
+                return data
+
+            def reader():
+                try:
+                    while not stop.is_set():
+                        _, opcode, payload = read_frame(recv_exact)
+                        if opcode == OP_PING:
+                            send(OP_PONG, payload)
+                        elif opcode == OP_CLOSE:
+                            break
+                        elif opcode == OP_TEXT:
+                            msg = json.loads(payload)
+                            if msg.get("method") == "SUBSCRIBE":
+                                subscribed.update(p.split("@")[0].upper() for p in msg["params"])
+                            send(OP_TEXT, json.dumps({"result": None, "id": msg.get("id")}).encode())
+                except (OSError, EOFError, ValueError):
+                    pass
+                finally:
+                    stop.set()
+
+            threading.Thread(target=reader, daemon=True).start()
+            replay = state.ticks
+            i = 0
+            try:
+                while not stop.is_set():
+                    if replay:
+                        tick = replay[i % len(replay)]
+                        i += 1
+                        stop.wait(max(float(tick.get("dt", 0)), 0.001))
+                        batch = [(tick["s"], tick["c"])] if tick["s"] in subscribed else []
+                    else:
+                        stop.wait(TICK_INTERVAL)
+                        batch = [(s, f"{_price(s):.8f}") for s in sorted(subscribed) if s in BASE_PRICES]
+
+                    with state.lock:
+                        cfg = dict(state.config["binance"])
+                    if cfg["down"]:
+                        break  # простой биржи — поток рвётся
+                    for symbol, price in batch:
+                        if random.random() < cfg["garbage_rate"]:
+                            price = _garbage()
+                        send(OP_TEXT, json.dumps({
+                            "e": "24hrMiniTicker", "E": int(time.time() * 1000), "s": symbol, "c": price,
+                        }).encode())
+            except OSError:
+                pass
+            finally:
+                stop.set()
+                # будит читателя и отдаёт клиенту FIN — иначе закрытие rfile ждёт его чтения
+                try:
+                    self.connection.shutdown(socket.SHUT_RDWR)
+                except OSError:
+                    pass
+
+        def do_GET(self):
+            url = urlparse(self.path)
+            if url.path == "/_sim/stats":
+                return self._send(200, state.stats())
+
+            provider, _, path = url.path.lstrip("/").partition("/")
+            if provider not in PROVIDERS:
+                return self._send(404, {"error": "not found"})
+            params = {k: v[0] for k, v in parse_qs(url.query).items()}
+
+            if provider == "binance" and path in ("ws", "stream"):
+                return self._stream(params)
+
+            with state.lock:
+                state.requests[provider] += 1
+                cfg = dict(state.config[provider])
+
+            if cfg["down"]:
+                time.sleep(cfg["hang_s"])
+                return self._send(503, {"error": "down"})
+            delay = cfg["latency_ms"] + random.uniform(-cfg["jitter_ms"], cfg["jitter_ms"])
+            time.sleep(max(0.0, delay) / 1000)
+            if random.random() < cfg["error_rate"]:
+                return self._send(500, {"error": "simulated"})
+            garbage = random.random() < cfg["garbage_rate"]
+
+            if provider == "cbr" and path == "daily_json.js":
+                value = _garbage() if garbage else USD_RUB * random.uniform(0.999, 1.001)
+                return self._send(200, {"Valute": {"USD": {"CharCode": "USD", "Value": value}}})
+
+            if path == "api/v3/ticker/price":
+                symbol = params.get("symbol")
+                if symbol is None:
+                    return self._send(200, [
+                        {"symbol": s, "price": _garbage() if garbage else f"{_price(s):.8f}"}
+                        for s in BASE_PRICES
+                    ])
+                if symbol not in BASE_PRICES:
+                    return self._send(400, {"code": -1121, "msg": "Invalid symbol."})
+                return self._send(200, {"symbol": symbol, "price": _garbage() if garbage else f"{_price(symbol):.8f}"})
+
+            if path == "api/v3/exchangeInfo":
+                status = "TRADING" if provider == "binance" else "1"
+                return self._send(200, {"symbols": [{"symbol": s, "status": status} for s in BASE_PRICES]})
+
+            return self._send(404, {"error": "not found"})
+
+    return Handler
+
+
+def urls(base: str) -> dict:
+    """Переменные окружения, направляющие rates.py на симулятор."""
+    env = {f"RATES_{p.upper()}_URL": f"{base}/{p}" for p in PROVIDERS}
+    env["RATES_STREAM_URL"] = base.replace("http", "ws", 1) + "/binance/ws"
+    return env
+
+
+def start(port: int = 0, host: str = "127.0.0.1") -> tuple[ThreadingHTTPServer, SimState]:
+    """Запустить симулятор в фоновом потоке (port=0 — любой свободный)."""
+    state = SimState()
+    server = ThreadingHTTPServer((host, port), make_handler(state))
+    server.daemon_threads = True
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    return server, state
+
+
+def _provider_values(items: list[str], cast) -> dict:
+    result = {}
+    for item in items or []:
+        provider, _, value = item.partition("=")
+        result[provider] = cast(value)
+    return result
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--port", type=int, default=8099)
+    parser.add_argument("--latency", nargs="*", metavar="PROVIDER=MS")
+    parser.add_argument("--error-rate", nargs="*", metavar="PROVIDER=RATE")
+    parser.add_argument("--garbage-rate", nargs="*", metavar="PROVIDER=RATE")
+    parser.add_argument("--down", nargs="*", metavar="PROVIDER", default=[])
+    parser.add_argument("--ticks", metavar="FILE", help="JSONL с тиками для повтора в потоке")
+    args = parser.parse_args()
+
+    server, state = start(args.port)
+    if args.ticks:
+        state.ticks = load_ticks(args.ticks)
+    changes = {p: {} for p in PROVIDERS}
+    for p, v in _provider_values(args.latency, float).items():
+        changes[p]["latency_ms"] = v
+    for p, v in _provider_values(args.error_rate, float).items():
+        changes[p]["error_rate"] = v
+    for p, v in _provider_values(args.garbage_rate, float).items():
+        changes[p]["garbage_rate"] = v
+    for p in args.down:
+        changes[p]["down"] = True
+    state.configure(changes)
+
+    base = f"http://127.0.0.1:{server.server_address[1]}"
+    print(f"симулятор бирж на {base}")
+    for key, value in urls(base).items():
+        print(f"  export {key}={value}")
+    try:
+        threading.Event().wait()
+    except KeyboardInterrupt:
+        server.shutdown()
+
+
+if __name__ == "__main__":
+    main()
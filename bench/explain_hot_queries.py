@@ -0,0 +1,143 @@
+"""
+EXPLAIN горячих запросов: проверка, что планы идут по индексам из models.py
+(миграция e1b4f2a7c935), а не последовательным сканированием.
+
+Запросы — те же, что строят маршруты: активная смена сервиса, страница ленты,
+заявки смены для сводки дашборда, вводы/выводы смены, группа перевода,
+строка баланса, история баланса. Параметры берутся из самой базы
+(первый сервис, последняя смена, любой перевод), иначе — 1.
+
+Запуск:
+  DATABASE_URL=postgresql+psycopg2://... python bench/explain_hot_queries.py
+  python bench/explain_hot_queries.py --analyze        # EXPLAIN ANALYZE (PostgreSQL)
+  python bench/explain_hot_queries.py --no-seqscan     # enable_seqscan=off: индекс вообще применим?
+
+На маленькой базе PostgreSQL честно выбирает Seq Scan — там смотрите с --no-seqscan.
+orders и balances_history разбиты по месяцам (partitions.py): в плане стоят
+индексы партиций (orders_p2026_10_shift_id_is_deleted_idx …) — они засчитываются
+за родительский индекс. Запросы по смене ограничены её месяцами, и в плане
+видно, сколько партиций осталось после отсечения.
+Код выхода 1, если какой-то запрос так и остался без индекса.
+"""
+import argparse
+import os
+import sys
+
+sys.path.append(os.path.abspath(os.path.join(os.path.dirname(__file__), "..")))
+
+from sqlalchemy import select, text  # noqa: E402
+
+import partitions  # noqa: E402
+from db import SessionLocal, engine  # noqa: E402
+from models import Balance, BalanceHistory, Order, Service, Shift  # noqa: E402
+
+# SQLite называет индекс UNIQUE-ограничения по-своему
+SQLITE_NAMES = {"uq_balances_service_asset": "sqlite_autoindex_balances"}
+
+
+def params(db) -> dict:
+    service_id = db.scalar(select(Service.id).order_by(Service.id)) or 1
+    shift = db.execute(
+        select(Shift.id, Shift.start_time).where(Shift.service_id == service_id).order_by(Shift.id.desc())
+    ).first()
+    balance = db.execute(select(Balance.service_id, Balance.asset_id).limit(1)).first() or (service_id, 1)
+    group = db.scalar(select(Order.transfer_group).where(Order.transfer_group.isnot(None)).limit(1)) or 1
+    return {
+        "service_id": service_id,
+        "shift_id": shift.id if shift else 1,
+        "shift_start": shift.start_time if shift else None,
+        "asset_id": balance[1],
+        "balance_service_id": balance[0],
+        "transfer_group": group,
+    }
+
+
+def hot_queries(db, p: dict) -> list:
+    """(название, ожидаемый индекс, запрос)."""
+    import main  # order_feed — та же проекция ленты, что в index()
+
+    in_shift = partitions.shift_window(Order.created_at, p["shift_start"])
+    feed = main.order_feed(
+        db.query(Order).filter(Order.service_id == p["service_id"])
+    ).order_by(Order.id.desc()).limit(16)
+    return [
+        ("активная смена сервиса", "ix_shifts_service_end",
+         select(Shift.id)
+         .where(Shift.service_id == p["service_id"], Shift.end_time.is_(None))
+         .order_by(Shift.start_time.desc()).limit(1)),
+        ("страница ленты сервиса", "ix_orders_service_id_desc", feed.statement),
+        ("заявки смены (сводка)", "ix_orders_shift_deleted",
+         select(Order.profit_rub, Order.amount)
+         .where(Order.shift_id == p["shift_id"], in_shift, Order.is_deleted == False)),
+        ("вводы смены admin_io", "ix_orders_type_shift_direction",
+         select(Order.amount)
+         .where(Order.type == "admin_io", Order.shift_id == p["shift_id"], in_shift,
+                Order.direction == "in", Order.is_deleted == False)),
+        ("группа перевода", "ix_orders_transfer_group",
+         select(Order.id)
+         .where(Order.transfer_group == p["transfer_group"], Order.is_deleted == False)),
+        ("строка баланса", "uq_balances_service_asset",
+         select(Balance.id)
+         .where(Balance.service_id == p["balance_service_id"], Balance.asset_id == p["asset_id"])),
+        ("история баланса", "ix_balances_history_service_asset_created",
+         select(BalanceHistory.new_amount)
+         .where(BalanceHistory.service_id == p["balance_service_id"],
+                BalanceHistory.asset_id == p["asset_id"])
+         .order_by(BalanceHistory.created_at.desc()).limit(20)),
+    ]
+
+
+def index_names(connection, index: str) -> list[str]:
+    """Индекс и его копии на партициях (в SQLite — имя автоиндекса)."""
+    if connection.dialect.name != "postgresql":
+        return [index, SQLITE_NAMES.get(index, index)]
+    children = connection.execute(text("""
+        SELECT c.relname FROM pg_inherits i
+        JOIN pg_class c ON c.oid = i.inhrelid
+        JOIN pg_class p ON p.oid = i.inhparent
+        WHERE p.relname = :index
+    """), {"index": index}).scalars()
+    return [index, *children]
+
+
+def explain(connection, stmt, analyze: bool) -> list[str]:
+    sql = str(stmt.compile(dialect=connection.dialect, compile_kwargs={"literal_binds": True}))
+    if connection.dialect.name == "postgresql":
+        prefix = "EXPLAIN (ANALYZE, BUFFERS) " if analyze else "EXPLAIN "
+        return [row[0] for row in connection.execute(text(prefix + sql))]
+    return [row[-1] for row in connection.execute(text("EXPLAIN QUERY PLAN " + sql))]
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--analyze", action="store_true", help="EXPLAIN ANALYZE (только PostgreSQL)")
+    parser.add_argument("--no-seqscan", action="store_true", help="SET enable_seqscan = off (PostgreSQL)")
+    args = parser.parse_args()
+
+    with SessionLocal() as db:
+        p = params(db)
+        queries = hot_queries(db, p)
+
+    missing = []
+    with engine.connect() as connection:
+        if args.no_seqscan and connection.dialect.name == "postgresql":
+            connection.execute(text("SET enable_seqscan = off"))
+        for name, index, stmt in queries:
+            plan = explain(connection, stmt, args.analyze)
+            names = index_names(connection, index)
+            used = any(name in line for line in plan for name in names)
+            print(f"\n== {name} ({'индекс ' + index if used else 'БЕЗ ' + index})")
+            for line in plan:
+                print("   ", line)
+            if not used:
+                missing.append(name)
+
+    print(f"\nпараметры: {p}")
+    if missing:
+        print("без индекса: " + ", ".join(missing))
+        sys.exit(1)
+    print("все горячие запросы идут по индексам")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,173 @@
+"""
+Справочники в памяти процесса: сервисы, активы, категории, пользователи.
+
+Они меняются редко (add_asset, delete_asset, /categories/*, /users/*,
+ручной курс), а читаются на каждой странице. Воркер держит их у себя
+неизменяемыми строками (namedtuple) и перечитывает справочник из БД,
+только когда выросла его версия в таблице catalog_versions.
+
+Версии растут в той же транзакции, что и сами изменения: обработчик
+after_flush видит добавленные, изменённые и удалённые Service / Asset /
+Category / User и делает upsert version = version + 1. Маршрутам main.py
+ничего вызывать не нужно, а остальные воркеры gunicorn замечают изменение
+по версии на следующем запросе.
+
+Так же по версии "shifts" кэшируется активная смена каждого сервиса:
+start_shift / end_shift / set_shift меняют Shift — версия растёт.
+
+Версии читаются одним запросом на транзакцию; справочник — только после изменения.
+"""
+from collections import namedtuple
+
+from sqlalchemy import event, select
+from sqlalchemy.dialects import postgresql, sqlite
+from sqlalchemy.orm import Session
+
+from models import Asset, CatalogVersion, Category, Service, Shift, User
+
+ServiceRef = namedtuple("ServiceRef", "id name")
+AssetRef = namedtuple("AssetRef", "id symbol name pair_symbol manual_rate")
+CategoryRef = namedtuple("CategoryRef", "id name")
+UserRef = namedtuple("UserRef", "id login role service_id")   # без password_hash
+ShiftRef = namedtuple("ShiftRef", "id number service_id start_time started_by")
+
+Catalog = namedtuple("Catalog", "version rows by_id")
+
+# справочник -> (модель, строка кэша)
+CATALOGS = {
+    "services": (Service, ServiceRef),
+    "assets": (Asset, AssetRef),
+    "categories": (Category, CategoryRef),
+    "users": (User, UserRef),
+}
+# модель -> чья версия растёт при её изменении
+_NAMES = {model: name for name, (model, _) in CATALOGS.items()}
+_NAMES[Shift] = "shifts"
+
+# ключи в session.info
+_VERSIONS = "catalog_versions"   # версии, прочитанные текущей транзакцией
+_CHANGED = "catalog_changed"     # справочники, изменённые незакоммиченной транзакцией
+
+
+class CatalogCache:
+    def __init__(self):
+        self._catalogs = {}   # name -> Catalog
+        self._shifts = (None, {})   # (версия shifts, {service_id: ShiftRef | None})
+
+    def versions(self, db) -> dict:
+        versions = db.info.get(_VERSIONS)
+        if versions is None:
+            versions = dict(db.execute(select(CatalogVersion.name, CatalogVersion.version)).all())
+            db.info[_VERSIONS] = versions
+        return versions
+
+    def _load(self, db, name: str, version: int) -> Catalog:
+        model, ref = CATALOGS[name]
+        columns = [model.__table__.c[field] for field in ref._fields]
+        rows = tuple(ref._make(row) for row in db.execute(select(*columns).order_by(model.id)))
+        return Catalog(version, rows, {row.id: row for row in rows})
+
+    def get(self, db, name: str) -> Catalog:
+        if name in db.info.get(_CHANGED, ()):
+            # свои незакоммиченные изменения — в общий кэш их не кладём, вдруг откат
+            return self._load(db, name, None)
+        version = self.versions(db).get(name, 0)
+        catalog = self._catalogs.get(name)
+        if catalog is None or catalog.version != version:
+            catalog = self._catalogs[name] = self._load(db, name, version)
+        return catalog
+
+    def _load_active_shift(self, db, service_id: int) -> ShiftRef | None:
+        columns = [Shift.__table__.c[field] for field in ShiftRef._fields]
+        row = db.execute(
+            select(*columns)
+            .where(Shift.service_id == service_id, Shift.end_time.is_(None))
+            .order_by(Shift.start_time.desc())
+            .limit(1)
+        ).first()
+        return ShiftRef._make(row) if row else None
+
+    def active_shift(self, db, service_id: int) -> ShiftRef | None:
+        if "shifts" in db.info.get(_CHANGED, ()):
+            return self._load_active_shift(db, service_id)
+        version = self.versions(db).get("shifts", 0)
+        cached_version, shifts = self._shifts
+        if cached_version != version:
+            shifts = {}
+            self._shifts = (version, shifts)
+        if service_id not in shifts:
+            shifts[service_id] = self._load_active_shift(db, service_id)
+        return shifts[service_id]
+
+
+catalog_cache = CatalogCache()
+
+
+def services(db) -> tuple:
+    return catalog_cache.get(db, "services").rows
+
+
+def assets(db) -> tuple:
+    return catalog_cache.get(db, "assets").rows
+
+
+def categories(db) -> tuple:
+    return catalog_cache.get(db, "categories").rows
+
+
+def users(db) -> tuple:
+    return catalog_cache.get(db, "users").rows
+
+
+def service(db, service_id: int | None) -> ServiceRef | None:
+    return catalog_cache.get(db, "services").by_id.get(service_id)
+
+
+def asset(db, asset_id: int | None) -> AssetRef | None:
+    return catalog_cache.get(db, "assets").by_id.get(asset_id)
+
+
+def user(db, user_id: int | None) -> UserRef | None:
+    return catalog_cache.get(db, "users").by_id.get(user_id)
+
+
+def active_shift(db, service_id: int | None) -> ShiftRef | None:
+    """Открытая смена сервиса (последняя начатая), без запроса к БД, пока смены не менялись."""
+    if service_id is None:
+        return None
+    return catalog_cache.active_shift(db, service_id)
+
+
+# =============================
+#  Версии: растут вместе с изменениями
+# =============================
+def _bump(connection, names):
+    rows = [{"name": name, "version": 1} for name in sorted(names)]
+    dialect = postgresql if connection.dialect.name == "postgresql" else sqlite
+    stmt = dialect.insert(CatalogVersion).values(rows)
+    stmt = stmt.on_conflict_do_update(
+        index_elements=[CatalogVersion.name],
+        set_={"version": CatalogVersion.version + 1},
+    )
+    connection.execute(stmt)
+
+
+@event.listens_for(Session, "after_flush")
+def _track_catalogs(session, flush_context):
+    changed = {_NAMES[type(obj)] for obj in session.new | session.deleted if type(obj) in _NAMES}
+    changed |= {
+        _NAMES[type(obj)] for obj in session.dirty
+        if type(obj) in _NAMES and session.is_modified(obj, include_collections=False)
+    }
+    if changed:
+        _bump(session.connection(), changed)
+        session.info.setdefault(_CHANGED, set()).update(changed)
+        session.info.pop(_VERSIONS, None)
+
+
+@event.listens_for(Session, "after_transaction_end")
+def _forget_versions(session, transaction):
+    # коммит, откат или close: следующая транзакция читает версии заново
+    if transaction.parent is None:
+        session.info.pop(_CHANGED, None)
+        session.info.pop(_VERSIONS, None)
@@ -0,0 +1,88 @@
+"""
+Контекст запроса: одна сессия БД на запрос и то, что нужно почти каждому
+маршруту, — текущий пользователь, его сервис, активная смена.
+
+Сессия открывается при первом обращении (request_db / get_db) и закрывается
+в teardown приложения. Она привязана к одному соединению на весь запрос:
+сколько бы раз маршрут и его помощники ни звали get_db() и commit(),
+из пула берётся одно соединение.
+
+RequestContext заполняется лениво: пользователь и сервис берутся из кэша
+справочников (catalogs.py), активная смена — из кэша смен по версии
+"shifts", так что обычно ни одного запроса к БД.
+"""
+from contextlib import contextmanager
+from functools import cached_property
+
+from flask import g, has_app_context, request, session
+
+import catalogs
+import db as database
+
+
+def request_db():
+    """Сессия БД текущего запроса (создаётся при первом вызове)."""
+    if "db" not in g:
+        # после commit() сессия не отдаёт соединение в пул — следующая транзакция на нём же
+        g.db_connection = database.engine.connect()
+        g.db = database.SessionLocal(bind=g.db_connection)
+    return g.db
+
+
+@contextmanager
+def get_db():
+    """
+    Как db.get_db, но внутри запроса отдаёт общую сессию запроса и не закрывает её.
+    Вне приложения (CLI, скрипты) — отдельная сессия, как раньше.
+    """
+    if not has_app_context():
+        with database.get_db() as db:
+            yield db
+        return
+    yield request_db()
+
+
+def close_request_db(exc=None):
+    """teardown_appcontext: незакоммиченное откатывается, соединение — в пул."""
+    db = g.pop("db", None)
+    if db is not None:
+        db.close()
+        g.pop("db_connection").close()
+
+
+class RequestContext:
+    """Кто делает запрос и с каким сервисом; всё загружается при первом обращении."""
+
+    def __init__(self, db):
+        self.db = db
+
+    @cached_property
+    def user(self) -> catalogs.UserRef | None:
+        user_id = session.get("user_id")
+        return catalogs.user(self.db, user_id) if user_id else None
+
+    @property
+    def role(self) -> str | None:
+        return self.user.role if self.user else None
+
+    @cached_property
+    def service(self) -> catalogs.ServiceRef | None:
+        """У оператора — его сервис, у админа — выбранный ?service_id= (или None)."""
+        if self.user is None:
+            return None
+        if self.role == "operator":
+            return catalogs.service(self.db, self.user.service_id)
+        service_id = request.args.get("service_id", type=int)
+        return catalogs.service(self.db, service_id) if service_id else None
+
+    def active_shift(self, service_id: int | None = None) -> catalogs.ShiftRef | None:
+        """Активная смена сервиса (по умолчанию — сервиса запроса)."""
+        if service_id is None:
+            service_id = self.service.id if self.service else None
+        return catalogs.active_shift(self.db, service_id)
+
+
+def request_context() -> RequestContext:
+    if "request_context" not in g:
+        g.request_context = RequestContext(request_db())
+    return g.request_context
@@ -1,23 +1,34 @@
 from flask import Flask, render_template, redirect, url_for, request
-from db import SessionLocal, init_db
-from models import Service, Asset, Balance, Shift, Order, User, BalanceHistory, Category
+from db import init_db
+from models import Service, Asset, Balance, Shift, Order, User, BalanceHistory, Category, RateSnapshot
 from datetime import datetime
 from sqlalchemy.orm import Session
-from collections import defaultdict
+from collections import defaultdict, namedtuple
 from flask import Flask, render_template, redirect, url_for, request, session, flash
 from werkzeug.security import check_password_hash, generate_password_hash
-from sqlalchemy.orm import joinedload
+from sqlalchemy.orm import joinedload, aliased
 from werkzeug.security import generate_password_hash
 from sqlalchemy.orm import joinedload
-from db import get_db
+from context import get_db, request_db, request_context, close_request_db
+from rate_store import rate_store
+from rate_history import rates_as_of
+import asset_usage
+import catalogs
+import order_legs
+import partitions
+import order_search
+from pairs import pair_catalog
 from rates import price_rub_for_symbol
-from sqlalchemy import func
+from sqlalchemy import func, case, and_, or_, select
 from datetime import datetime, timezone, timedelta
-from rates import price_rub_for_symbol, _get_binance_price, _get_mexc_price
+from rates import price_rub_for_symbol, price_rub_for_asset, price_rub_for_assets, cache_stats, breaker_stats, limiter_stats, provider_stats, stream_stats, rates_staleness, MIN_RUB_RATE
+from rates import price_stream, watch_assets
 from flask import session
 from rates import ICON_MAP, NAME_MAP, ALIAS
 from flask import abort
 import logging
+import click
+import time
 from datetime import timezone
 from datetime import datetime, timedelta
 
@@ -30,9 +41,22 @@ MSK = timezone.utc
 app = Flask(__name__)
 logging.basicConfig(level=logging.DEBUG)
 app.secret_key = "super_secret_key_123"
+app.teardown_appcontext(close_request_db)   # одна сессия БД на запрос (context.py)
 init_db()
 
 
+def watch_asset_pairs():
+    """Поток цен (RATES_STREAM=1) подписываем на пары всех активов до первых запросов."""
+    if price_stream is None:
+        return
+    with get_db() as db:
+        catalog = catalogs.catalog_cache.get(db, "assets")
+        watch_assets(catalog.rows, catalog.version)
+
+
+watch_asset_pairs()
+
+
 # ===== ВСПОМОГАТЕЛЬНЫЕ ФУНКЦИИ =====
 
 def get_or_create_service(db: Session, name: str):
@@ -241,7 +265,10 @@ def get_shift_report(db: Session, service_id: int):
     if not shift:
         return {"error": "Смена не найдена"}
 
-    orders = db.query(Order).filter(Order.shift_id == shift.id).all()
+    orders = db.query(Order).filter(
+        Order.shift_id == shift.id,
+        partitions.shift_window(Order.created_at, shift.start_time, shift.end_time),
+    ).all()
 
     totals = defaultdict(float)
     total_profit_rub = 0
@@ -277,6 +304,257 @@ def get_shift_report(db: Session, service_id: int):
     }
 
 
+# ===== СВОДКА ДАШБОРДА =====
+
+def dashboard_summary(db, service_id: int, shift) -> dict:
+    """
+    Итоги текущей смены: прибыль текущей и предыдущей смены, вводы/выводы
+    admin_io и переводы. Предыдущая смена — коротким запросом по индексу:
+    её начало ограничивает created_at, и PostgreSQL читает только месяцы
+    двух смен. Заявки выбираются в CTE и суммируются через CASE, без ORM.
+    """
+    shift_id = shift.id
+    prev_shift = db.execute(
+        select(Shift.id, Shift.start_time)
+        .where(Shift.service_id == service_id, Shift.id != shift_id)
+        .order_by(Shift.start_time.desc())
+        .limit(1)
+    ).first()
+    shift_ids = [shift_id] + ([prev_shift.id] if prev_shift else [])
+    starts = [s.start_time for s in (shift, prev_shift) if s is not None]
+    since = None if None in starts else min(starts)
+    shift_orders = (
+        select(
+            Order.shift_id, Order.type, Order.direction, Order.service_id,
+            Order.profit_rub, Order.amount, Order.rub_value,
+        )
+        .where(
+            Order.is_deleted == False,
+            Order.shift_id.in_(shift_ids),
+            partitions.shift_window(Order.created_at, since),
+        )
+        .cte("shift_orders")
+    )
+    o = shift_orders.c
+    current = o.shift_id == shift_id
+    transfer = and_(current, o.type == "internal_transfer", o.service_id == service_id)
+
+    def total(value, *conditions):
+        return func.coalesce(func.sum(case((and_(*conditions), value))), 0)
+
+    row = db.execute(
+        select(
+            total(o.profit_rub, current).label("current_profit"),
+            total(o.profit_rub, o.shift_id != shift_id).label("prev_profit"),
+            total(o.amount, current, o.type == "admin_io", o.direction == "in").label("inputs_sum"),
+            total(o.amount, current, o.type == "admin_io", o.direction == "out").label("outputs_sum"),
+            total(o.rub_value, transfer, o.rub_value.isnot(None)).label("transfers_sum"),
+            func.count(case((and_(transfer, o.rub_value.is_(None)), 1))).label("legacy_transfers"),
+        ).select_from(shift_orders)
+    ).one()
+    return row._asdict()
+
+
+def legacy_transfers_rub(db, service_id: int, shift) -> float:
+    """
+    Переводы, записанные до появления rub_value: сумма по активу
+    одним GROUP BY × курсы пачкой.
+    """
+    rows = (
+        db.query(
+            Order.received_asset_id,
+            func.sum(Order.received_amount),
+            Order.given_asset_id,
+            func.sum(Order.given_amount),
+        )
+        .filter(
+            Order.type == "internal_transfer",
+            Order.shift_id == shift.id,
+            partitions.shift_window(Order.created_at, shift.start_time),
+            Order.service_id == service_id,
+            Order.is_deleted == False,
+            Order.rub_value.is_(None),
+        )
+        .group_by(Order.received_asset_id, Order.given_asset_id)
+        .all()
+    )
+    rates = price_rub_for_asset_ids(
+        db, {r[0] for r in rows if r[0]} | {r[2] for r in rows if r[2]}
+    )
+    total = 0.0
+    for received_asset_id, received, given_asset_id, given in rows:
+        if received_asset_id and received and received > 0:
+            # этот сервис получил средства
+            total += received * (rates.get(received_asset_id) or 0)
+        if given_asset_id and given and given > 0:
+            # этот сервис отправил средства
+            total -= given * (rates.get(given_asset_id) or 0)
+    return total
+
+
+# ===== ЛЕНТА ЗАЯВОК: keyset-пагинация =====
+
+# параметры курсора в ссылках пейджера (не фильтры)
+PAGER_PARAMS = ("page", "per_page", "after", "before", "skip", "last")
+PAGER_WINDOW = 2          # ссылок по обе стороны от текущей страницы
+ORDER_COUNT_TTL = 60      # сек, сколько живёт посчитанное «N заявок»
+_order_counts = {}        # ключ фильтров -> (count, counted_at)
+
+
+def cached_order_count(query, key) -> int:
+    """COUNT(*) ленты с теми же фильтрами — не чаще раза в ORDER_COUNT_TTL."""
+    now = time.time()
+    cached = _order_counts.get(key)
+    if cached and now - cached[1] < ORDER_COUNT_TTL:
+        return cached[0]
+    if len(_order_counts) > 1000:
+        _order_counts.clear()
+    count = query.order_by(None).count()
+    _order_counts[key] = (count, now)
+    return count
+
+
+# строка ленты для index.html: только показываемые поля, имена — из JOIN, без ORM-объектов
+OrderRow = namedtuple("OrderRow", [
+    "id", "created_at", "type", "is_deleted", "shift_id", "user_id",
+    "received_asset_id", "received_amount", "given_asset_id", "given_amount",
+    "asset_id", "amount", "direction", "comment", "category_id",
+    "profit_percent", "profit_rub",
+    "category_name", "user_login", "received_symbol", "given_symbol",
+])
+ReceivedAsset = aliased(Asset, name="received_asset")
+GivenAsset = aliased(Asset, name="given_asset")
+
+
+def order_feed(query):
+    """
+    Та же лента, но одной выборкой колонок OrderRow: категория, оператор
+    и символы активов приходят JOIN'ом, а не ленивыми relationship на каждую строку.
+    """
+    columns = [getattr(Order, name) for name in OrderRow._fields[:-4]]
+    return (
+        query.with_entities(
+            *columns,
+            Category.name.label("category_name"),
+            User.login.label("user_login"),
+            ReceivedAsset.symbol.label("received_symbol"),
+            GivenAsset.symbol.label("given_symbol"),
+        )
+        .outerjoin(Category, Category.id == Order.category_id)
+        .outerjoin(User, User.id == Order.user_id)
+        .outerjoin(ReceivedAsset, ReceivedAsset.id == Order.received_asset_id)
+        .outerjoin(GivenAsset, GivenAsset.id == Order.given_asset_id)
+    )
+
+
+def keyset_page(query, per_page: int, after=None, before=None, skip: int = 0, last: bool = False,
+                last_size: int | None = None):
+    """
+    Страница ленты по Order.id desc без OFFSET от начала:
+    after — заявки старше id, before — новее id, last — самые старые.
+    skip — сдвиг от курсора (только соседние страницы окна пейджера).
+    last_size — сколько заявок на последней странице (остаток от COUNT).
+    Возвращает (orders, has_newer, has_older).
+    """
+    if last or before is not None:
+        size = last_size if last and last_size else per_page
+        q = query.order_by(Order.id.asc())
+        if before is not None:
+            q = q.filter(Order.id > before)
+        rows = q.offset(skip).limit(size + 1).all()
+        more = len(rows) > size
+        rows = rows[:size][::-1]
+        return rows, more, not last
+
+    q = query.order_by(Order.id.desc())
+    if after is not None:
+        q = q.filter(Order.id < after)
+    rows = q.offset(skip).limit(per_page + 1).all()
+    return rows[:per_page], after is not None, len(rows) > per_page
+
+
+def legacy_cursor(query, per_page: int, page: int) -> int | None:
+    """
+    id последней заявки перед страницей page — курсор after= для старой
+    ссылки ?page=N. OFFSET тут один раз: дальше ссылка идёт по курсору.
+    """
+    return (
+        query.with_entities(Order.id)
+        .order_by(Order.id.desc())
+        .offset((page - 1) * per_page - 1)
+        .limit(1)
+        .scalar()
+    )
+
+
+def ranked_page(query, rank, per_page: int, page: int):
+    """Страница выдачи по релевантности: порядок не по id, поэтому OFFSET (выдача поиска короткая)."""
+    rows = (
+        query.order_by(rank.desc(), Order.id.desc())
+        .offset((page - 1) * per_page)
+        .limit(per_page + 1)
+        .all()
+    )
+    return rows[:per_page], page > 1, len(rows) > per_page
+
+
+def _cursor(page: int, direction: str, order_id: int, skip: int) -> dict:
+    params = {"page": page, direction: order_id}
+    if skip:
+        params["skip"] = skip
+    return params
+
+
+def pager_links(page: int, per_page: int, total_pages: int, orders,
+                has_newer: bool, has_older: bool) -> list:
+    """
+    Окно ссылок вокруг текущей страницы: [(номер, параметры | None)].
+    Соседние страницы — от курсора текущей со сдвигом skip не больше
+    PAGER_WINDOW страниц; первая и последняя — без курсора.
+    Параметры None — текущая страница, номер None — многоточие.
+    """
+    if not orders:
+        return [(page, None)]
+    newest, oldest = orders[0].id, orders[-1].id
+    # число страниц по кэшированному COUNT может отставать от ленты
+    total_pages = max(total_pages, page + 1 if has_older else page)
+
+    links = []
+    first = max(1, page - PAGER_WINDOW) if has_newer else page
+    if first > 1:
+        links.append((1, {"page": 1}))
+        if first > 2:
+            links.append((None, None))
+    for p in range(first, page):
+        links.append((p, _cursor(p, "before", newest, (page - p - 1) * per_page)))
+    links.append((page, None))
+
+    last = min(total_pages, page + PAGER_WINDOW) if has_older else page
+    for p in range(page + 1, last + 1):
+        links.append((p, _cursor(p, "after", oldest, (p - page - 1) * per_page)))
+    if last < total_pages:
+        if last < total_pages - 1:
+            links.append((None, None))
+        links.append((total_pages, {"page": total_pages, "last": 1}))
+    return links
+
+
+def numbered_links(page: int, total_pages: int) -> list:
+    """То же окно, но ссылки ?page=N — для ranked_page."""
+    first, last = max(1, page - PAGER_WINDOW), min(total_pages, page + PAGER_WINDOW)
+    links = []
+    if first > 1:
+        links.append((1, {"page": 1}))
+        if first > 2:
+            links.append((None, None))
+    links += [(p, None if p == page else {"page": p}) for p in range(first, last + 1)]
+    if last < total_pages:
+        if last < total_pages - 1:
+            links.append((None, None))
+        links.append((total_pages, {"page": total_pages}))
+    return links
+
+
 # ===== FLASK ROUTES =====
 
 from sqlalchemy import func
@@ -287,21 +565,16 @@ def index():
         return redirect(url_for("login"))
 
     with get_db() as db:
-        user = db.query(User).get(session["user_id"])
+        ctx = request_context()
+        user = ctx.user
 
         # выбор сервиса (для админа — можно переключать, для оператора — всегда свой)
         selected_service_id = request.args.get("service_id", type=int)
-        if user.role == "operator":
-            service = db.query(Service).get(user.service_id)
-        else:
-            service = db.query(Service).get(selected_service_id) if selected_service_id else None
+        service = ctx.service
 
         # формируем запрос заказов
-        query = (
-            db.query(Order)
-            .outerjoin(User, User.id == Order.user_id)                # чтобы не терять ордера без user/service
-            .outerjoin(Service, Service.id == Order.service_id)       # привязываем сервис по полю в Order, а не через User
-        )
+        # фильтры — по самой orders; имена для таблицы добавляет order_feed()
+        query = db.query(Order)
 
         # ✅ показываем все типы операций (обмены, переводы, ввод/вывод)
         query = query.filter(Order.type.in_(["order", "admin_io", "internal_transfer", "admin_action", "admin_set"]))
@@ -318,100 +591,44 @@ def index():
 
         if request.args.get("asset_id"):
             asset_id = int(request.args["asset_id"])
-            query = query.filter(
-                (Order.received_asset_id == asset_id) |
-                (Order.given_asset_id == asset_id)
-            )
+            # по индексу order_legs вместо OR по received/given
+            query = query.filter(Order.id.in_(order_legs.orders_with_asset(asset_id)))
 
         if request.args.get("operator_id"):
             query = query.filter(Order.user_id == int(request.args["operator_id"]))
 
-        if request.args.get("comment"):
-            query = query.filter(Order.comment.ilike(f"%{request.args['comment']}%"))
+        # 🔹 поиск по комментарию: подстрока (pg_trgm) или слова с префиксом (tsvector)
+        search = request.args.get("comment", "").strip()
+        search_mode = request.args.get("search") if request.args.get("search") in order_search.MODES else "substring"
+        search_rank = None
+        if search:
+            dialect = db.get_bind().dialect.name
+            query = order_search.apply(query, search, search_mode, dialect)
+            if request.args.get("rank") == "1":
+                search_rank = order_search.rank(search, search_mode, dialect)
 
         # 🔹 фильтр по категории
         if request.args.get("category_id"):
             query = query.filter(Order.category_id == int(request.args["category_id"]))
 
-        # --- ✅ активная смена ---
-        current_shift = None
-        current_profit = 0.0
-        prev_profit = 0.0
-
-# --- Определяем текущую смену ДО расчета переводов ---
-        if service:
-            current_shift = (
-                db.query(Shift)
-                .filter(Shift.service_id == service.id, Shift.end_time.is_(None))
-                .order_by(Shift.start_time.desc())
-                .first()
-            )
-
-        # --- Получаем переводы между сервисами ---
-        # В функции index() замените проблемный блок:
-        transfers_sum = 0
-        if service and current_shift:  # Добавьте проверку на current_shift
-            internal_transfers = (
-                db.query(Order)
-                .filter(
-                    Order.type == "internal_transfer",
-                    Order.shift_id == current_shift.id,
-                    Order.is_deleted == False
-                )
-                .all()
-            )
-
-            # Простой вариант расчета переводов:
-            for t in internal_transfers:
-                if t.given_asset_id and t.given_amount > 0 and t.service_id == current_shift.service_id:
-                    # Этот сервис отправил средства
-                    rub_rate = price_rub_for_asset_id(db, t.given_asset_id) or 0
-                    transfers_sum -= t.given_amount * rub_rate
-                    
-                if t.received_asset_id and t.received_amount > 0 and t.service_id == current_shift.service_id:
-                    # Этот сервис получил средства
-                    rub_rate = price_rub_for_asset_id(db, t.received_asset_id) or 0
-                    transfers_sum += t.received_amount * rub_rate
-
-        if service:
-            current_shift = (
-                db.query(Shift)
-                .filter(Shift.service_id == service.id, Shift.end_time.is_(None))
-                .order_by(Shift.start_time.desc())
-                .first()
-            )
-
-            if current_shift:
-                # прибыль текущей смены
-                # прибыль текущей смены (только не удалённые заявки)
-                orders_in_shift = (
-                    db.query(Order)
-                    .filter(Order.shift_id == current_shift.id, Order.is_deleted == False)
-                    .all()
-                )
-                current_profit = sum(o.profit_rub or 0 for o in orders_in_shift)
-
-                # предыдущая смена (тоже только не удалённые)
-                prev_shift = (
-                    db.query(Shift)
-                    .filter(Shift.service_id == service.id, Shift.id != current_shift.id)
-                    .order_by(Shift.start_time.desc())
-                    .first()
-                )
-                if prev_shift:
-                    prev_orders = (
-                        db.query(Order)
-                        .filter(Order.shift_id == prev_shift.id, Order.is_deleted == False)
-                        .all()
-                    )
-                    prev_profit = sum(o.profit_rub or 0 for o in prev_orders)
+        # --- ✅ активная смена и её итоги ---
+        summary = dict(current_profit=0, prev_profit=0, inputs_sum=0, outputs_sum=0, transfers_sum=0)
+        current_shift = ctx.active_shift()
+        shift_user = catalogs.user(db, current_shift.started_by) if current_shift else None
+        if current_shift:
+            summary = dashboard_summary(db, service.id, current_shift)
+            if summary["legacy_transfers"]:
+                summary["transfers_sum"] += legacy_transfers_rub(db, service.id, current_shift)
 
         # 🔹 фильтр по смене (перенесён сюда, где уже есть current_shift)
         if request.args.get("my_shift") == "1" and current_shift:
-            query = query.filter(Order.shift_id == current_shift.id)
+            query = query.filter(
+                Order.shift_id == current_shift.id,
+                partitions.shift_window(Order.created_at, current_shift.start_time),
+            )
 
-        # --- ✅ пагинация ---
-        page = request.args.get("page", 1, type=int)
+        # --- ✅ пагинация: курсор по Order.id, без OFFSET от начала ленты ---
+        page = max(1, request.args.get("page", 1, type=int))
 
         # если per_page передан в запросе — сохраняем в сессии
         if "per_page" in request.args:
@@ -420,14 +637,41 @@ def index():
         # берём из сессии или дефолт
         per_page = session.get("per_page", 15)
 
-        total_orders = query.count()
-        orders = (
-            query.order_by(Order.id.desc())
-            .offset((page - 1) * per_page)
-            .limit(per_page)
-            .all()
-        )
-        total_pages = (total_orders + per_page - 1) // per_page
+        after = request.args.get("after", type=int)
+        before = request.args.get("before", type=int)
+        skip = min(max(0, request.args.get("skip", 0, type=int)), PAGER_WINDOW * per_page)
+        last = request.args.get("last") == "1"
+        args = {k: v for k, v in request.args.items() if k not in PAGER_PARAMS}  # фильтры без курсора
+
+        # старая ссылка ?page=N без курсора — один раз переводим на курсор after=
+        if search_rank is None and page > 1 and after is None and before is None and not last:
+            cursor = legacy_cursor(query, per_page, page)
+            if cursor is None:
+                return redirect(url_for("index", **args, last=1))
+            return redirect(url_for("index", **args, page=page, after=cursor))
+
+        filters = tuple(sorted(args.items()))
+        count_key = (user.id, service.id if service else None, filters)
+        total_orders = cached_order_count(query, count_key)
+        total_pages = max(1, (total_orders + per_page - 1) // per_page)
+
+        if search_rank is not None:
+            orders, has_newer, has_older = ranked_page(order_feed(query), search_rank, per_page, page)
+        else:
+            # на последней странице — остаток, а не полная страница самых старых
+            last_size = total_orders % per_page or per_page
+            orders, has_newer, has_older = keyset_page(order_feed(query), per_page, after, before, skip,
+                                                       last, last_size)
+        orders = [OrderRow._make(row) for row in orders]
+        if last:
+            page = total_pages
+        if search_rank is not None:
+            links = numbered_links(page, total_pages)
+        else:
+            links = pager_links(page, per_page, total_pages, orders, has_newer, has_older)
+        pager = [(p, params if params is None else {**args, **params}) for p, params in links]
+        pager_prev = next((params for p, params in pager if p == page - 1), None)
+        pager_next = next((params for p, params in pager if p == page + 1), None)
 
         # --- ✅ балансы ---
         balances = db.query(Balance, Asset).join(Asset, Balance.asset_id == Asset.id)
@@ -437,10 +681,11 @@ def index():
             balances = balances.filter(Balance.service_id == service.id)
         balances = balances.all()
 
-        services = db.query(Service).all()
-        all_users = db.query(User).all() if user.role == "admin" else [user]
-        assets = db.query(Asset).all()
-        categories = db.query(Category).all()   # 🔹 загружаем категории
+        # справочники — из кэша процесса (catalogs.py), БД читается только после изменений
+        services = catalogs.services(db)
+        all_users = catalogs.users(db) if user.role == "admin" else [user]
+        assets = catalogs.assets(db)
+        categories = catalogs.categories(db)   # 🔹 загружаем категории
 
         # --- ✅ топ-активы ---
         saved_top_assets = session.get("top_assets")
@@ -448,48 +693,12 @@ def index():
             # если уже редактировали — берём сохранённый список
             top_assets = saved_top_assets
         else:
-            # иначе считаем топ по использованию
-            asset_usage = (
-                db.query(
-                    Asset.id,
-                    func.count(Order.id).label("usage_count")
-                )
-                .outerjoin(Order, (Order.received_asset_id == Asset.id) | (Order.given_asset_id == Asset.id))
-                .group_by(Asset.id)
-                .all()
-            )
-            asset_usage_sorted = sorted(asset_usage, key=lambda x: x.usage_count, reverse=True)
-            top_assets = [a.id for a in asset_usage_sorted[:12]]
+            # иначе — самые используемые активы сервиса по счётчикам asset_usage,
+            # добитые остальными активами до TOP_ASSETS, как раньше
+            top_assets = asset_usage.top_assets(db, service.id if service else None)
+            top_assets += [a.id for a in assets if a.id not in top_assets][:asset_usage.TOP_ASSETS - len(top_assets)]
 
-        args = request.args.to_dict(flat=True)
-        args.pop("page", None)        # убираем текущую страницу
-        args.pop("per_page", None) 
-
-        # --- 💰 Вводы / выводы за текущую смену ---
-        # --- 💰 Вводы / выводы за текущую смену ---
-        inputs_sum = outputs_sum = 0
-        if current_shift:
-            inputs_sum = (
-                db.query(func.sum(Order.amount))
-                .filter(Order.type == "admin_io")
-                .filter(Order.direction == "in")
-                .filter(Order.shift_id == current_shift.id)
-                .filter(Order.is_deleted == False)  # ✅ добавлено
-                .scalar()
-                or 0
-            )
-
-            outputs_sum = (
-                db.query(func.sum(Order.amount))
-                .filter(Order.type == "admin_io")
-                .filter(Order.direction == "out")
-                .filter(Order.shift_id == current_shift.id)
-                .filter(Order.is_deleted == False)  # ✅ добавлено
-                .scalar()
-                or 0
-            )
-
-        usdt_asset = db.query(Asset).filter(Asset.symbol == "USDT").first()
+        usdt_asset = next((a for a in assets if a.symbol == "USDT"), None)
         usdt_manual_rate = usdt_asset.manual_rate if usdt_asset else None
 
         # --- рендер страницы ---
@@ -504,12 +713,16 @@ def index():
             all_users=all_users,
             categories=categories,
             current_shift=current_shift,
-            current_profit=round(current_profit) if current_profit else 0,
-            prev_profit=round(prev_profit) if prev_profit else 0,
-            inputs_sum=round(inputs_sum) if inputs_sum else 0,
-            outputs_sum=round(outputs_sum) if outputs_sum else 0,
+            shift_user=shift_user,
+            current_profit=round(summary["current_profit"]),
+            prev_profit=round(summary["prev_profit"]),
+            inputs_sum=round(summary["inputs_sum"]),
+            outputs_sum=round(summary["outputs_sum"]),
             page=page,
             total_pages=total_pages,
+            pager=pager,
+            pager_prev=pager_prev,
+            pager_next=pager_next,
             top_assets=top_assets,
             per_page=per_page,
             total_orders=total_orders,
@@ -518,7 +731,8 @@ def index():
             NAME_MAP=NAME_MAP,
             ALIAS=ALIAS,
             usdt_manual_rate=usdt_manual_rate,
-            transfers_sum=transfers_sum,
+            transfers_sum=summary["transfers_sum"],
+            rates_stale_age=rates_stale_age(db),
         )
 
 
@@ -529,33 +743,27 @@ def shift_start(service_id):
     if "user_id" not in session:
         return redirect(url_for("login"))
 
-    db = SessionLocal()
-    shift = start_shift(db, service_id, session["user_id"])
-    db.close()
+    shift = start_shift(request_db(), service_id, session["user_id"])
     return redirect(url_for("index"))
 
 
 @app.route("/shift/end/<int:service_id>")
 def shift_end(service_id):
-    db = SessionLocal()
-    end_shift(db, service_id)
-    db.close()
+    end_shift(request_db(), service_id)
     return redirect(url_for("index"))
 
 
 @app.route("/shift/report/<int:service_id>")
 def shift_report(service_id):
-    db = SessionLocal()
-    report = get_shift_report(db, service_id)
-    db.close()
-    return report
+    return get_shift_report(request_db(), service_id)
 
 @app.route("/add_order", methods=["POST"])
 
 @app.route("/add_order", methods=["POST"])
 def add_order():
     with get_db() as db:
-        user = db.query(User).get(session["user_id"])
+        ctx = request_context()
+        user = ctx.user
 
         if user.role == "operator":
             service_id = user.service_id
@@ -571,12 +779,7 @@ def add_order():
             flash("Нет доступного сервиса для создания заявки.", "error")
             return redirect(url_for("index"))
 
-        shift = (
-            db.query(Shift)
-            .filter(Shift.service_id == service_id, Shift.end_time.is_(None))
-            .order_by(Shift.start_time.desc())
-            .first()
-        )
+        shift = ctx.active_shift(service_id)
         if not shift:
             shift = Shift(
                 service_id=service_id,
@@ -599,10 +802,14 @@ def add_order():
         comment = request.form.get("comment", "").strip()
         category_id = request.form.get("category_id")
 
-        # --- курс входящего актива ---
-        recv_rub = price_rub_for_asset_id(db, received_asset_id)
-        # --- курс исходящего актива ---
-        give_rub = price_rub_for_asset_id(db, given_asset_id)
+        try:
+            # --- курс входящего актива ---
+            recv_rub = price_rub_for_asset_id(db, received_asset_id)
+            # --- курс исходящего актива ---
+            give_rub = price_rub_for_asset_id(db, given_asset_id)
+        except ValueError:
+            # ни одна биржа не дала правдоподобного курса
+            recv_rub = give_rub = None
 
         # --- проверка правильности курсов ---
         if recv_rub is None or give_rub is None:
@@ -615,7 +822,7 @@ def add_order():
             return redirect(url_for("index"))
 
         # Дополнительная проверка — если курс слишком маленький
-        if recv_rub < 0.01 or give_rub < 0.01:
+        if recv_rub < MIN_RUB_RATE or give_rub < MIN_RUB_RATE:
             flash("⛔ Ошибка: получен неправдоподобно низкий курс. Заявка не создана.", "error")
             return redirect(url_for("index"))
 
@@ -708,8 +915,8 @@ def shift_report_html():
     if "user_id" not in session:
         return redirect(url_for("login"))
 
-    db = SessionLocal()
-    user = db.query(User).get(session["user_id"])
+    db = request_db()
+    user = request_context().user
 
     # берём последнюю смену этого пользователя (или сервиса)
     shift = (
@@ -720,13 +927,15 @@ def shift_report_html():
     )
 
     if not shift:
-        db.close()
         return render_template("shift_report.html", shift=None, orders=[], balances=[])
 
     # заявки в этой смене
     orders = (
         db.query(Order)
-        .filter(Order.shift_id == shift.id)
+        .filter(
+            Order.shift_id == shift.id,
+            partitions.shift_window(Order.created_at, shift.start_time, shift.end_time),
+        )
         .order_by(Order.id.asc())
         .all()
     )
@@ -739,8 +948,6 @@ def shift_report_html():
         .all()
     )
 
-    db.close()
-
     return render_template(
         "shift_report.html",
         shift=shift,
@@ -754,7 +961,8 @@ def admin_action():
         return redirect(url_for("login"))
 
     with get_db() as db:
-        user = db.query(User).get(session["user_id"])
+        ctx = request_context()
+        user = ctx.user
         if user.role != "admin":
             flash("Нет прав", "error")
             return redirect(url_for("index"))
@@ -766,13 +974,17 @@ def admin_action():
         comment = request.form.get("comment", "")
         category_id = request.form.get("category_id")
 
-        asset = db.query(Asset).get(asset_id)
+        asset = catalogs.asset(db, asset_id)
         if not asset:
             flash("Актив не найден", "error")
             return redirect(url_for("index", service_id=service_id))
 
         # курс и сумма в рублях
-        rate_rub = price_rub_for_symbol(asset.symbol)
+        try:
+            rate_rub = price_rub_for_asset_id(db, asset_id)
+        except ValueError as e:
+            flash(str(e), "error")
+            return redirect(url_for("index", service_id=service_id))
         amount_rub = amount * rate_rub
 
         # обновляем баланс в ед. актива
@@ -807,12 +1019,7 @@ def admin_action():
         ))
 
         # привязываем к активной смене, если есть
-        current_shift = (
-            db.query(Shift)
-            .filter(Shift.service_id == service_id, Shift.end_time.is_(None))
-            .order_by(Shift.start_time.desc())
-            .first()
-        )
+        current_shift = ctx.active_shift(service_id)
 
         # полноценная запись
         order = Order(
@@ -846,8 +1053,9 @@ def internal_transfer():
     if "user_id" not in session:
         return redirect(url_for("login"))
 
-    db = SessionLocal()
-    user = db.query(User).get(session["user_id"])
+    db = request_db()
+    ctx = request_context()
+    user = ctx.user
 
     from_service_id = int(request.form["from_service_id"])
     to_service_id = int(request.form["to_service_id"])
@@ -857,22 +1065,17 @@ def internal_transfer():
     category_id = request.form.get("category_id")
 
     # 🔥 НАЙТИ АКТИВНЫЕ СМЕНЫ ДЛЯ ОБОИХ СЕРВИСОВ
-    from_shift = (
-        db.query(Shift)
-        .filter(Shift.service_id == from_service_id, Shift.end_time.is_(None))
-        .order_by(Shift.start_time.desc())
-        .first()
-    )
-    
-    to_shift = (
-        db.query(Shift)
-        .filter(Shift.service_id == to_service_id, Shift.end_time.is_(None))
-        .order_by(Shift.start_time.desc())
-        .first()
-    )
+    from_shift = ctx.active_shift(from_service_id)
+    to_shift = ctx.active_shift(to_service_id)
 
     transfer_group = int(datetime.now(MSK).timestamp() * 1000)
 
+    # рублёвая стоимость перевода — один раз при записи, дашборд её только суммирует
+    try:
+        rub_value = amount * price_rub_for_asset_id(db, asset_id)
+    except (ValueError, TypeError):
+        rub_value = None  # курса нет — дашборд оценит перевод по текущему курсу
+
     from_balance = db.query(Balance).filter_by(service_id=from_service_id, asset_id=asset_id).first()
     if not from_balance:
         from_balance = Balance(service_id=from_service_id, asset_id=asset_id, amount=0)
@@ -915,6 +1118,7 @@ def internal_transfer():
         given_asset_id=asset_id,
         given_amount=amount,
         transfer_group=transfer_group,
+        rub_value=-rub_value if rub_value is not None else None,
         comment=comment or f"Перевод {amount} актива в сервис {to_service_id}",
         category_id=int(category_id) if category_id else None,
         rate_at_creation={
@@ -935,6 +1139,7 @@ def internal_transfer():
         received_asset_id=asset_id,
         received_amount=amount,
         transfer_group=transfer_group,
+        rub_value=rub_value,
         comment=comment or f"Перевод {amount} актива из сервиса {from_service_id}",
         category_id=int(category_id) if category_id else None,
         rate_at_creation={
@@ -946,17 +1151,15 @@ def internal_transfer():
     db.add(order_in)
 
     db.commit()
-    db.close()
     return redirect(url_for("index"))
 
 
 
 @app.route("/users")
 def users_list():
-    db = SessionLocal()
+    db = request_db()
     users = db.query(User).options(joinedload(User.service)).all()
-    services = db.query(Service).all()
-    db.close()
+    services = catalogs.services(db)
     return render_template("users.html", users=users, services=services)
 
 
@@ -970,11 +1173,10 @@ def add_user():
     role = request.form["role"]
     service_id = request.form.get("service_id")
 
-    db = SessionLocal()
+    db = request_db()
 
     # если оператор, но сервис не выбран
     if role == "operator" and not service_id:
-        db.close()
         return "Ошибка: оператор должен быть привязан к сервису", 400
 
     new_user = User(
@@ -985,7 +1187,6 @@ def add_user():
     )
     db.add(new_user)
     db.commit()
-    db.close()
     return redirect(url_for("users_list"))  
 
 @app.route("/users/edit/<int:user_id>", methods=["POST"])
@@ -993,7 +1194,7 @@ def edit_user(user_id):
     if session.get("role") != "admin":
         return redirect(url_for("index"))
 
-    db = SessionLocal()
+    db = request_db()
     user = db.query(User).get(user_id)
 
     if user:
@@ -1005,7 +1206,6 @@ def edit_user(user_id):
             user.password_hash = generate_password_hash(request.form["password"])
 
         db.commit()
-    db.close()
     return redirect(url_for("users_list"))
 
 @app.route("/users/delete/<int:user_id>", methods=["POST"])
@@ -1013,19 +1213,18 @@ def delete_user(user_id):
     if session.get("role") != "admin":
         return redirect(url_for("index"))
 
-    db = SessionLocal()
+    db = request_db()
     user = db.query(User).get(user_id)
     if user:
         db.delete(user)
         db.commit()
-    db.close()
     return redirect(url_for("users_list"))
 
 @app.route("/set_shift", methods=["POST"])
 def set_shift():
     # менеджер контекста из db.py
     with get_db() as db:
-        user = db.query(User).get(session["user_id"])
+        user = request_context().user
         if not user:
             return redirect(url_for("login"))
 
@@ -1061,23 +1260,78 @@ def set_shift():
 
     return redirect(url_for("index"))
 
+# снимок от воркера rates считается актуальным не дольше этого времени
+RATE_SNAPSHOT_MAX_AGE = timedelta(minutes=2)
+
+
+def latest_rate_snapshot(db) -> RateSnapshot | None:
+    """Последний свежий снимок курсов (один запрос на сессию БД)."""
+    if "rate_snapshot" not in db.info:
+        snapshot = db.query(RateSnapshot).order_by(RateSnapshot.id.desc()).first()
+        if snapshot and datetime.utcnow() - snapshot.taken_at > RATE_SNAPSHOT_MAX_AGE:
+            snapshot = None  # воркер не работает — снимку не доверяем
+        db.info["rate_snapshot"] = snapshot
+    return db.info["rate_snapshot"]
+
+
+def rates_stale_age(db) -> float | None:
+    """
+    Сколько секунд курсам, если провайдеры недоступны и считаем по последним
+    проверенным (в этом процессе или у воркера rates). None — всё свежее.
+    """
+    snapshot = latest_rate_snapshot(db)
+    ages = [age for age in (rates_staleness(), snapshot and snapshot.stale_age) if age]
+    return max(ages) if ages else None
+
+
 def price_rub_for_asset_id(db, asset_id: int) -> float | None:
-    asset = db.query(Asset).get(asset_id)
+    asset = catalogs.asset(db, asset_id)
     if not asset:
         return None
 
-    # 1. если зафиксированный курс
+    # ручной курс меняется сразу, не дожидаясь следующего снимка
     if asset.manual_rate is not None:
         return asset.manual_rate
 
-    # 2. если указана торговая пара
-    if asset.pair_symbol:
-        px = _get_binance_price(asset.pair_symbol) or _get_mexc_price(asset.pair_symbol)
-        if px:
-            return float(px) * price_rub_for_symbol("USDT")
+    # общий файл воркера rates — без запросов к БД
+    shared = rate_store.get(asset_id, max_age=RATE_SNAPSHOT_MAX_AGE.total_seconds())
+    if shared:
+        return shared.rub_price
+
+    snapshot = latest_rate_snapshot(db)
+    if snapshot and str(asset_id) in snapshot.rates:
+        return snapshot.rates[str(asset_id)]
+
+    # снимка нет — считаем сами
+    return price_rub_for_asset(asset)
+
+
+def price_rub_for_asset_ids(db, asset_ids) -> dict[int, float]:
+    """Курсы многих активов: ручные, из снимка, остальные — одним проходом по графу."""
+    asset_ids = set(asset_ids)
+    if not asset_ids:
+        return {}
+
+    catalog = catalogs.catalog_cache.get(db, "assets")
+    result = {a.id: a.manual_rate for a in catalog.rows if a.id in asset_ids and a.manual_rate is not None}
 
-    # 3. старое поведение (через symbol)
-    return price_rub_for_symbol(asset.symbol)
+    max_age = RATE_SNAPSHOT_MAX_AGE.total_seconds()
+    for asset_id in asset_ids - result.keys():
+        shared = rate_store.get(asset_id, max_age=max_age)
+        if shared:
+            result[asset_id] = shared.rub_price
+
+    snapshot = latest_rate_snapshot(db) if asset_ids - result.keys() else None
+    if snapshot:
+        for asset_id in asset_ids - result.keys():
+            if str(asset_id) in snapshot.rates:
+                result[asset_id] = snapshot.rates[str(asset_id)]
+
+    missing = asset_ids - result.keys()
+    if missing:
+        # граф строится по всему справочнику и кэшируется до смены его версии
+        result.update(price_rub_for_assets(catalog.rows, missing, catalog.version))
+    return result
 
 
 @app.route("/admin_io", methods=["POST"])
@@ -1086,7 +1340,8 @@ def admin_io():
         return redirect(url_for("login"))
 
     with get_db() as db:
-        user = db.query(User).get(session["user_id"])
+        ctx = request_context()
+        user = ctx.user
         if user.role not in ["admin", "operator"]:
             flash("Нет прав", "error")
             return redirect(url_for("index"))
@@ -1099,25 +1354,22 @@ def admin_io():
         category_id = request.form.get("category_id")
 
         # --- 💰 Пересчёт суммы в рубли ---
-        asset = db.query(Asset).get(asset_id)
+        asset = catalogs.asset(db, asset_id)
         if not asset:
             flash("Актив не найден", "error")
             return redirect(url_for("index", service_id=service_id))
 
         # --- 💰 Пересчёт суммы в рубли ---
-        asset = db.query(Asset).get(asset_id)
+        asset = catalogs.asset(db, asset_id)
         if not asset:
             flash("Актив не найден", "error")
             return redirect(url_for("index", service_id=service_id))
 
         # --- безопасное определение курса ---
-        if asset.manual_rate and asset.manual_rate > 0:
-            rate_rub = asset.manual_rate
-        else:
-            try:
-                rate_rub = price_rub_for_symbol(asset.symbol)
-            except Exception:
-                rate_rub = 1  # fallback — если курса нет
+        try:
+            rate_rub = price_rub_for_asset_id(db, asset_id) or 1
+        except Exception:
+            rate_rub = 1  # fallback — если курса нет
 
         amount_rub = amount * rate_rub
 
@@ -1143,12 +1395,7 @@ def admin_io():
             created_at=datetime.utcnow()
         ))
 
-        current_shift = (
-            db.query(Shift)
-            .filter(Shift.service_id == service_id, Shift.end_time.is_(None))
-            .order_by(Shift.start_time.desc())
-            .first()
-        )
+        current_shift = ctx.active_shift(service_id)
 
         order = Order(
             service_id=service_id,
@@ -1188,7 +1435,7 @@ def add_asset():
     service_id = int(request.form["service_id"])
 
     # новые поля из формы
-    pair_symbol = request.form.get("pair_symbol") or None
+    pair_symbol = (request.form.get("pair_symbol") or "").strip().upper() or None
     manual_rate = request.form.get("manual_rate")
     manual_rate = float(manual_rate) if manual_rate else None
 
@@ -1230,6 +1477,45 @@ def initdb():
 
 
 
+@app.cli.command("backfill-asset-usage")
+def backfill_asset_usage():
+    """Пересчитать счётчики asset_usage по всем заявкам."""
+    with get_db() as db:
+        print(f"asset_usage: {asset_usage.backfill(db)} строк")
+
+
+@app.cli.command("backfill-order-legs")
+def backfill_order_legs():
+    """Пересобрать order_legs по всем заявкам."""
+    with get_db() as db:
+        print(f"order_legs: {order_legs.backfill(db)} строк")
+
+
+@app.cli.command("check-balances")
+def check_balances():
+    """Сверить balances с суммой сторон живых заявок (order_legs)."""
+    with get_db() as db:
+        mismatches = order_legs.balance_mismatches(db)
+    for service_id, asset_id, stored, replayed in mismatches:
+        print(f"сервис {service_id}, актив {asset_id}: в balances {stored}, по заявкам {replayed}")
+    print(f"расхождений: {len(mismatches)}")
+
+
+@app.cli.command("partitions")
+@click.option("--ahead", default=partitions.AHEAD_MONTHS, show_default=True,
+              help="на сколько месяцев вперёд создать партиции")
+@click.option("--keep-months", type=int, default=None,
+              help="отцепить партиции старше стольких месяцев (по умолчанию — не трогать)")
+def maintain_partitions(ahead, keep_months):
+    """Создать будущие помесячные партиции orders / balances_history и отцепить старые."""
+    with get_db() as db:
+        done = partitions.maintain(db.connection(), ahead=ahead, keep_months=keep_months)
+        db.commit()
+    for line in done:
+        print(line)
+    print(f"партиции: {len(done)} изменений")
+
+
 @app.route("/update_top_assets", methods=["POST"])
 def update_top_assets():
     data = request.get_json()
@@ -1244,7 +1530,8 @@ def delete_order(order_id):
         return redirect(url_for("login"))
 
     with get_db() as db:
-        user = db.query(User).get(session["user_id"])
+        ctx = request_context()
+        user = ctx.user
         order = db.query(Order).get(order_id)
 
         if not order:
@@ -1256,11 +1543,7 @@ def delete_order(order_id):
 
         # 🔒 оператор может удалять только свои заявки в текущей смене
         if user.role == "operator":
-            current_shift = (
-                db.query(Shift)
-                .filter(Shift.service_id == user.service_id, Shift.end_time.is_(None))
-                .first()
-            )
+            current_shift = ctx.active_shift(user.service_id)
             if not current_shift or order.shift_id != current_shift.id or order.user_id != user.id:
                 abort(403)
 
@@ -1315,7 +1598,7 @@ def categories_list():
     if "user_id" not in session:
         return redirect(url_for("login"))
     with get_db() as db:
-        user = db.query(User).get(session["user_id"])
+        user = request_context().user
         if user.role != "admin":
             flash("Доступ запрещён", "error")
             return redirect(url_for("index"))
@@ -1327,7 +1610,7 @@ def categories_list():
 @app.route("/categories/add", methods=["POST"])
 def add_category():
     with get_db() as db:
-        user = db.query(User).get(session["user_id"])
+        user = request_context().user
         if user.role != "admin":
             return {"error": "forbidden"}, 403
 
@@ -1342,7 +1625,7 @@ def add_category():
 @app.route("/categories/delete/<int:category_id>", methods=["POST"])
 def delete_category(category_id):
     with get_db() as db:
-        user = db.query(User).get(session["user_id"])
+        user = request_context().user
         if user.role != "admin":
             return {"error": "forbidden"}, 403
 
@@ -1356,16 +1639,15 @@ def delete_category(category_id):
 
 @app.route("/api/pairs")
 def get_pairs():
-    import requests
     from flask import jsonify
 
-    try:
-        r = requests.get("https://api.binance.com/api/v3/exchangeInfo", timeout=5)
-        data = r.json()
-        symbols = [s["symbol"] for s in data["symbols"] if s["status"] == "TRADING"]
-        return jsonify(symbols)
-    except Exception as e:
-        return jsonify({"error": str(e)}), 500
+    # ?q=BT&limit=20 — поиск по закэшированному каталогу пар Binance + MEXC
+    query = request.args.get("q", "")
+    limit = max(1, min(request.args.get("limit", 20, type=int), 500))
+
+    if not pair_catalog.ensure_fresh():
+        return jsonify({"error": "Не удалось загрузить список пар"}), 500
+    return jsonify(pair_catalog.search(query, limit))
 
 @app.route("/admin_set_balance", methods=["POST"])
 def admin_set_balance():
@@ -1373,7 +1655,7 @@ def admin_set_balance():
         return redirect(url_for("login"))
 
     with get_db() as db:
-        user = db.query(User).get(session["user_id"])
+        user = request_context().user
         if user.role != "admin":
             flash("Нет прав", "error")
             return redirect(url_for("index"))
@@ -1423,13 +1705,38 @@ def admin_set_balance():
 
     return redirect(url_for("index", service_id=service_id))
 
+def order_rates_as_of(db, order, old_received_asset, old_given_asset):
+    """
+    Курсы сторон заявки на момент её создания — правка старой заявки
+    не должна пересчитывать прибыль по сегодняшним ценам.
+    Актив не менялся → курс, сохранённый при создании; иначе rate_history;
+    истории нет (свежая установка) → текущий курс.
+    """
+    sides = [
+        (order.received_asset_id, old_received_asset, order.rate_at_creation),
+        (order.given_asset_id, old_given_asset, order.rate_at_execution),
+    ]
+    history = rates_as_of(db, [(asset_id, order.created_at) for asset_id, _, _ in sides])
+
+    result = []
+    for asset_id, old_asset_id, saved in sides:
+        if asset_id == old_asset_id and isinstance(saved, (int, float)) and saved > 0:
+            result.append(saved)
+        elif (asset_id, order.created_at) in history:
+            result.append(history[(asset_id, order.created_at)])
+        else:
+            result.append(price_rub_for_asset_id(db, asset_id) if asset_id else None)
+    return result
+
+
 @app.route("/edit_order/<int:order_id>", methods=["POST"])
 def edit_order(order_id):
     if "user_id" not in session:
         return redirect(url_for("login"))
 
     with get_db() as db:
-        user = db.query(User).get(session["user_id"])
+        ctx = request_context()
+        user = ctx.user
         order = db.query(Order).get(order_id)
 
         if not order:
@@ -1438,11 +1745,7 @@ def edit_order(order_id):
 
         # оператор может редактировать только свои заявки и только в своей смене
         if user.role == "operator":
-            current_shift = (
-                db.query(Shift)
-                .filter(Shift.service_id == user.service_id, Shift.end_time.is_(None))
-                .first()
-            )
+            current_shift = ctx.active_shift(user.service_id)
             if not current_shift or order.shift_id != current_shift.id or order.user_id != user.id:
                 flash("⛔ Вы можете редактировать только свои заявки в текущей смене", "error")
                 return redirect(url_for("index"))
@@ -1461,10 +1764,16 @@ def edit_order(order_id):
         order.comment = request.form.get("comment")
         order.category_id = request.form.get("category_id", type=int)
 
-        # --- пересчёт прибыли ---
-        recv_rub = price_rub_for_asset_id(db, order.received_asset_id)
-        give_rub = price_rub_for_asset_id(db, order.given_asset_id)
+        # --- пересчёт прибыли по курсам на момент создания заявки ---
+        try:
+            recv_rub, give_rub = order_rates_as_of(
+                db, order, old_received_asset, old_given_asset
+            )
+        except ValueError:
+            recv_rub = give_rub = None  # курса нет — прибыль не считаем
         if recv_rub and give_rub:
+            order.rate_at_creation = recv_rub
+            order.rate_at_execution = give_rub
             value_in = (order.received_amount or 0) * recv_rub
             value_out = (order.given_amount or 0) * give_rub
             order.profit_rub = value_in - value_out
@@ -1621,7 +1930,7 @@ def delete_asset(asset_id):
         return redirect(url_for("login"))
 
     with get_db() as db:
-        user = db.get(User, user_id)
+        user = request_context().user
         if not user or user.role != "admin":
             return "Forbidden", 403
 
@@ -1674,7 +1983,7 @@ def admin_analytics():
 
     with get_db() as db:
         # 🔹 Проверка прав
-        user = db.get(User, session["user_id"])
+        user = request_context().user
         if not user or user.role != "admin":
             flash("Нет доступа", "error")
             return redirect(url_for("index"))
@@ -1727,10 +2036,13 @@ def admin_analytics():
         operators = []
 
         if selected_shift:
+            in_shift = partitions.shift_window(
+                Order.created_at, selected_shift.start_time, selected_shift.end_time
+            )
             # заявки в смене
             orders = (
                 db.query(Order)
-                .filter(Order.shift_id == selected_shift.id, Order.is_deleted == False)
+                .filter(Order.shift_id == selected_shift.id, in_shift, Order.is_deleted == False)
                 .all()
             )
 
@@ -1749,7 +2061,7 @@ def admin_analytics():
             operators = (
                 db.query(User.login)
                 .join(Order, Order.user_id == User.id)
-                .filter(Order.shift_id == selected_shift.id, Order.is_deleted == False)
+                .filter(Order.shift_id == selected_shift.id, in_shift, Order.is_deleted == False)
                 .distinct()
                 .all()
             )
@@ -1781,7 +2093,11 @@ def admin_analytics():
                 # вычисляем данные по каждой смене
                 orders_in_shift = (
                     db.query(Order)
-                    .filter(Order.shift_id == sh.id, Order.is_deleted == False)
+                    .filter(
+                        Order.shift_id == sh.id,
+                        partitions.shift_window(Order.created_at, sh.start_time, sh.end_time),
+                        Order.is_deleted == False,
+                    )
                     .all()
                 )
 
@@ -1815,7 +2131,7 @@ def admin_delete_shift(shift_id):
         return redirect(url_for("login"))
 
     with get_db() as db:
-        user = db.get(User, session["user_id"])
+        user = request_context().user
         if not user or user.role != "admin":
             flash("Нет доступа", "error")
             return redirect(url_for("index"))
@@ -1833,6 +2149,26 @@ def admin_delete_shift(shift_id):
         return redirect(url_for("admin_analytics", service_id=shift.service_id))
 
 
+@app.route("/admin/rates/stats")
+def admin_rates_stats():
+    if "user_id" not in session:
+        return redirect(url_for("login"))
+
+    with get_db() as db:
+        user = request_context().user
+        if not user or user.role != "admin":
+            return "Forbidden", 403
+
+    # статистика кэша курсов, предохранителей, лимитов, табло провайдеров и потока цен этого воркера
+    return {
+        "cache": cache_stats(),
+        "breakers": breaker_stats(),
+        "limits": limiter_stats(),
+        "providers": provider_stats(),
+        "stream": stream_stats(),
+    }
+
+
 @app.route("/set_manual_usdt_rate", methods=["POST"])
 def set_manual_usdt_rate():
     if "user_id" not in session:
@@ -1861,7 +2197,7 @@ def delete_transfer(order_id):
         return redirect(url_for("login"))
 
     with get_db() as db:
-        user = db.query(User).get(session["user_id"])
+        user = request_context().user
         if not user:
             flash("Пользователь не найден", "error")
             return redirect(url_for("index"))
@@ -0,0 +1,70 @@
+"""order legs
+
+Revision ID: 0a9e3d5c7b21
+Revises: f6c2d8a1b347
+Create Date: 2026-10-18 21:14:37.520918
+
+"""
+from typing import Sequence, Union
+
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision: str = '0a9e3d5c7b21'
+down_revision: Union[str, Sequence[str], None] = 'f6c2d8a1b347'
+branch_labels: Union[str, Sequence[str], None] = None
+depends_on: Union[str, Sequence[str], None] = None
+
+
+def upgrade() -> None:
+    """Upgrade schema."""
+    op.create_table(
+        'order_legs',
+        sa.Column('id', sa.Integer(), nullable=False),
+        sa.Column('order_id', sa.Integer(), nullable=False),
+        sa.Column('service_id', sa.Integer(), nullable=True),
+        sa.Column('asset_id', sa.Integer(), nullable=False),
+        sa.Column('signed_amount', sa.Float(), nullable=False),
+        sa.Column('rub_value', sa.Float(), nullable=True),
+        sa.Column('is_deleted', sa.Boolean(), nullable=False),
+        sa.ForeignKeyConstraint(['order_id'], ['orders.id'], ondelete='CASCADE'),
+        sa.ForeignKeyConstraint(['service_id'], ['services.id'], ondelete='CASCADE'),
+        sa.ForeignKeyConstraint(['asset_id'], ['assets.id'], ondelete='CASCADE'),
+        sa.PrimaryKeyConstraint('id'),
+    )
+    # начальное заполнение по всем заявкам (то же, что backfill-order-legs / order_legs.legs_for)
+    op.execute("""
+        INSERT INTO order_legs (order_id, service_id, asset_id, signed_amount, rub_value, is_deleted)
+        SELECT id, service_id, received_asset_id, COALESCE(received_amount, 0),
+               CASE
+                   WHEN type = 'order' AND json_typeof(rate_at_creation) = 'number'
+                       THEN COALESCE(received_amount, 0) * (rate_at_creation::text)::float
+                   WHEN type = 'internal_transfer' THEN rub_value
+                   WHEN type IN ('admin_io', 'admin_action') THEN amount
+               END,
+               COALESCE(is_deleted, false)
+        FROM orders WHERE received_asset_id IS NOT NULL
+        UNION ALL
+        SELECT id, service_id, given_asset_id, -COALESCE(given_amount, 0),
+               CASE
+                   WHEN type = 'order' AND json_typeof(rate_at_execution) = 'number'
+                       THEN -COALESCE(given_amount, 0) * (rate_at_execution::text)::float
+                   WHEN type = 'internal_transfer' THEN rub_value
+                   WHEN type IN ('admin_io', 'admin_action') THEN -COALESCE(amount, 0)
+               END,
+               COALESCE(is_deleted, false)
+        FROM orders WHERE given_asset_id IS NOT NULL
+    """)
+    op.create_index('ix_order_legs_order', 'order_legs', ['order_id'])
+    op.create_index('ix_order_legs_asset_service_order', 'order_legs', ['asset_id', 'service_id', 'order_id'])
+    op.create_index('ix_order_legs_service_asset', 'order_legs', ['service_id', 'asset_id'])
+
+
+def downgrade() -> None:
+    """Downgrade schema."""
+    op.drop_index('ix_order_legs_service_asset', table_name='order_legs')
+    op.drop_index('ix_order_legs_asset_service_order', table_name='order_legs')
+    op.drop_index('ix_order_legs_order', table_name='order_legs')
+    op.drop_table('order_legs')
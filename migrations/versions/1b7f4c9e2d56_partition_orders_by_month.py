@@ -0,0 +1,134 @@
+"""partition orders and balances_history by month
+
+Revision ID: 1b7f4c9e2d56
+Revises: 0a9e3d5c7b21
+Create Date: 2026-10-18 22:02:48.317205
+
+"""
+from datetime import datetime
+from typing import Sequence, Union
+
+from alembic import op
+import sqlalchemy as sa
+
+import partitions
+
+
+# revision identifiers, used by Alembic.
+revision: str = '1b7f4c9e2d56'
+down_revision: Union[str, Sequence[str], None] = '0a9e3d5c7b21'
+branch_labels: Union[str, Sequence[str], None] = None
+depends_on: Union[str, Sequence[str], None] = None
+
+# внешние ключи и индексы пересоздаются на новой (партиционированной) таблице
+TABLES = {
+    'orders': {
+        'fill_created_at': """
+            UPDATE orders SET created_at = COALESCE(
+                (SELECT start_time FROM shifts WHERE shifts.id = orders.shift_id), now()
+            ) WHERE created_at IS NULL
+        """,
+        'foreign_keys': [
+            ('orders_service_id_fkey', 'service_id', 'services', ''),
+            ('orders_user_id_fkey', 'user_id', 'users', ''),
+            ('orders_shift_id_fkey', 'shift_id', 'shifts', ''),
+            ('orders_received_asset_id_fkey', 'received_asset_id', 'assets', 'ON DELETE SET NULL'),
+            ('orders_given_asset_id_fkey', 'given_asset_id', 'assets', 'ON DELETE SET NULL'),
+            ('orders_asset_id_fkey', 'asset_id', 'assets', 'ON DELETE SET NULL'),
+            ('orders_category_id_fkey', 'category_id', 'categories', ''),
+        ],
+        'indexes': {
+            'ix_orders_service_id_desc': 'ON orders (service_id, id DESC)',
+            'ix_orders_shift_deleted': 'ON orders (shift_id, is_deleted)',
+            'ix_orders_type_shift_direction': 'ON orders (type, shift_id, direction) WHERE is_deleted = false',
+            'ix_orders_transfer_group': 'ON orders (transfer_group) WHERE is_deleted = false',
+            'ix_orders_comment_trgm': 'ON orders USING gin (comment gin_trgm_ops)',
+            'ix_orders_comment_tsv': 'ON orders USING gin (comment_tsv)',
+        },
+    },
+    'balances_history': {
+        'fill_created_at': "UPDATE balances_history SET created_at = now() WHERE created_at IS NULL",
+        'foreign_keys': [
+            ('balances_history_service_id_fkey', 'service_id', 'services', ''),
+            ('balances_history_asset_id_fkey', 'asset_id', 'assets', 'ON DELETE SET NULL'),
+        ],
+        'indexes': {
+            'ix_balances_history_service_asset_created':
+                'ON balances_history (service_id, asset_id, created_at)',
+        },
+    },
+}
+
+# ссылки на orders.id: у партиционированной orders ключ (id, created_at)
+ORDER_REFERENCES = [
+    ('balances_history', 'balances_history_order_id_fkey', ''),
+    ('order_legs', 'order_legs_order_id_fkey', 'ON DELETE CASCADE'),
+]
+
+
+def _columns(bind, table: str) -> str:
+    names = bind.execute(sa.text("""
+        SELECT column_name FROM information_schema.columns
+        WHERE table_name = :table AND table_schema = current_schema() AND is_generated = 'NEVER'
+        ORDER BY ordinal_position
+    """), {'table': table}).scalars()
+    return ', '.join(f'"{name}"' for name in names)
+
+
+def _rebuild(table: str, spec: dict, partitioned: bool) -> None:
+    """Пересоздать таблицу (партиционированной или обычной) и перелить в неё строки."""
+    bind = op.get_bind()
+    old = f'{table}_old'
+    op.execute(f'ALTER TABLE {table} RENAME TO {old}')
+    op.execute(f'ALTER INDEX {table}_pkey RENAME TO {old}_pkey')
+    for name in spec['indexes']:
+        op.execute(f'DROP INDEX IF EXISTS {name}')
+    sequence = bind.scalar(sa.text(f"SELECT pg_get_serial_sequence('{old}', 'id')"))
+
+    partition_by = f' PARTITION BY RANGE ({partitions.PARTITION_KEY})' if partitioned else ''
+    op.execute(f'CREATE TABLE {table} (LIKE {old} INCLUDING DEFAULTS INCLUDING GENERATED){partition_by}')
+    key = f'id, {partitions.PARTITION_KEY}' if partitioned else 'id'
+    op.execute(f'ALTER TABLE {table} ADD CONSTRAINT {table}_pkey PRIMARY KEY ({key})')
+    for name, column, target, action in spec['foreign_keys']:
+        op.execute(f'ALTER TABLE {table} ADD CONSTRAINT {name} '
+                   f'FOREIGN KEY ({column}) REFERENCES {target} (id) {action}')
+
+    if partitioned:
+        partitions.ensure_default(bind, table)
+        first = bind.scalar(sa.text(f'SELECT min({partitions.PARTITION_KEY}) FROM {old}'))
+        current = partitions.month_start(datetime.now())
+        month = partitions.month_start(first) if first else current
+        while month <= partitions.add_months(current, partitions.AHEAD_MONTHS):
+            partitions.ensure_month(bind, table, month)
+            month = partitions.add_months(month, 1)
+
+    for name, definition in spec['indexes'].items():
+        op.execute(f'CREATE INDEX {name} {definition}')
+
+    columns = _columns(bind, old)
+    op.execute(f'INSERT INTO {table} ({columns}) SELECT {columns} FROM {old}')
+    if sequence:
+        op.execute(f'ALTER SEQUENCE {sequence} OWNED BY {table}.id')
+    op.execute(f'DROP TABLE {old}')
+
+
+def upgrade() -> None:
+    """Upgrade schema."""
+    for table, name, _ in ORDER_REFERENCES:
+        op.execute(f'ALTER TABLE {table} DROP CONSTRAINT IF EXISTS {name}')
+    for table, spec in TABLES.items():
+        op.execute(spec['fill_created_at'])
+        op.alter_column(table, 'created_at', existing_type=sa.DateTime(), nullable=False)
+        _rebuild(table, spec, partitioned=True)
+
+
+def downgrade() -> None:
+    """Downgrade schema."""
+    # строки переливаются из прикреплённых партиций; отцеплённые (архивные) остаются как есть
+    for table, spec in TABLES.items():
+        _rebuild(table, spec, partitioned=False)
+        op.alter_column(table, 'created_at', existing_type=sa.DateTime(), nullable=True)
+    for table, name, action in ORDER_REFERENCES:
+        # NOT VALID: строки могут ссылаться на заявки из отцеплённых партиций
+        op.execute(f'ALTER TABLE {table} ADD CONSTRAINT {name} '
+                   f'FOREIGN KEY (order_id) REFERENCES orders (id) {action} NOT VALID')
@@ -0,0 +1,28 @@
+"""rate snapshot stale age
+
+Revision ID: 3c9e1f7a2b64
+Revises: ea5b2a4514ef
+Create Date: 2026-10-18 14:05:11.402817
+
+"""
+from typing import Sequence, Union
+
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision: str = '3c9e1f7a2b64'
+down_revision: Union[str, Sequence[str], None] = 'ea5b2a4514ef'
+branch_labels: Union[str, Sequence[str], None] = None
+depends_on: Union[str, Sequence[str], None] = None
+
+
+def upgrade() -> None:
+    """Upgrade schema."""
+    op.add_column('rate_snapshots', sa.Column('stale_age', sa.Float(), nullable=True))
+
+
+def downgrade() -> None:
+    """Downgrade schema."""
+    op.drop_column('rate_snapshots', 'stale_age')
@@ -0,0 +1,39 @@
+"""rate history
+
+Revision ID: 8d41b6c0e2f3
+Revises: 3c9e1f7a2b64
+Create Date: 2026-10-18 15:20:37.918442
+
+"""
+from typing import Sequence, Union
+
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision: str = '8d41b6c0e2f3'
+down_revision: Union[str, Sequence[str], None] = '3c9e1f7a2b64'
+branch_labels: Union[str, Sequence[str], None] = None
+depends_on: Union[str, Sequence[str], None] = None
+
+
+def upgrade() -> None:
+    """Upgrade schema."""
+    op.create_table(
+        'rate_history',
+        sa.Column('id', sa.Integer(), nullable=False),
+        sa.Column('asset_id', sa.Integer(), nullable=False),
+        sa.Column('ts', sa.DateTime(), nullable=False),
+        sa.Column('rub', sa.Float(), nullable=False),
+        sa.Column('source', sa.String(length=16), nullable=True),
+        sa.ForeignKeyConstraint(['asset_id'], ['assets.id'], ondelete='CASCADE'),
+        sa.PrimaryKeyConstraint('id'),
+    )
+    op.create_index('ix_rate_history_asset_ts', 'rate_history', ['asset_id', 'ts'], unique=False)
+
+
+def downgrade() -> None:
+    """Downgrade schema."""
+    op.drop_index('ix_rate_history_asset_ts', table_name='rate_history')
+    op.drop_table('rate_history')
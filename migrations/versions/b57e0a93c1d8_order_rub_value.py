@@ -0,0 +1,28 @@
+"""order rub value
+
+Revision ID: b57e0a93c1d8
+Revises: 8d41b6c0e2f3
+Create Date: 2026-10-18 16:42:09.551730
+
+"""
+from typing import Sequence, Union
+
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision: str = 'b57e0a93c1d8'
+down_revision: Union[str, Sequence[str], None] = '8d41b6c0e2f3'
+branch_labels: Union[str, Sequence[str], None] = None
+depends_on: Union[str, Sequence[str], None] = None
+
+
+def upgrade() -> None:
+    """Upgrade schema."""
+    op.add_column('orders', sa.Column('rub_value', sa.Float(), nullable=True))
+
+
+def downgrade() -> None:
+    """Downgrade schema."""
+    op.drop_column('orders', 'rub_value')
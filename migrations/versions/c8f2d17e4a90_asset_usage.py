@@ -0,0 +1,49 @@
+"""asset usage
+
+Revision ID: c8f2d17e4a90
+Revises: b57e0a93c1d8
+Create Date: 2026-10-18 18:03:26.114905
+
+"""
+from typing import Sequence, Union
+
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision: str = 'c8f2d17e4a90'
+down_revision: Union[str, Sequence[str], None] = 'b57e0a93c1d8'
+branch_labels: Union[str, Sequence[str], None] = None
+depends_on: Union[str, Sequence[str], None] = None
+
+
+def upgrade() -> None:
+    """Upgrade schema."""
+    op.create_table(
+        'asset_usage',
+        sa.Column('service_id', sa.Integer(), nullable=False),
+        sa.Column('asset_id', sa.Integer(), nullable=False),
+        sa.Column('count', sa.Integer(), nullable=False),
+        sa.ForeignKeyConstraint(['asset_id'], ['assets.id'], ondelete='CASCADE'),
+        sa.ForeignKeyConstraint(['service_id'], ['services.id'], ondelete='CASCADE'),
+        sa.PrimaryKeyConstraint('service_id', 'asset_id'),
+    )
+    # начальное заполнение по живым заявкам (то же, что backfill-asset-usage)
+    op.execute("""
+        INSERT INTO asset_usage (service_id, asset_id, count)
+        SELECT service_id, asset_id, count(*)
+        FROM (
+            SELECT id, service_id, received_asset_id AS asset_id FROM orders
+            WHERE is_deleted IS NOT TRUE AND service_id IS NOT NULL AND received_asset_id IS NOT NULL
+            UNION
+            SELECT id, service_id, given_asset_id AS asset_id FROM orders
+            WHERE is_deleted IS NOT TRUE AND service_id IS NOT NULL AND given_asset_id IS NOT NULL
+        ) AS sides
+        GROUP BY service_id, asset_id
+    """)
+
+
+def downgrade() -> None:
+    """Downgrade schema."""
+    op.drop_table('asset_usage')
@@ -0,0 +1,36 @@
+"""catalog versions
+
+Revision ID: d3a7c5e91f02
+Revises: c8f2d17e4a90
+Create Date: 2026-10-18 19:12:40.527318
+
+"""
+from typing import Sequence, Union
+
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision: str = 'd3a7c5e91f02'
+down_revision: Union[str, Sequence[str], None] = 'c8f2d17e4a90'
+branch_labels: Union[str, Sequence[str], None] = None
+depends_on: Union[str, Sequence[str], None] = None
+
+
+def upgrade() -> None:
+    """Upgrade schema."""
+    versions = op.create_table(
+        'catalog_versions',
+        sa.Column('name', sa.String(length=32), nullable=False),
+        sa.Column('version', sa.BigInteger(), nullable=False),
+        sa.PrimaryKeyConstraint('name'),
+    )
+    op.bulk_insert(versions, [
+        {'name': name, 'version': 1} for name in ('services', 'assets', 'categories', 'users')
+    ])
+
+
+def downgrade() -> None:
+    """Downgrade schema."""
+    op.drop_table('catalog_versions')
@@ -0,0 +1,69 @@
+"""hot path indexes
+
+Revision ID: e1b4f2a7c935
+Revises: d3a7c5e91f02
+Create Date: 2026-10-18 20:05:11.803642
+
+"""
+from typing import Sequence, Union
+
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision: str = 'e1b4f2a7c935'
+down_revision: Union[str, Sequence[str], None] = 'd3a7c5e91f02'
+branch_labels: Union[str, Sequence[str], None] = None
+depends_on: Union[str, Sequence[str], None] = None
+
+ALIVE = sa.text('is_deleted = false')
+
+
+def upgrade() -> None:
+    """Upgrade schema."""
+    # дубли балансов (гонка get-or-create): сумму — в самую раннюю строку, остальные удаляем
+    op.execute("""
+        UPDATE balances SET amount = (
+            SELECT SUM(COALESCE(b2.amount, 0)) FROM balances b2
+            WHERE b2.service_id = balances.service_id AND b2.asset_id = balances.asset_id
+        )
+        WHERE id IN (
+            SELECT MIN(id) FROM balances
+            WHERE service_id IS NOT NULL AND asset_id IS NOT NULL
+            GROUP BY service_id, asset_id HAVING COUNT(*) > 1
+        )
+    """)
+    op.execute("""
+        DELETE FROM balances
+        WHERE service_id IS NOT NULL AND asset_id IS NOT NULL AND id NOT IN (
+            SELECT MIN(id) FROM balances
+            WHERE service_id IS NOT NULL AND asset_id IS NOT NULL
+            GROUP BY service_id, asset_id
+        )
+    """)
+    op.create_unique_constraint('uq_balances_service_asset', 'balances', ['service_id', 'asset_id'])
+
+    op.create_index('ix_shifts_service_end', 'shifts', ['service_id', 'end_time'])
+    op.create_index('ix_orders_service_id_desc', 'orders', ['service_id', sa.text('id DESC')])
+    op.create_index('ix_orders_shift_deleted', 'orders', ['shift_id', 'is_deleted'])
+    op.create_index(
+        'ix_orders_type_shift_direction', 'orders', ['type', 'shift_id', 'direction'],
+        postgresql_where=ALIVE,
+    )
+    op.create_index('ix_orders_transfer_group', 'orders', ['transfer_group'], postgresql_where=ALIVE)
+    op.create_index(
+        'ix_balances_history_service_asset_created', 'balances_history',
+        ['service_id', 'asset_id', 'created_at'],
+    )
+
+
+def downgrade() -> None:
+    """Downgrade schema."""
+    op.drop_index('ix_balances_history_service_asset_created', table_name='balances_history')
+    op.drop_index('ix_orders_transfer_group', table_name='orders')
+    op.drop_index('ix_orders_type_shift_direction', table_name='orders')
+    op.drop_index('ix_orders_shift_deleted', table_name='orders')
+    op.drop_index('ix_orders_service_id_desc', table_name='orders')
+    op.drop_index('ix_shifts_service_end', table_name='shifts')
+    op.drop_constraint('uq_balances_service_asset', 'balances', type_='unique')
@@ -0,0 +1,37 @@
+"""rate snapshots
+
+Revision ID: ea5b2a4514ef
+Revises: ffe18c8cdd2f
+Create Date: 2026-10-18 10:12:40.118204
+
+"""
+from typing import Sequence, Union
+
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision: str = 'ea5b2a4514ef'
+down_revision: Union[str, Sequence[str], None] = 'ffe18c8cdd2f'
+branch_labels: Union[str, Sequence[str], None] = None
+depends_on: Union[str, Sequence[str], None] = None
+
+
+def upgrade() -> None:
+    """Upgrade schema."""
+    op.create_table(
+        'rate_snapshots',
+        sa.Column('id', sa.Integer(), nullable=False),
+        sa.Column('taken_at', sa.DateTime(), nullable=True),
+        sa.Column('rates', sa.JSON(), nullable=False),
+        sa.Column('errors', sa.JSON(), nullable=True),
+        sa.PrimaryKeyConstraint('id'),
+    )
+    op.create_index(op.f('ix_rate_snapshots_taken_at'), 'rate_snapshots', ['taken_at'], unique=False)
+
+
+def downgrade() -> None:
+    """Downgrade schema."""
+    op.drop_index(op.f('ix_rate_snapshots_taken_at'), table_name='rate_snapshots')
+    op.drop_table('rate_snapshots')
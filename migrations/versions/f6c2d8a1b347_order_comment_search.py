@@ -0,0 +1,39 @@
+"""order comment search
+
+Revision ID: f6c2d8a1b347
+Revises: e1b4f2a7c935
+Create Date: 2026-10-18 20:41:52.190374
+
+"""
+from typing import Sequence, Union
+
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision: str = 'f6c2d8a1b347'
+down_revision: Union[str, Sequence[str], None] = 'e1b4f2a7c935'
+branch_labels: Union[str, Sequence[str], None] = None
+depends_on: Union[str, Sequence[str], None] = None
+
+
+def upgrade() -> None:
+    """Upgrade schema."""
+    # подстрока (ILIKE '%...%') — по триграммам
+    op.execute("CREATE EXTENSION IF NOT EXISTS pg_trgm")
+    op.execute("CREATE INDEX ix_orders_comment_trgm ON orders USING gin (comment gin_trgm_ops)")
+    # слова с префиксом — по tsvector; STORED-колонку (PostgreSQL 12+) пересчитывает сама БД при записи,
+    # добавление переписывает таблицу orders
+    op.execute(
+        "ALTER TABLE orders ADD COLUMN comment_tsv tsvector "
+        "GENERATED ALWAYS AS (to_tsvector('simple', coalesce(comment, ''))) STORED"
+    )
+    op.execute("CREATE INDEX ix_orders_comment_tsv ON orders USING gin (comment_tsv)")
+
+
+def downgrade() -> None:
+    """Downgrade schema."""
+    op.drop_index('ix_orders_comment_tsv', table_name='orders')
+    op.drop_column('orders', 'comment_tsv')
+    op.drop_index('ix_orders_comment_trgm', table_name='orders')
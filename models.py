@@ -1,9 +1,10 @@
 from sqlalchemy import Column, Integer, String, Float, ForeignKey, Boolean, DateTime, JSON
 from datetime import datetime
-from db import Base
+from db import Base, engine
 from sqlalchemy.orm import relationship
-from sqlalchemy import BigInteger
+from sqlalchemy import BigInteger, Index, UniqueConstraint, text, event, DDL
 from datetime import datetime, timezone, timedelta
+import partitions
 
 # часовой пояс UTC+3 (Москва)
 MSK = timezone.utc
@@ -42,6 +43,11 @@ class Balance(Base):
     asset_id = Column(Integer, ForeignKey("assets.id", ondelete="SET NULL"), nullable=True)
     amount = Column(Float, default=0.0)
 
+    __table_args__ = (
+        # одна строка баланса на пару сервис/актив (get-or-create в маршрутах)
+        UniqueConstraint("service_id", "asset_id", name="uq_balances_service_asset"),
+    )
+
 
 class Shift(Base):
     __tablename__ = "shifts"
@@ -55,10 +61,21 @@ class Shift(Base):
     user = relationship("User")
     is_deleted = Column(Boolean, default=False)
 
+    __table_args__ = (
+        Index("ix_shifts_service_end", "service_id", "end_time"),   # активная смена сервиса
+    )
+
+
+# orders и balances_history в PostgreSQL разбиты по месяцам (partitions.py), а ключ
+# партиционированной таблицы обязан содержать created_at — там ключ (id, created_at).
+# В SQLite (бенч) партиций нет и ключ — id: составной ключ SQLite не автоинкрементит.
+# Для ORM ключ везде id (__mapper_args__).
+PARTITIONED_PK = engine.dialect.name == "postgresql"
+
 
 class Order(Base):
     __tablename__ = "orders"
-    id = Column(Integer, primary_key=True)
+    id = Column(Integer, primary_key=True, autoincrement=True)
     service_id = Column(Integer, ForeignKey("services.id"))
     user_id = Column(Integer, ForeignKey("users.id"))
     shift_id = Column(Integer, ForeignKey("shifts.id"))
@@ -85,27 +102,137 @@ class Order(Base):
     profit_percent = Column(Float, nullable=True)
     profit_rub = Column(Float, default=0)
     user = relationship("User")
-    created_at = Column(DateTime, default=lambda: datetime.now(MSK))
+    created_at = Column(DateTime, primary_key=PARTITIONED_PK, nullable=False,
+                        default=lambda: datetime.now(MSK))   # ключ партиции
     is_deleted = Column(Boolean, default=False)
     transfer_group = Column(BigInteger, nullable=True)
+    rub_value = Column(Float, nullable=True)   # internal_transfer: ± рубли для сервиса заявки по курсу на момент перевода
     category_id = Column(Integer, ForeignKey("categories.id"), nullable=True)
     category = relationship("Category", back_populates="orders")
 
+    __table_args__ = (
+        # лента сервиса: WHERE service_id = ? ORDER BY id DESC + keyset
+        Index("ix_orders_service_id_desc", "service_id", text("id DESC")),
+        # заявки смены (отчёты, аналитика, сводка дашборда)
+        Index("ix_orders_shift_deleted", "shift_id", "is_deleted"),
+        # ниже — только живые заявки
+        Index(
+            "ix_orders_type_shift_direction", "type", "shift_id", "direction",
+            postgresql_where=text("is_deleted = false"),
+            sqlite_where=text("is_deleted = 0"),
+        ),
+        Index(
+            "ix_orders_transfer_group", "transfer_group",
+            postgresql_where=text("is_deleted = false"),
+            sqlite_where=text("is_deleted = 0"),
+        ),
+        {"postgresql_partition_by": "RANGE (created_at)"},
+    )
+    __mapper_args__ = {"primary_key": [id]}
+
+
+# поиск по комментарию (order_search.py). pg_trgm и tsvector есть только в PostgreSQL,
+# поэтому в create_all они добавляются DDL-событиями, а не колонкой/индексами модели;
+# на рабочей базе то же делает миграция f6c2d8a1b347. comment_tsv пересчитывает сама БД.
+for ddl, when in (
+    ("CREATE EXTENSION IF NOT EXISTS pg_trgm", "before_create"),
+    ("CREATE INDEX ix_orders_comment_trgm ON orders USING gin (comment gin_trgm_ops)", "after_create"),
+    ("ALTER TABLE orders ADD COLUMN comment_tsv tsvector "
+     "GENERATED ALWAYS AS (to_tsvector('simple', coalesce(comment, ''))) STORED", "after_create"),
+    ("CREATE INDEX ix_orders_comment_tsv ON orders USING gin (comment_tsv)", "after_create"),
+):
+    event.listen(Order.__table__, when, DDL(ddl).execute_if(dialect="postgresql"))
+
 
 class BalanceHistory(Base):
     __tablename__ = "balances_history"
-    id = Column(Integer, primary_key=True)
+    id = Column(Integer, primary_key=True, autoincrement=True)
     service_id = Column(Integer, ForeignKey("services.id"))
     asset_id = Column(Integer, ForeignKey("assets.id", ondelete="SET NULL"), nullable=True)
-    order_id = Column(Integer, ForeignKey("orders.id"), nullable=True)
+    order_id = Column(Integer, nullable=True)   # orders.id; внешний ключ на партиционированную orders невозможен
     old_amount = Column(Float, default=0.0)
     new_amount = Column(Float, default=0.0)
     change = Column(Float, default=0.0)
-    created_at = Column(DateTime, default=lambda: datetime.now(MSK))
+    created_at = Column(DateTime, primary_key=PARTITIONED_PK, nullable=False,
+                        default=lambda: datetime.now(MSK))   # ключ партиции
+
+    __table_args__ = (
+        Index("ix_balances_history_service_asset_created", "service_id", "asset_id", "created_at"),
+        {"postgresql_partition_by": "RANGE (created_at)"},
+    )
+    __mapper_args__ = {"primary_key": [id]}
+
+
+# init_db: default-партиция и месяцы вперёд (в SQLite — ничего)
+for partitioned in (Order.__table__, BalanceHistory.__table__):
+    event.listen(partitioned, "after_create", partitions.create_initial)
+
 
 class Category(Base):
     __tablename__ = "categories"
     id = Column(Integer, primary_key=True)
     name = Column(String, unique=True)
 
-    orders = relationship("Order", back_populates="category")
\ No newline at end of file
+    orders = relationship("Order", back_populates="category")
+
+class RateSnapshot(Base):
+    """Снимок рублёвых курсов всех активов от воркера rates."""
+    __tablename__ = "rate_snapshots"
+    id = Column(Integer, primary_key=True)
+    taken_at = Column(DateTime, default=datetime.utcnow, index=True)
+    rates = Column(JSON, nullable=False)    # {"<asset_id>": rub}
+    errors = Column(JSON, nullable=True)    # {"<asset_id>": "текст ошибки"}
+    stale_age = Column(Float, nullable=True)  # сек; курсы из last_good, провайдеры недоступны
+
+
+class RateHistory(Base):
+    """Рублёвый курс актива с момента ts (строка — только когда курс изменился)."""
+    __tablename__ = "rate_history"
+    id = Column(Integer, primary_key=True)
+    asset_id = Column(Integer, ForeignKey("assets.id", ondelete="CASCADE"), nullable=False)
+    ts = Column(DateTime, nullable=False, default=datetime.utcnow)
+    rub = Column(Float, nullable=False)
+    source = Column(String(16), nullable=True)   # manual / rub / cbr / exchange
+
+    __table_args__ = (
+        Index("ix_rate_history_asset_ts", "asset_id", "ts"),
+    )
+
+
+class OrderLeg(Base):
+    """
+    Сторона заявки одной строкой: актив и знаковая сумма (+ получили, − отдали)
+    с рублёвой оценкой. Пишется вместе с заявкой (order_legs.py) — фильтры
+    и агрегаты по активу идут по одному индексу вместо OR по received/given.
+    """
+    __tablename__ = "order_legs"
+    id = Column(Integer, primary_key=True)
+    order_id = Column(Integer, nullable=False)   # orders.id (партиционирована — без внешнего ключа)
+    service_id = Column(Integer, ForeignKey("services.id", ondelete="CASCADE"), nullable=True)
+    asset_id = Column(Integer, ForeignKey("assets.id", ondelete="CASCADE"), nullable=False)
+    signed_amount = Column(Float, nullable=False, default=0.0)
+    rub_value = Column(Float, nullable=True)      # ± рубли по курсу заявки, если он известен
+    is_deleted = Column(Boolean, nullable=False, default=False)   # копия orders.is_deleted
+
+    __table_args__ = (
+        Index("ix_order_legs_order", "order_id"),
+        # фильтр ленты по активу: asset_id [+ service_id] -> order_id
+        Index("ix_order_legs_asset_service_order", "asset_id", "service_id", "order_id"),
+        # агрегаты сервиса по активам (GROUP BY asset_id)
+        Index("ix_order_legs_service_asset", "service_id", "asset_id"),
+    )
+
+
+class AssetUsage(Base):
+    """Сколько живых заявок сервиса затрагивают актив (для top_assets); ведёт asset_usage.py."""
+    __tablename__ = "asset_usage"
+    service_id = Column(Integer, ForeignKey("services.id", ondelete="CASCADE"), primary_key=True)
+    asset_id = Column(Integer, ForeignKey("assets.id", ondelete="CASCADE"), primary_key=True)
+    count = Column(Integer, nullable=False, default=0)
+
+
+class CatalogVersion(Base):
+    """Версия справочника (services / assets / categories / users); растёт при каждом изменении."""
+    __tablename__ = "catalog_versions"
+    name = Column(String(32), primary_key=True)
+    version = Column(BigInteger, nullable=False, default=0)
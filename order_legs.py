@@ -0,0 +1,130 @@
+"""
+Стороны заявок (таблица order_legs).
+
+У Order каждая сторона — своя пара колонок: received_asset_id/received_amount
+и given_asset_id/given_amount. Здесь они же лежат строками
+(order_id, service_id, asset_id, signed_amount, rub_value): получили — плюс,
+отдали — минус. «Заявки с активом X», обороты и пересборка балансов по
+активу становятся одним диапазоном индекса и простым GROUP BY.
+
+Строки пишутся в той же транзакции, что и заявка: обработчик after_flush
+переписывает стороны каждой добавленной или изменённой Order (удалённые
+is_deleted остаются со своим флагом — лента их тоже показывает).
+Маршрутам main.py ничего вызывать не нужно.
+
+Пересчёт с нуля: flask --app main backfill-order-legs
+Сверка с balances: flask --app main check-balances
+"""
+from sqlalchemy import delete, event, func, select
+from sqlalchemy.orm import Session
+
+from models import Balance, Order, OrderLeg
+
+BACKFILL_CHUNK = 1000
+
+
+def _rate(value):
+    """Курс из rate_at_creation / rate_at_execution: у обменов — число, у переводов — словарь."""
+    return value if isinstance(value, (int, float)) and not isinstance(value, bool) else None
+
+
+def legs_for(order) -> list[dict]:
+    """Строки order_legs для заявки (по текущим значениям полей)."""
+    received = order.received_amount or 0.0
+    given = order.given_amount or 0.0
+    if order.type == "order":
+        recv_rate, give_rate = _rate(order.rate_at_creation), _rate(order.rate_at_execution)
+        recv_rub = received * recv_rate if recv_rate is not None else None
+        give_rub = -given * give_rate if give_rate is not None else None
+    elif order.type == "internal_transfer":
+        recv_rub = give_rub = order.rub_value     # у перевода одна сторона, знак уже учтён
+    elif order.type in ("admin_io", "admin_action"):
+        recv_rub, give_rub = order.amount, -(order.amount or 0)   # amount — рубли
+    else:
+        recv_rub = give_rub = None
+
+    sides = (
+        (order.received_asset_id, received, recv_rub),
+        (order.given_asset_id, -given, give_rub),
+    )
+    return [
+        {
+            "order_id": order.id,
+            "service_id": order.service_id,
+            "asset_id": asset_id,
+            "signed_amount": amount,
+            "rub_value": rub,
+            "is_deleted": bool(order.is_deleted),
+        }
+        for asset_id, amount, rub in sides if asset_id is not None
+    ]
+
+
+@event.listens_for(Session, "after_flush")
+def _write_legs(session, flush_context):
+    changed = [o for o in session.new if isinstance(o, Order)]
+    changed += [o for o in session.dirty if isinstance(o, Order) and session.is_modified(o)]
+    removed = [o.id for o in session.deleted if isinstance(o, Order)]
+    stale = [o.id for o in changed if o not in session.new] + removed
+    if not changed and not removed:
+        return
+    connection = session.connection()
+    if stale:
+        connection.execute(delete(OrderLeg).where(OrderLeg.order_id.in_(stale)))
+    rows = [leg for o in changed for leg in legs_for(o)]
+    if rows:
+        connection.execute(OrderLeg.__table__.insert(), rows)
+
+
+def backfill(db) -> int:
+    """Пересобрать order_legs по всей таблице orders. Возвращает число строк."""
+    db.execute(delete(OrderLeg))
+    total, last_id = 0, 0
+    while True:
+        chunk = db.execute(
+            select(Order).where(Order.id > last_id).order_by(Order.id).limit(BACKFILL_CHUNK)
+        ).scalars().all()
+        if not chunk:
+            break
+        rows = [leg for order in chunk for leg in legs_for(order)]
+        if rows:
+            db.execute(OrderLeg.__table__.insert(), rows)
+        total += len(rows)
+        last_id = chunk[-1].id
+    db.commit()
+    return total
+
+
+def orders_with_asset(asset_id: int, service_id: int | None = None):
+    """Подзапрос id заявок, у которых актив на любой из сторон."""
+    q = select(OrderLeg.order_id).where(OrderLeg.asset_id == asset_id)
+    if service_id is not None:
+        q = q.where(OrderLeg.service_id == service_id)
+    return q
+
+
+def replayed_balances(db, service_id: int | None = None) -> dict:
+    """{(service_id, asset_id): сумма} — балансы, собранные заново из живых заявок."""
+    q = (
+        select(OrderLeg.service_id, OrderLeg.asset_id, func.sum(OrderLeg.signed_amount))
+        .where(OrderLeg.is_deleted == False)
+        .group_by(OrderLeg.service_id, OrderLeg.asset_id)
+    )
+    if service_id is not None:
+        q = q.where(OrderLeg.service_id == service_id)
+    return {(s, a): total for s, a, total in db.execute(q)}
+
+
+def balance_mismatches(db, service_id: int | None = None, tolerance: float = 1e-6) -> list:
+    """[(service_id, asset_id, в balances, по заявкам)] там, где они расходятся."""
+    replayed = replayed_balances(db, service_id)
+    q = select(Balance.service_id, Balance.asset_id, Balance.amount).where(Balance.asset_id.isnot(None))
+    if service_id is not None:
+        q = q.where(Balance.service_id == service_id)
+    stored = {(s, a): amount or 0.0 for s, a, amount in db.execute(q)}
+    result = []
+    for key in sorted(stored.keys() | replayed.keys()):
+        have, expected = stored.get(key, 0.0), replayed.get(key, 0.0)
+        if abs(have - expected) > tolerance:
+            result.append((*key, have, expected))
+    return result
@@ -0,0 +1,58 @@
+"""
+Поиск заявок по комментарию (фильтр «Комментарий» на главной).
+
+Операторы ищут по кускам кошельков и карт, поэтому режим по умолчанию —
+подстрока: comment ILIKE '%...%', как и раньше. В PostgreSQL его обслуживает
+GIN-индекс pg_trgm (ix_orders_comment_trgm) вместо полного прохода по orders.
+
+Режим «слова» (?search=words): каждое слово запроса — префикс слова
+комментария ('4276 ivan' → 4276:* & ivan:*), по колонке comment_tsv
+с GIN-индексом; колонку PostgreSQL пересчитывает сам при записи.
+
+?rank=1 — выдача по релевантности: word_similarity() pg_trgm для подстроки,
+ts_rank() для слов; при равенстве — новые выше.
+
+Вне PostgreSQL (SQLite бенча) — те же режимы через LIKE, без ранжирования.
+"""
+import re
+
+from sqlalchemy import and_, func, literal_column, or_
+
+from models import Order
+
+MODES = ("substring", "words")
+
+comment_tsv = literal_column("orders.comment_tsv")
+
+
+def _words(text: str) -> list[str]:
+    return re.findall(r"\w+", text.lower())
+
+
+def _tsquery(words: list[str]):
+    return func.to_tsquery("simple", " & ".join(f"{w}:*" for w in words))
+
+
+def apply(query, text: str, mode: str, dialect: str):
+    """Добавить к запросу ленты условие поиска (остальные фильтры не трогает)."""
+    if mode == "words":
+        words = _words(text)
+        if not words:
+            return query
+        if dialect == "postgresql":
+            return query.filter(comment_tsv.op("@@")(_tsquery(words)))
+        # слово комментария начинается с каждого слова запроса
+        return query.filter(and_(*(
+            or_(Order.comment.ilike(f"{w}%"), Order.comment.ilike(f"% {w}%")) for w in words
+        )))
+    return query.filter(Order.comment.ilike(f"%{text}%"))
+
+
+def rank(text: str, mode: str, dialect: str):
+    """Выражение релевантности для ORDER BY ... DESC; None — ранжировать нечем."""
+    if dialect != "postgresql":
+        return None
+    if mode == "words":
+        words = _words(text)
+        return func.ts_rank(comment_tsv, _tsquery(words)) if words else None
+    return func.word_similarity(text, Order.comment)
@@ -0,0 +1,173 @@
+"""
+Каталог торговых пар бирж для выбора pair_symbol актива.
+
+exchangeInfo у Binance весит мегабайты, поэтому список пар хранится
+на диске и в памяти, а с бирж перезапрашивается в фоне не чаще
+REFRESH_INTERVAL — условным запросом (ETag / Last-Modified), если биржа
+их отдаёт. Поиск идёт по отсортированному списку в памяти.
+"""
+import bisect
+import json
+import os
+import tempfile
+import threading
+import time
+
+import requests
+
+from rate_limit import rate_limiter
+from rates import PROVIDER_URLS, REQUEST_COST, REQUEST_TIMEOUT
+
+CACHE_PATH = os.environ.get(
+    "PAIRS_CACHE_PATH", os.path.join(tempfile.gettempdir(), "exchange_pairs.json")
+)
+REFRESH_INTERVAL = 6 * 3600
+
+EXCHANGE_INFO = {
+    "binance": "/api/v3/exchangeInfo",
+    "mexc": "/api/v3/exchangeInfo",
+}
+# Binance пишет TRADING, MEXC — "1" или ENABLED
+TRADING_STATUSES = ("TRADING", "1", "ENABLED")
+
+
+class PairCatalog:
+    def __init__(self, path: str = CACHE_PATH):
+        self.path = path
+        self.providers = {}     # provider -> {"symbols", "etag", "last_modified"}
+        self.symbols = []       # объединённый отсортированный список
+        self.fetched_at = 0.0
+        self._lock = threading.Lock()
+        self._load_lock = threading.Lock()   # холодная загрузка — одна на процесс
+        self._refreshing = False
+        self._session = requests.Session()
+
+    # ---------- диск ----------
+
+    def _load_disk(self):
+        try:
+            with open(self.path, encoding="utf-8") as f:
+                data = json.load(f)
+        except (OSError, ValueError):
+            return
+        self._apply(data.get("providers", {}), data.get("fetched_at", 0.0))
+
+    def _save_disk(self):
+        data = {"fetched_at": self.fetched_at, "providers": self.providers}
+        fd, tmp = tempfile.mkstemp(dir=os.path.dirname(self.path) or ".")
+        with os.fdopen(fd, "w", encoding="utf-8") as f:
+            json.dump(data, f)
+        os.replace(tmp, self.path)
+
+    def _apply(self, providers: dict, fetched_at: float):
+        merged = set()
+        for info in providers.values():
+            merged.update(info.get("symbols", ()))
+        with self._lock:
+            self.providers = providers
+            self.symbols = sorted(merged)
+            self.fetched_at = fetched_at
+
+    # ---------- биржи ----------
+
+    def _fetch(self, provider: str, old: dict | None) -> dict | None:
+        headers = {}
+        if old and old.get("etag"):
+            headers["If-None-Match"] = old["etag"]
+        if old and old.get("last_modified"):
+            headers["If-Modified-Since"] = old["last_modified"]
+
+        # тот же общий лимит запросов, что и у курсов
+        if rate_limiter.acquire(provider, REQUEST_COST[EXCHANGE_INFO[provider]]):
+            return old
+
+        try:
+            r = self._session.get(
+                PROVIDER_URLS[provider] + EXCHANGE_INFO[provider],
+                headers=headers,
+                timeout=REQUEST_TIMEOUT * 3,
+            )
+            if r.status_code == 304 and old:
+                return old
+            r.raise_for_status()
+            data = r.json()
+        except Exception:
+            return old  # биржа недоступна — оставляем прежний список
+
+        symbols = sorted(
+            s["symbol"] for s in data.get("symbols", [])
+            if str(s.get("status")) in TRADING_STATUSES
+        )
+        return {
+            "symbols": symbols,
+            "etag": r.headers.get("ETag"),
+            "last_modified": r.headers.get("Last-Modified"),
+        }
+
+    def refresh(self):
+        providers = {}
+        for provider in EXCHANGE_INFO:
+            info = self._fetch(provider, self.providers.get(provider))
+            if info:
+                providers[provider] = info
+        if not providers:
+            return
+        self._apply(providers, time.time())
+        try:
+            self._save_disk()
+        except OSError:
+            pass  # без дискового кэша тоже работаем
+
+    def _refresh_async(self):
+        with self._lock:
+            if self._refreshing:
+                return
+            self._refreshing = True
+
+        def run():
+            try:
+                self.refresh()
+            finally:
+                with self._lock:
+                    self._refreshing = False
+
+        threading.Thread(target=run, daemon=True).start()
+
+    def ensure_fresh(self) -> bool:
+        """Есть ли список пар. Устаревший список отдаётся сразу и обновляется в фоне."""
+        if not self.symbols:
+            # остальные запросы ждут ту же загрузку, а не идут на биржу каждый сам
+            with self._load_lock:
+                if not self.symbols:
+                    self._load_disk()
+                if not self.symbols:
+                    self.refresh()  # холодный старт без файла — придётся подождать
+        elif time.time() - self.fetched_at > REFRESH_INTERVAL:
+            self._refresh_async()
+        return bool(self.symbols)
+
+    # ---------- поиск ----------
+
+    def search(self, query: str = "", limit: int = 20) -> list[str]:
+        """Сначала пары, начинающиеся с query, затем содержащие его."""
+        symbols = self.symbols
+        query = query.strip().upper()
+        if not query:
+            return symbols[:limit]
+
+        result = []
+        i = bisect.bisect_left(symbols, query)
+        while i < len(symbols) and len(result) < limit and symbols[i].startswith(query):
+            result.append(symbols[i])
+            i += 1
+
+        if len(result) < limit:
+            for symbol in symbols:
+                if query in symbol and not symbol.startswith(query):
+                    result.append(symbol)
+                    if len(result) >= limit:
+                        break
+        return result
+
+
+pair_catalog = PairCatalog()
@@ -0,0 +1,156 @@
+"""
+Помесячные партиции orders и balances_history (PostgreSQL).
+
+Обе таблицы — PARTITION BY RANGE (created_at): партиция на календарный
+месяц (orders_p2026_10 — [2026-10-01, 2026-11-01)) и orders_default для
+строк вне созданных месяцев. Первичный ключ — (id, created_at), иначе
+PostgreSQL его не примет; для ORM ключ по-прежнему id.
+
+Запросы по смене добавляют shift_window(): условие на created_at по
+границам смены, и PostgreSQL читает только её месяцы, а не всю историю.
+Время в created_at записано то в МСК, то в UTC, поэтому границы —
+с запасом SHIFT_SLACK.
+
+Обслуживание (cron, раз в сутки):
+  flask --app main partitions                    # месяцы до +AHEAD_MONTHS вперёд
+  flask --app main partitions --keep-months 24   # и отцепить месяцы старше 24
+Отцепленная партиция (DETACH) остаётся отдельной таблицей — архив;
+удалять её или выгружать решает администратор.
+
+В SQLite (бенч) партиций нет: функции здесь ничего не делают.
+"""
+from datetime import date, datetime, timedelta
+
+from sqlalchemy import and_, text, true
+
+PARTITIONED = ("orders", "balances_history")
+PARTITION_KEY = "created_at"
+AHEAD_MONTHS = 3
+SHIFT_SLACK = timedelta(days=1)
+
+
+def month_start(day) -> date:
+    return date(day.year, day.month, 1)
+
+
+def add_months(month: date, n: int) -> date:
+    index = month.year * 12 + month.month - 1 + n
+    return date(index // 12, index % 12 + 1, 1)
+
+
+def partition_name(table: str, month: date) -> str:
+    return f"{table}_p{month:%Y_%m}"
+
+
+def _exists(connection, name: str) -> bool:
+    return connection.scalar(text("SELECT to_regclass(:name) IS NOT NULL"), {"name": name})
+
+
+def partitions(connection, table: str) -> dict:
+    """{месяц: имя} прикреплённых месячных партиций таблицы."""
+    rows = connection.execute(text("""
+        SELECT c.relname FROM pg_inherits i
+        JOIN pg_class c ON c.oid = i.inhrelid
+        JOIN pg_class p ON p.oid = i.inhparent
+        WHERE p.relname = :table
+    """), {"table": table}).scalars()
+    result = {}
+    for name in rows:
+        suffix = name[len(table) + 2:]
+        if name.startswith(f"{table}_p") and len(suffix) == 7:
+            result[date(int(suffix[:4]), int(suffix[5:]), 1)] = name
+    return result
+
+
+def _columns(connection, table: str) -> str:
+    """Колонки для INSERT ... SELECT (без вычисляемых вроде comment_tsv)."""
+    names = connection.execute(text("""
+        SELECT column_name FROM information_schema.columns
+        WHERE table_name = :table AND table_schema = current_schema() AND is_generated = 'NEVER'
+        ORDER BY ordinal_position
+    """), {"table": table}).scalars()
+    return ", ".join(f'"{name}"' for name in names)
+
+
+def ensure_default(connection, table: str) -> bool:
+    name = f"{table}_default"
+    if _exists(connection, name):
+        return False
+    connection.execute(text(f"CREATE TABLE {name} PARTITION OF {table} DEFAULT"))
+    return True
+
+
+def ensure_month(connection, table: str, month: date) -> bool:
+    """Создать партицию месяца, если её нет. Строки этого месяца из default переносятся в неё."""
+    name = partition_name(table, month)
+    if _exists(connection, name):
+        return False
+    bounds = {"lo": month, "hi": add_months(month, 1)}
+    in_month = f"{PARTITION_KEY} >= :lo AND {PARTITION_KEY} < :hi"
+    default = f"{table}_default"
+    stray = _exists(connection, default) and connection.scalar(
+        text(f"SELECT EXISTS (SELECT 1 FROM {default} WHERE {in_month})"), bounds
+    )
+    create = (f"CREATE TABLE {name} PARTITION OF {table} "
+              f"FOR VALUES FROM ('{bounds['lo']}') TO ('{bounds['hi']}')")
+    if not stray:
+        connection.execute(text(create))
+        return True
+    # PostgreSQL не создаст партицию, пока подходящие строки лежат в default
+    columns = _columns(connection, table)
+    connection.execute(text(f"ALTER TABLE {table} DETACH PARTITION {default}"))
+    connection.execute(text(create))
+    connection.execute(text(f"INSERT INTO {table} ({columns}) SELECT {columns} FROM {default} WHERE {in_month}"), bounds)
+    connection.execute(text(f"DELETE FROM {default} WHERE {in_month}"), bounds)
+    connection.execute(text(f"ALTER TABLE {table} ATTACH PARTITION {default} DEFAULT"))
+    return True
+
+
+def detach_before(connection, table: str, month: date) -> list[str]:
+    """Отцепить месячные партиции раньше month. Возвращает их имена."""
+    detached = []
+    for start, name in sorted(partitions(connection, table).items()):
+        if start < month:
+            connection.execute(text(f"ALTER TABLE {table} DETACH PARTITION {name}"))
+            detached.append(name)
+    return detached
+
+
+def maintain(connection, ahead: int = AHEAD_MONTHS, keep_months: int | None = None,
+             today: date | None = None) -> list[str]:
+    """Партиции с текущего месяца до +ahead; при keep_months — отцепить старше. Возвращает сделанное."""
+    if connection.dialect.name != "postgresql":
+        return []
+    current = month_start(today or datetime.now())
+    done = []
+    for table in PARTITIONED:
+        if ensure_default(connection, table):
+            done.append(f"создана {table}_default")
+        for n in range(ahead + 1):
+            month = add_months(current, n)
+            if ensure_month(connection, table, month):
+                done.append(f"создана {partition_name(table, month)}")
+        if keep_months is not None:
+            done += [f"отцеплена {name}"
+                     for name in detach_before(connection, table, add_months(current, -keep_months))]
+    return done
+
+
+def create_initial(target, connection, **kw):
+    """after_create (init_db): default и месяцы вперёд — без них вставка в пустую родительскую таблицу падает."""
+    if connection.dialect.name != "postgresql":
+        return
+    ensure_default(connection, target.name)
+    current = month_start(datetime.now())
+    for n in range(AHEAD_MONTHS + 1):
+        ensure_month(connection, target.name, add_months(current, n))
+
+
+def shift_window(column, start_time, end_time=None):
+    """Условие на created_at по границам смены — чтобы PostgreSQL отсёк чужие месяцы."""
+    conditions = []
+    if start_time is not None:
+        conditions.append(column >= start_time - SHIFT_SLACK)
+    if end_time is not None:
+        conditions.append(column < end_time + SHIFT_SLACK)
+    return and_(true(), *conditions)
@@ -0,0 +1,101 @@
+"""
+История рублёвых курсов активов.
+
+Строка в rate_history пишется только когда курс актива изменился,
+поэтому курс «на момент t» — последняя строка актива с ts <= t:
+один проход назад по индексу (asset_id, ts), без сети и без пересчёта.
+Время — naive UTC, как у Order.created_at и RateSnapshot.taken_at.
+
+Пишет воркер rates (RateHistoryWriter), читают edit_order и отчёты.
+"""
+from datetime import datetime
+
+from sqlalchemy import DateTime, Integer, func, select, true, values, column
+
+from models import RateHistory
+
+# изменение меньше этой доли курс «не меняет» — цена бирж дышит постоянно
+MIN_CHANGE = 0.001
+
+
+def rate_as_of(db, asset_id: int, ts: datetime) -> float | None:
+    """Курс актива, действовавший в момент ts, или None, если истории ещё нет."""
+    return db.execute(
+        select(RateHistory.rub)
+        .where(RateHistory.asset_id == asset_id, RateHistory.ts <= ts)
+        .order_by(RateHistory.ts.desc())
+        .limit(1)
+    ).scalar()
+
+
+def rates_as_of(db, items) -> dict[tuple[int, datetime], float]:
+    """
+    Курсы для многих пар (asset_id, ts) одним запросом:
+    {(asset_id, ts): rub}; пар без истории в ответе нет.
+    """
+    items = list(dict.fromkeys((a, t) for a, t in items if a and t))
+    if not items:
+        return {}
+
+    if db.get_bind().dialect.name != "postgresql":
+        # VALUES ... AS q(a, b) и LATERAL есть только у PostgreSQL
+        result = {}
+        for asset_id, ts in items:
+            rub = rate_as_of(db, asset_id, ts)
+            if rub is not None:
+                result[(asset_id, ts)] = rub
+        return result
+
+    wanted = values(column("asset_id", Integer), column("ts", DateTime), name="wanted").data(items)
+    found = (
+        select(RateHistory.rub)
+        .where(RateHistory.asset_id == wanted.c.asset_id, RateHistory.ts <= wanted.c.ts)
+        .order_by(RateHistory.ts.desc())
+        .limit(1)
+        .lateral("found")
+    )
+    rows = db.execute(
+        select(wanted.c.asset_id, wanted.c.ts, found.c.rub).select_from(wanted.join(found, true()))
+    )
+    return {(asset_id, ts): rub for asset_id, ts, rub in rows}
+
+
+class RateHistoryWriter:
+    """Дописывает в rate_history только изменившиеся курсы (держит последние в памяти)."""
+
+    def __init__(self):
+        self._last = None   # asset_id -> (rub, source)
+
+    def _load(self, db):
+        latest = (
+            select(RateHistory.asset_id, func.max(RateHistory.ts).label("ts"))
+            .group_by(RateHistory.asset_id)
+            .subquery()
+        )
+        rows = db.execute(
+            select(RateHistory.asset_id, RateHistory.rub, RateHistory.source).join(
+                latest,
+                (RateHistory.asset_id == latest.c.asset_id) & (RateHistory.ts == latest.c.ts),
+            )
+        )
+        self._last = {asset_id: (rub, source) for asset_id, rub, source in rows}
+
+    def record(self, db, prices: dict[int, float], sources: dict[int, str], ts: datetime) -> int:
+        """Добавить в сессию строки для изменившихся курсов; коммитит вызывающий."""
+        if self._last is None:
+            self._load(db)
+
+        written = 0
+        for asset_id, rub in prices.items():
+            source = sources.get(asset_id)
+            last = self._last.get(asset_id)
+            if last and last[1] == source and abs(rub - last[0]) <= abs(last[0]) * MIN_CHANGE:
+                continue
+            db.add(RateHistory(asset_id=asset_id, ts=ts, rub=rub, source=source))
+            self._last[asset_id] = (rub, source)
+            written += 1
+        return written
+
+    def reset(self):
+        """Забыть последние курсы (после отката транзакции)."""
+        self._last = None
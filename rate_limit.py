@@ -0,0 +1,113 @@
+"""
+Общий для всех воркеров gunicorn лимит запросов к провайдерам курсов.
+
+Token bucket на провайдера в маленьком файле (mmap): перед каждым
+запросом процесс берёт жетоны под flock, поэтому все воркеры вместе
+не выходят за лимит биржи — и не получают бан (418/429), который
+потом превращается в медленные ошибки у всех.
+
+Если файл недоступен, бакеты живут в памяти процесса — лимит тогда
+действует на каждый воркер отдельно, но запросы не ломаются.
+"""
+import fcntl
+import mmap
+import os
+import struct
+import tempfile
+import threading
+import time
+from collections import Counter
+
+LIMIT_PATH = os.environ.get(
+    "RATES_LIMIT_PATH",
+    os.path.join("/dev/shm" if os.path.isdir("/dev/shm") else tempfile.gettempdir(),
+                 "exchange_ratelimit.bin"),
+)
+
+# провайдер -> (жетонов в секунду, ёмкость бакета); с запасом от лимитов бирж
+LIMITS = {
+    "cbr": (1.0, 5),
+    "binance": (10.0, 20),
+    "mexc": (10.0, 20),
+}
+
+MAGIC = b"RLIM"
+VERSION = 1
+HEADER = struct.Struct("<4sI")
+HEADER_SIZE = 16
+# tokens, updated_at (time.monotonic — общий для всех процессов машины)
+SLOT = struct.Struct("<dd")
+
+
+class TokenBucketLimiter:
+    def __init__(self, path: str = LIMIT_PATH, limits: dict = LIMITS):
+        self.path = path
+        self.limits = limits
+        self.slots = {name: i for i, name in enumerate(sorted(limits))}
+        self.granted = Counter()
+        self._buf = None
+        self._fd = None
+        self._lock = threading.Lock()   # flock не разделяет потоки одного процесса
+
+    @property
+    def size(self) -> int:
+        return HEADER_SIZE + len(self.slots) * SLOT.size
+
+    def _open(self):
+        if self._buf is not None:
+            return
+        try:
+            fd = os.open(self.path, os.O_RDWR | os.O_CREAT, 0o644)
+            fcntl.flock(fd, fcntl.LOCK_EX)
+            try:
+                # первый процесс размечает файл; остальные видят готовый заголовок
+                if os.fstat(fd).st_size < self.size or os.pread(fd, 4, 0) != MAGIC:
+                    os.ftruncate(fd, self.size)
+                    os.pwrite(fd, bytes(self.size), 0)
+                    os.pwrite(fd, HEADER.pack(MAGIC, VERSION), 0)
+            finally:
+                fcntl.flock(fd, fcntl.LOCK_UN)
+            self._buf = mmap.mmap(fd, self.size)
+            self._fd = fd
+        except OSError:
+            self._buf = bytearray(self.size)   # без общего файла — лимит на процесс
+
+    def acquire(self, provider: str, cost: float = 1.0) -> float:
+        """
+        Взять cost жетонов. 0 — можно слать запрос;
+        иначе сколько секунд ждать, пока бакет наполнится (жетоны не списаны).
+        """
+        if provider not in self.limits:
+            return 0.0
+        rate, capacity = self.limits[provider]
+        offset = HEADER_SIZE + self.slots[provider] * SLOT.size
+
+        with self._lock:
+            self._open()
+            if self._fd is not None:
+                fcntl.flock(self._fd, fcntl.LOCK_EX)
+            try:
+                tokens, updated_at = SLOT.unpack_from(self._buf, offset)
+                now = time.monotonic()
+                if updated_at == 0 or updated_at > now:
+                    tokens = capacity   # новый бакет или машина перезагрузилась
+                else:
+                    tokens = min(capacity, tokens + (now - updated_at) * rate)
+                if tokens >= cost:
+                    SLOT.pack_into(self._buf, offset, tokens - cost, now)
+                    self.granted[provider] += 1
+                    return 0.0
+                SLOT.pack_into(self._buf, offset, tokens, now)
+                return (cost - tokens) / rate
+            finally:
+                if self._fd is not None:
+                    fcntl.flock(self._fd, fcntl.LOCK_UN)
+
+    def stats(self) -> dict:
+        return {
+            name: {"granted": self.granted[name], "rate": rate, "capacity": capacity}
+            for name, (rate, capacity) in self.limits.items()
+        }
+
+
+rate_limiter = TokenBucketLimiter()
@@ -0,0 +1,168 @@
+"""
+Общий для всех воркеров gunicorn файл курсов в памяти (mmap).
+
+Формат фиксированный: заголовок + слот на каждый asset_id
+(слот = asset_id, поэтому поиск — одно смещение, без индексов).
+Пишет только воркер rates, читают все web-воркеры без блокировок:
+запись обрамляется счётчиком seq (seqlock) — нечётный seq значит
+«идёт запись», и читатель повторяет чтение после короткой паузы.
+Писатель переписывает только изменившиеся слоты и счётчик used
+(занятые слоты — [1, used)), поэтому запись короткая.
+
+Работает только когда web и rates запущены на одной машине.
+Если файла нет, main.py берёт курсы из rate_snapshots.
+"""
+import mmap
+import os
+import struct
+import tempfile
+import time
+from collections import namedtuple
+
+STORE_PATH = os.environ.get(
+    "RATES_STORE_PATH",
+    os.path.join("/dev/shm" if os.path.isdir("/dev/shm") else tempfile.gettempdir(),
+                 "exchange_rates.bin"),
+)
+CAPACITY = 16384        # максимальный asset_id + 1
+
+MAGIC = b"RATE"
+VERSION = 2
+# magic, version, capacity, seq, written_at, used
+HEADER = struct.Struct("<4sIIxxxxQdI")
+HEADER_SIZE = 64
+SEQ_OFFSET = 16
+WRITTEN_AT_OFFSET = 24
+USED_OFFSET = 32
+# asset_id, source, rub_price, fetched_at
+RECORD = struct.Struct("<iB3xdd")
+EMPTY = bytes(RECORD.size)
+
+READ_ATTEMPTS = 10
+READ_BACKOFF = 0.0002   # сек; пауза растёт с каждой попыткой
+
+SOURCES = ("", "manual", "rub", "cbr", "exchange")
+
+SharedRate = namedtuple("SharedRate", "rub_price fetched_at source")
+
+
+class SharedRateStore:
+    def __init__(self, path: str = STORE_PATH, capacity: int = CAPACITY):
+        self.path = path
+        self.capacity = capacity
+        self._mm = None
+
+    @property
+    def size(self) -> int:
+        return HEADER_SIZE + self.capacity * RECORD.size
+
+    # ---------- чтение (web-воркеры) ----------
+
+    def _open_reader(self) -> bool:
+        if self._mm is not None:
+            return True
+        try:
+            with open(self.path, "rb") as f:
+                mm = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+        except (OSError, ValueError):
+            return False
+        magic, version, capacity, _, _, _ = HEADER.unpack_from(mm, 0)
+        if magic != MAGIC or version != VERSION:
+            mm.close()
+            return False
+        self.capacity = capacity
+        self._mm = mm
+        return True
+
+    def get(self, asset_id: int, max_age: float | None = None) -> SharedRate | None:
+        """Курс актива или None (нет файла, нет записи, данные старше max_age)."""
+        if not 0 < asset_id < self.capacity or not self._open_reader():
+            return None
+
+        mm = self._mm
+        offset = HEADER_SIZE + asset_id * RECORD.size
+        for attempt in range(READ_ATTEMPTS):
+            if attempt:
+                time.sleep(READ_BACKOFF * attempt)   # даём писателю закончить
+            seq = struct.unpack_from("<Q", mm, SEQ_OFFSET)[0]
+            if seq % 2:
+                continue  # писатель посередине записи
+            stored_id, source, rub, fetched_at = RECORD.unpack_from(mm, offset)
+            written_at = struct.unpack_from("<d", mm, WRITTEN_AT_OFFSET)[0]
+            used = struct.unpack_from("<I", mm, USED_OFFSET)[0]
+            if struct.unpack_from("<Q", mm, SEQ_OFFSET)[0] == seq:
+                break
+        else:
+            return None
+
+        if asset_id >= used or stored_id != asset_id:
+            return None
+        if max_age is not None and time.time() - written_at > max_age:
+            return None  # воркер rates перестал обновлять файл
+        return SharedRate(rub, fetched_at, SOURCES[source])
+
+    # ---------- запись (только воркер rates) ----------
+
+    def _open_writer(self):
+        if not self._writable():
+            # создаём рядом и переименовываем — читатель не увидит файл неполного размера
+            fd, tmp = tempfile.mkstemp(dir=os.path.dirname(self.path) or ".")
+            with os.fdopen(fd, "wb") as f:
+                f.write(HEADER.pack(MAGIC, VERSION, self.capacity, 0, 0.0, 0))
+                f.truncate(self.size)
+            os.chmod(tmp, 0o644)
+            os.replace(tmp, self.path)
+        with open(self.path, "r+b") as f:
+            return mmap.mmap(f.fileno(), self.size)
+
+    def _writable(self) -> bool:
+        """Файл есть и в нашем формате (иначе — после смены формата — создаём заново)."""
+        try:
+            with open(self.path, "rb") as f:
+                header = f.read(HEADER.size)
+                size = os.fstat(f.fileno()).st_size
+        except OSError:
+            return False
+        if len(header) < HEADER.size or size != self.size:
+            return False
+        magic, version, capacity, _, _, _ = HEADER.unpack(header)
+        return magic == MAGIC and version == VERSION and capacity == self.capacity
+
+    def publish(self, rates: dict[int, tuple[float, float, str]]):
+        """
+        Атомарно заменить все курсы: {asset_id: (rub_price, fetched_at, source)}.
+        fetched_at — когда курс получен у провайдера, а не время публикации.
+        """
+        records = {
+            asset_id: RECORD.pack(asset_id, SOURCES.index(source), rub, fetched_at)
+            for asset_id, (rub, fetched_at, source) in rates.items()
+            if 0 < asset_id < self.capacity
+        }
+        used = max(records, default=0) + 1
+
+        mm = self._open_writer()
+        try:
+            # что поменялось — выясняем до захвата seq, читатели в это время не ждут
+            old_used = struct.unpack_from("<I", mm, USED_OFFSET)[0]
+            changed = []
+            for asset_id in range(1, max(old_used, used)):
+                offset = HEADER_SIZE + asset_id * RECORD.size
+                record = records.get(asset_id, EMPTY)
+                if mm[offset:offset + RECORD.size] != record:
+                    changed.append((offset, record))
+
+            seq = struct.unpack_from("<Q", mm, SEQ_OFFSET)[0]
+            struct.pack_into("<Q", mm, SEQ_OFFSET, seq + 1 if seq % 2 == 0 else seq)
+
+            for offset, record in changed:
+                mm[offset:offset + RECORD.size] = record
+            struct.pack_into("<I", mm, USED_OFFSET, used)
+            struct.pack_into("<d", mm, WRITTEN_AT_OFFSET, time.time())
+
+            seq = struct.unpack_from("<Q", mm, SEQ_OFFSET)[0]
+            struct.pack_into("<Q", mm, SEQ_OFFSET, seq + 1)
+        finally:
+            mm.close()
+
+
+rate_store = SharedRateStore()
@@ -0,0 +1,323 @@
+"""
+Потоковые цены биржи вместо REST-запроса на каждый курс.
+
+Одно долгоживущее WebSocket-соединение с mini-ticker потоком Binance:
+на нужные пары подписываемся по мере того, как их спрашивают, а биржа
+сама присылает новые цены. Таблица цен в памяти читается без сети.
+
+Пока соединение живо (любой кадр не старше STALE_AFTER), последняя цена
+пары считается текущей: mini-ticker присылает её только при изменении.
+Соединение упало — price() сразу отдаёт None, и rates.py идёт в REST, как раньше.
+
+Клиент WebSocket минимальный, на стандартной библиотеке (RFC 6455):
+текстовые кадры, ping/pong, close; без расширений и сжатия.
+
+Включается RATES_STREAM=1, адрес потока — RATES_STREAM_URL.
+Запись живых тиков для симулятора:
+  python rate_stream.py BTCUSDT ETHUSDT > ticks.jsonl
+"""
+import base64
+import hashlib
+import json
+import os
+import random
+import socket
+import ssl
+import struct
+import sys
+import threading
+import time
+from urllib.parse import urlparse
+
+STREAM_URL = os.environ.get("RATES_STREAM_URL", "wss://stream.binance.com:9443/ws")
+CONNECT_TIMEOUT = 5
+PING_INTERVAL = 10      # сек тишины, после которых шлём ping
+STALE_AFTER = 30        # сек без единого кадра — соединение считаем мёртвым
+RECONNECT_MAX = 30      # потолок паузы между переподключениями
+
+GUID = "258EAFA5-E914-47DA-95CA-C5AB0DC85B11"
+OP_CONT, OP_TEXT, OP_BINARY, OP_CLOSE, OP_PING, OP_PONG = 0x0, 0x1, 0x2, 0x8, 0x9, 0xA
+
+
+class WebSocketClosed(Exception):
+    """Соединение закрыто той или другой стороной."""
+
+
+# =============================
+#  Кадры WebSocket (общие с bench/exchange_sim.py)
+# =============================
+def accept_key(key: str) -> str:
+    return base64.b64encode(hashlib.sha1((key + GUID).encode()).digest()).decode()
+
+
+def encode_frame(opcode: int, payload: bytes, mask: bool) -> bytes:
+    """Один кадр с FIN. Клиент обязан маскировать, сервер — нет."""
+    head = bytes([0x80 | opcode])
+    bit = 0x80 if mask else 0
+    n = len(payload)
+    if n < 126:
+        head += bytes([bit | n])
+    elif n < 1 << 16:
+        head += bytes([bit | 126]) + struct.pack("!H", n)
+    else:
+        head += bytes([bit | 127]) + struct.pack("!Q", n)
+    if not mask:
+        return head + payload
+    key = os.urandom(4)
+    return head + key + bytes(b ^ key[i % 4] for i, b in enumerate(payload))
+
+
+def read_frame(recv_exact) -> tuple[bool, int, bytes]:
+    """(fin, opcode, payload) следующего кадра; recv_exact(n) читает ровно n байт."""
+    b0, b1 = recv_exact(2)
+    n = b1 & 0x7F
+    if n == 126:
+        n = struct.unpack("!H", recv_exact(2))[0]
+    elif n == 127:
+        n = struct.unpack("!Q", recv_exact(8))[0]
+    key = recv_exact(4) if b1 & 0x80 else None
+    payload = recv_exact(n) if n else b""
+    if key:
+        payload = bytes(b ^ key[i % 4] for i, b in enumerate(payload))
+    return bool(b0 & 0x80), b0 & 0x0F, payload
+
+
+class WebSocket:
+    """Клиентское соединение: connect → send/recv текстом → close."""
+
+    def __init__(self, url: str, timeout: float = CONNECT_TIMEOUT):
+        u = urlparse(url)
+        secure = u.scheme == "wss"
+        port = u.port or (443 if secure else 80)
+        sock = socket.create_connection((u.hostname, port), timeout=timeout)
+        if secure:
+            sock = ssl.create_default_context().wrap_socket(sock, server_hostname=u.hostname)
+        self.sock = sock
+        self._buf = b""
+        self._pos = 0           # сколько байт _buf занял недочитанный кадр
+        self._send_lock = threading.Lock()
+
+        key = base64.b64encode(os.urandom(16)).decode()
+        path = (u.path or "/") + (f"?{u.query}" if u.query else "")
+        sock.sendall((
+            f"GET {path} HTTP/1.1\r\n"
+            f"Host: {u.hostname}:{port}\r\n"
+            "Upgrade: websocket\r\n"
+            "Connection: Upgrade\r\n"
+            f"Sec-WebSocket-Key: {key}\r\n"
+            "Sec-WebSocket-Version: 13\r\n\r\n"
+        ).encode())
+
+        while b"\r\n\r\n" not in self._buf:
+            self._fill()
+        head, self._buf = self._buf.split(b"\r\n\r\n", 1)
+        lines = head.decode("latin-1").split("\r\n")
+        headers = {k.strip().lower(): v.strip() for k, _, v in (l.partition(":") for l in lines[1:])}
+        if lines[0].split()[1:2] != ["101"] or headers.get("sec-websocket-accept") != accept_key(key):
+            sock.close()
+            raise WebSocketClosed(f"рукопожатие не удалось: {lines[0]}")
+
+    def _fill(self):
+        chunk = self.sock.recv(65536)
+        if not chunk:
+            raise WebSocketClosed("соединение разорвано")
+        self._buf += chunk
+
+    def _recv_exact(self, n: int) -> bytes:
+        while len(self._buf) - self._pos < n:
+            self._fill()
+        data = self._buf[self._pos:self._pos + n]
+        self._pos += n
+        return data
+
+    def _read_frame(self):
+        # кадр убираем из буфера только целиком: таймаут посреди кадра не сбивает разбор
+        self._pos = 0
+        try:
+            frame = read_frame(self._recv_exact)
+        finally:
+            self._pos, consumed = 0, self._pos
+        self._buf = self._buf[consumed:]
+        return frame
+
+    def _send(self, opcode: int, payload: bytes):
+        with self._send_lock:
+            self.sock.sendall(encode_frame(opcode, payload, mask=True))
+
+    def send(self, text: str):
+        self._send(OP_TEXT, text.encode())
+
+    def ping(self):
+        self._send(OP_PING, b"")
+
+    def recv(self) -> str | None:
+        """
+        Следующее текстовое сообщение; None — пришёл служебный кадр (ping/pong).
+        socket.timeout — за время таймаута сокета не пришло ничего.
+        """
+        parts = []
+        while True:
+            fin, opcode, payload = self._read_frame()
+            if opcode == OP_PING:
+                self._send(OP_PONG, payload)
+                return None
+            if opcode == OP_PONG:
+                return None
+            if opcode == OP_CLOSE:
+                self.close()
+                raise WebSocketClosed("сервер закрыл соединение")
+            parts.append(payload)
+            if fin:
+                return b"".join(parts).decode()
+
+    def close(self):
+        try:
+            self._send(OP_CLOSE, b"")
+        except OSError:
+            pass
+        self.sock.close()
+
+
+# =============================
+#  Таблица потоковых цен
+# =============================
+class PriceStream:
+    """
+    Цены пар из mini-ticker потока. watch() добавляет пары в подписку,
+    price() читает из памяти. Соединение держит фоновый поток.
+    """
+
+    def __init__(self, url: str):
+        self.url = url
+        self.symbols = set()
+        self.prices = {}            # SYMBOL -> (price, received_at)
+        self.connected = False
+        self.last_frame_at = 0.0
+        self.messages = 0
+        self.reconnects = 0
+        self._ws = None
+        self._next_id = 0
+        self._thread = None
+        self._lock = threading.Lock()
+
+    def watch(self, symbols):
+        with self._lock:
+            new = {s.upper() for s in symbols} - self.symbols
+            self.symbols |= new
+            ws = self._ws
+            if self._thread is None:
+                self._thread = threading.Thread(target=self._run, daemon=True)
+                self._thread.start()
+        if new and ws:
+            try:
+                self._subscribe(ws, new)
+            except OSError:
+                pass  # поток переподключится и подпишется на всё заново
+
+    def alive(self) -> bool:
+        return self.connected and time.time() - self.last_frame_at < STALE_AFTER
+
+    def price(self, symbol: str) -> float | None:
+        """Последняя цена пары или None (нет подписки, нет тика, соединение мертво)."""
+        if not self.alive():
+            return None
+        entry = self.prices.get(symbol.upper())
+        return entry[0] if entry else None
+
+    def _subscribe(self, ws: WebSocket, symbols):
+        with self._lock:
+            self._next_id += 1
+            request_id = self._next_id
+        ws.send(json.dumps({
+            "method": "SUBSCRIBE",
+            "params": [f"{s.lower()}@miniTicker" for s in sorted(symbols)],
+            "id": request_id,
+        }))
+
+    def _handle(self, text: str):
+        data = json.loads(text)
+        if isinstance(data, dict) and "data" in data:
+            data = data["data"]   # комбинированный поток /stream?streams=...
+        now = time.time()
+        for tick in data if isinstance(data, list) else [data]:
+            if "s" in tick and "c" in tick:
+                self.prices[tick["s"]] = (float(tick["c"]), now)
+                self.messages += 1
+
+    def _session(self):
+        ws = WebSocket(self.url)
+        ws.sock.settimeout(PING_INTERVAL)
+        with self._lock:
+            self._ws = ws
+            symbols = set(self.symbols)
+        try:
+            if symbols:
+                self._subscribe(ws, symbols)
+            self.last_frame_at = time.time()
+            self.connected = True
+            while True:
+                try:
+                    text = ws.recv()
+                except socket.timeout:
+                    if not self.alive():
+                        raise WebSocketClosed("нет кадров дольше STALE_AFTER")
+                    ws.ping()
+                    continue
+                self.last_frame_at = time.time()
+                if text:
+                    self._handle(text)
+        finally:
+            self.connected = False
+            with self._lock:
+                self._ws = None
+            ws.close()
+
+    def _run(self):
+        delay = 1.0
+        while True:
+            started = time.time()
+            try:
+                self._session()
+            except (OSError, ValueError, WebSocketClosed):
+                pass
+            self.reconnects += 1
+            if time.time() - started > STALE_AFTER:
+                delay = 1.0   # соединение успело поработать — начинаем паузы заново
+            time.sleep(delay * random.uniform(0.5, 1.5))
+            delay = min(RECONNECT_MAX, delay * 2)
+
+    def stats(self) -> dict:
+        now = time.time()
+        return {
+            "url": self.url,
+            "alive": self.alive(),
+            "symbols": len(self.symbols),
+            "priced": len(self.prices),
+            "messages": self.messages,
+            "reconnects": self.reconnects,
+            "last_frame_age": round(now - self.last_frame_at, 1) if self.last_frame_at else None,
+        }
+
+
+def main():
+    """Записать живые тики в JSONL для bench/exchange_sim.py --ticks."""
+    symbols = sys.argv[1:] or ["BTCUSDT", "ETHUSDT"]
+    ws = WebSocket(STREAM_URL)
+    ws.send(json.dumps({
+        "method": "SUBSCRIBE", "params": [f"{s.lower()}@miniTicker" for s in symbols], "id": 1,
+    }))
+    last = time.time()
+    try:
+        while True:
+            text = ws.recv()
+            data = json.loads(text) if text else {}
+            if "s" in data and "c" in data:
+                now = time.time()
+                print(json.dumps({"dt": round(now - last, 3), "s": data["s"], "c": data["c"]}), flush=True)
+                last = now
+    except KeyboardInterrupt:
+        ws.close()
+
+
+if __name__ == "__main__":
+    main()
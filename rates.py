@@ -1,63 +1,529 @@
+import fcntl
+import json
+import math
+import os
+import random
 import requests
+import statistics
+import tempfile
+import threading
+import time
+from collections import Counter, defaultdict, deque
+from contextlib import contextmanager
+from concurrent.futures import FIRST_COMPLETED, Future, ThreadPoolExecutor, wait
+from concurrent.futures import TimeoutError as FutureTimeout
 from datetime import datetime
+from requests.adapters import HTTPAdapter
+
+from rate_limit import rate_limiter
+from rate_stream import PriceStream
 
 # =============================
-#  Курс доллара ЦБ РФ
+#  HTTP: постоянные сессии и предохранители
 # =============================
-def get_usd_rub() -> float:
-    """Курс $ в рублях по ЦБ РФ."""
+# адреса можно подменить (например, на bench/exchange_sim.py)
+PROVIDER_URLS = {
+    "cbr": os.environ.get("RATES_CBR_URL", "https://www.cbr-xml-daily.ru"),
+    "binance": os.environ.get("RATES_BINANCE_URL", "https://api.binance.com"),
+    "mexc": os.environ.get("RATES_MEXC_URL", "https://api.mexc.com"),
+}
+STREAM_URL = os.environ.get("RATES_STREAM_URL", "wss://stream.binance.com:9443/ws")
+REQUEST_TIMEOUT = 3     # сек на один HTTP-запрос
+LOOKUP_DEADLINE = 6     # сек на весь поиск курса со всеми повторами
+BACKOFF_BASE = 0.2      # первая пауза между повторами, дальше ×2 и джиттер
+THROTTLE_WAIT = 0.5     # сек, которые запрос готов подождать жетон лимита
+# жетонов на запрос; выгрузки всех тикеров и exchangeInfo у бирж «весят» больше
+REQUEST_COST = {"/api/v3/exchangeInfo": 10.0}
+BULK_COST = 2.0     # /api/v3/ticker/price без symbol
+
+
+class ProviderUnavailable(Exception):
+    """Провайдер отключён предохранителем или кончился бюджет времени."""
+
+
+class ProviderThrottled(ProviderUnavailable):
+    """Запрос не отправлен: общий лимит провайдера исчерпан."""
+
+
+class ProviderRejected(Exception):
+    """Провайдер ответил 4xx: запрос неверный (например, нет такой пары), но сам он жив."""
+
+
+class CircuitBreaker:
+    """
+    Предохранитель провайдера.
+    После threshold ошибок подряд провайдер пропускается cooldown секунд,
+    затем пропускается один пробный запрос: успех — снова в работе,
+    ошибка — ещё cooldown секунд простоя.
+    """
+
+    def __init__(self, name: str, threshold: int = 3, cooldown: float = 30):
+        self.name = name
+        self.threshold = threshold
+        self.cooldown = cooldown
+        self.failures = 0
+        self.opened_at = None
+        self.trips = 0
+        self.rejected = 0
+        self._probing = False
+        self._lock = threading.Lock()
+
+    def is_open(self) -> bool:
+        return self.opened_at is not None and time.time() - self.opened_at < self.cooldown
+
+    def allow(self) -> bool:
+        with self._lock:
+            if self.opened_at is None:
+                return True
+            if not self.is_open() and not self._probing:
+                self._probing = True   # пробный запрос после простоя
+                return True
+            self.rejected += 1
+            return False
+
+    def success(self):
+        with self._lock:
+            self.failures = 0
+            self.opened_at = None
+            self._probing = False
+
+    def failure(self):
+        with self._lock:
+            self.failures += 1
+            if self._probing or (self.opened_at is None and self.failures >= self.threshold):
+                self.opened_at = time.time()
+                self.trips += 1
+            self._probing = False
+
+    def stats(self) -> dict:
+        return {
+            "state": "open" if self.is_open() else ("half_open" if self.opened_at else "closed"),
+            "failures": self.failures,
+            "trips": self.trips,
+            "rejected": self.rejected,
+        }
+
+
+class ProviderScoreboard:
+    """
+    Табло провайдеров: задержки, ошибки и отбракованные (нулевые/мусорные)
+    цены за последние WINDOW вызовов (не старше HORIZON секунд) —
+    по провайдеру целиком и по каждой паре.
+    По нему биржи упорядочиваются: первой спрашиваем самую здоровую.
+    Старые неудачи забываются, так что отстающая биржа со временем
+    снова получает шанс.
+    """
+
+    WINDOW = 200
+    HORIZON = 600
+    MIN_SAMPLES = 5         # меньше — по паре не судим, берём провайдера целиком
+    FAILURE_PENALTY = 5.0   # сколько секунд «стоит» одна неудача в оценке
+
+    def __init__(self):
+        self._calls = defaultdict(lambda: deque(maxlen=self.WINDOW))  # (provider, symbol) -> (ts, latency, outcome)
+        self._lock = threading.Lock()
+
+    def record(self, provider: str, symbol: str | None, latency: float, outcome: str):
+        """
+        outcome: ok, error, rejected (цена не прошла проверку) или bad_request
+        (4xx на наш запрос, например нет такой пары — биржа здорова, в оценку не идёт).
+        """
+        call = (time.time(), latency, outcome)
+        with self._lock:
+            self._calls[(provider, None)].append(call)
+            if symbol:
+                self._calls[(provider, symbol)].append(call)
+
+    def reject(self, provider: str, symbol: str | None):
+        """Ответ пришёл, но цена не прошла проверку: переписываем последний ok в rejected."""
+        with self._lock:
+            for key in ((provider, None), (provider, symbol)):
+                calls = self._calls.get(key)
+                if calls and calls[-1][2] == "ok":
+                    calls[-1] = calls[-1][:2] + ("rejected",)
+
+    def _recent(self, key) -> list:
+        since = time.time() - self.HORIZON
+        with self._lock:
+            return [(latency, outcome) for ts, latency, outcome in self._calls.get(key, ()) if ts >= since]
+
+    def _samples(self, provider: str, symbol: str | None) -> list:
+        """Вызовы для оценки; bad_request (ошибка нашего запроса) здоровье биржи не меряет."""
+        def health(key):
+            return [c for c in self._recent(key) if c[1] != "bad_request"]
+
+        calls = health((provider, symbol))
+        if len(calls) < self.MIN_SAMPLES and symbol is not None:
+            calls = health((provider, None))
+        return calls
+
+    def score(self, provider: str, symbol: str | None = None) -> float:
+        """Ожидаемая «цена» запроса в секундах: медианная задержка + штраф за неудачи."""
+        calls = self._samples(provider, symbol)
+        if not calls:
+            return 0.0  # о провайдере ничего не знаем — не наказываем
+        ok = sorted(latency for latency, outcome in calls if outcome == "ok")
+        p50 = ok[len(ok) // 2] if ok else REQUEST_TIMEOUT
+        failure_rate = 1 - len(ok) / len(calls)
+        # округляем до 50 мс, чтобы порядок не прыгал от шума
+        return round((p50 + failure_rate * self.FAILURE_PENALTY) * 20) / 20
+
+    def order(self, providers, symbol: str | None = None) -> list:
+        """Провайдеры от здорового к больному; разомкнутые предохранители — в конец."""
+        return sorted(providers, key=lambda p: (breakers[p].is_open(), self.score(p, symbol)))
+
+    def stats(self) -> dict:
+        with self._lock:
+            keys = list(self._calls)
+        snapshot = {key: self._recent(key) for key in keys}
+
+        def summary(calls):
+            latencies = sorted(latency for latency, _ in calls)
+            outcomes = [outcome for _, outcome in calls]
+            pct = lambda q: round(latencies[min(len(latencies) - 1, int(q * len(latencies)))] * 1000)
+            return {
+                "calls": len(calls),
+                "p50_ms": pct(0.50),
+                "p95_ms": pct(0.95),
+                "p99_ms": pct(0.99),
+                "error_rate": round(outcomes.count("error") / len(calls), 3),
+                "rejected_rate": round(outcomes.count("rejected") / len(calls), 3),
+                "bad_request_rate": round(outcomes.count("bad_request") / len(calls), 3),
+            }
+
+        result = {}
+        for (provider, symbol), calls in sorted(snapshot.items(), key=lambda kv: (kv[0][0], kv[0][1] or "")):
+            if not calls:
+                continue
+            entry = result.setdefault(provider, {"symbols": {}})
+            if symbol is None:
+                entry.update(summary(calls), score=self.score(provider))
+            else:
+                entry["symbols"][symbol] = dict(summary(calls), score=self.score(provider, symbol))
+        return result
+
+
+def _make_session() -> requests.Session:
+    session = requests.Session()
+    # keep-alive: соединение к бирже переиспользуется между запросами
+    adapter = HTTPAdapter(pool_connections=1, pool_maxsize=10, max_retries=0)
+    session.mount("https://", adapter)
+    session.mount("http://", adapter)
+    return session
+
+
+class SingleFlight:
+    """
+    Одинаковые запросы, идущие одновременно, ждут ответа первого (ведущего),
+    а не уходят к провайдеру каждый сам по себе. Только внутри процесса.
+    """
+
+    def __init__(self):
+        self._calls = {}         # key -> Future ведущего запроса
+        self._lock = threading.Lock()
+        self.coalesced = Counter()
+
+    def in_flight(self, key) -> Future | None:
+        with self._lock:
+            return self._calls.get(key)
+
+    def wait(self, key, future: Future, timeout: float):
+        self.coalesced[key[0]] += 1
+        try:
+            return future.result(timeout)
+        except FutureTimeout:
+            raise ProviderUnavailable(f"{key[0]}: не дождались ответа") from None
+
+    def do(self, key, fn, timeout: float):
+        with self._lock:
+            future = self._calls.get(key)
+            leader = future is None
+            if leader:
+                future = self._calls[key] = Future()
+        if not leader:
+            return self.wait(key, future, timeout)
+
+        try:
+            result = fn()
+        except BaseException as e:
+            future.set_exception(e)
+            raise
+        else:
+            future.set_result(result)
+            return result
+        finally:
+            with self._lock:
+                self._calls.pop(key, None)
+
+
+_sessions = {name: _make_session() for name in PROVIDER_URLS}
+breakers = {name: CircuitBreaker(name) for name in PROVIDER_URLS}
+scoreboard = ProviderScoreboard()
+single_flight = SingleFlight()
+throttled = Counter()
+
+
+def _provider_get(provider: str, path: str, params: dict | None = None,
+                  deadline: float | None = None):
+    """
+    GET к провайдеру через его сессию, предохранитель и общий лимит.
+    Одинаковые одновременные запросы склеиваются в один. Возвращает JSON.
+    """
+    key = (provider, path, tuple(sorted((params or {}).items())))
+    wait_for = REQUEST_TIMEOUT if deadline is None else max(0.0, deadline - time.monotonic())
+    return single_flight.do(key, lambda: _limited_get(provider, path, params, deadline), wait_for)
+
+
+def _take_token(provider: str, path: str, params: dict | None, deadline: float | None):
+    cost = BULK_COST if path == "/api/v3/ticker/price" and not params else REQUEST_COST.get(path, 1.0)
+    pause = rate_limiter.acquire(provider, cost)
+    if pause and pause <= THROTTLE_WAIT and (deadline is None or time.monotonic() + pause < deadline):
+        time.sleep(pause)
+        pause = rate_limiter.acquire(provider, cost)
+    if not pause:
+        return
+
+    # лимит исчерпан: если уже идёт выгрузка всех тикеров, цена пары будет в ней
+    symbol = (params or {}).get("symbol")
+    bulk_key = (provider, path, ())
+    bulk = single_flight.in_flight(bulk_key) if symbol else None
+    if bulk is not None:
+        return bulk_key, bulk, symbol
+    throttled[provider] += 1
+    raise ProviderThrottled(f"{provider}: превышен лимит запросов")
+
+
+def _limited_get(provider: str, path: str, params: dict | None, deadline: float | None):
+    breaker = breakers[provider]
+    if breaker.is_open():
+        raise ProviderUnavailable(f"{provider}: предохранитель разомкнут")
+
+    coalesce = _take_token(provider, path, params, deadline)
+    if coalesce:
+        bulk_key, bulk, symbol = coalesce
+        wait_for = REQUEST_TIMEOUT if deadline is None else max(0.0, deadline - time.monotonic())
+        for t in single_flight.wait(bulk_key, bulk, wait_for):
+            if t.get("symbol") == symbol:
+                return t
+        raise ProviderRejected(f"{provider}: нет пары {symbol}")
+
+    # бюджет проверяем до allow(): пробный запрос полуоткрытого предохранителя,
+    # выданный allow(), обязан закончиться success() или failure()
+    timeout = REQUEST_TIMEOUT
+    if deadline is not None:
+        timeout = min(timeout, deadline - time.monotonic())
+        if timeout <= 0:
+            raise ProviderUnavailable(f"{provider}: истёк бюджет времени")
+
+    if not breaker.allow():
+        raise ProviderUnavailable(f"{provider}: предохранитель разомкнут")
+
+    symbol = (params or {}).get("symbol")
+    started = time.monotonic()
     try:
-        r = requests.get("https://www.cbr-xml-daily.ru/daily_json.js", timeout=5)
+        r = _sessions[provider].get(PROVIDER_URLS[provider] + path, params=params, timeout=timeout)
+        # 4xx (кроме лимитов) — ошибка запроса, а не биржи: например, нет такой пары
+        if 400 <= r.status_code < 500 and r.status_code not in (418, 429):
+            raise ProviderRejected(f"{provider}: HTTP {r.status_code}")
+        r.raise_for_status()
         data = r.json()
-        return float(data["Valute"]["USD"]["Value"])
+    except ProviderRejected:
+        breaker.success()
+        scoreboard.record(provider, symbol, time.monotonic() - started, "bad_request")
+        raise
     except Exception:
-        return 100.0   # безопасный fallback, как было
+        breaker.failure()
+        scoreboard.record(provider, symbol, time.monotonic() - started, "error")
+        raise
+    breaker.success()
+    scoreboard.record(provider, symbol, time.monotonic() - started, "ok")
+    return data
+
+
+def breaker_stats() -> dict:
+    return {name: breaker.stats() for name, breaker in breakers.items()}
+
+
+def limiter_stats() -> dict:
+    """Сколько запросов отправлено, отсечено лимитом и склеено с чужими."""
+    result = rate_limiter.stats()
+    for name in PROVIDER_URLS:
+        entry = result.setdefault(name, {})
+        entry["throttled"] = throttled[name]
+        entry["coalesced"] = single_flight.coalesced[name]
+    return result
+
+
+def provider_stats() -> dict:
+    return scoreboard.stats()
+
+
+# =============================
+#  Курс доллара ЦБ РФ
+# =============================
+def get_usd_rub() -> float:
+    """
+    Курс $ в рублях по ЦБ РФ.
+    Без выдуманных значений: если ЦБ недоступен, кэш отдаст последний
+    проверенный курс из last_good, а если нет и его — будет ValueError.
+    """
+    try:
+        data = _provider_get("cbr", "/daily_json.js")
+        value = float(data["Valute"]["USD"]["Value"])
+    except Exception as e:
+        raise ValueError("Ошибка: ЦБ не вернул курс USD") from e
+    if not math.isfinite(value) or value <= 0:
+        raise ValueError("Ошибка: ЦБ вернул неверный курс USD")
+    return value
 
 
 # =============================
 #  БАЗОВЫЕ ФУНКЦИИ БИРЖ
 # =============================
-def _get_binance_price(symbol: str) -> float | None:
+def _get_binance_price(symbol: str, deadline: float | None = None) -> float | None:
     try:
-        r = requests.get(
-            "https://api.binance.com/api/v3/ticker/price",
-            params={"symbol": symbol},
-            timeout=5,
-        )
-        return float(r.json().get("price", 0))
+        data = _provider_get("binance", "/api/v3/ticker/price", {"symbol": symbol}, deadline)
+        return float(data.get("price", 0))
     except Exception:
         return None
 
 
-def _get_mexc_price(symbol: str) -> float | None:
+def _get_mexc_price(symbol: str, deadline: float | None = None) -> float | None:
     try:
-        r = requests.get(
-            "https://api.mexc.com/api/v3/ticker/price",
-            params={"symbol": symbol},
-            timeout=5,
-        )
-        return float(r.json().get("price", 0))
+        data = _provider_get("mexc", "/api/v3/ticker/price", {"symbol": symbol}, deadline)
+        return float(data.get("price", 0))
     except Exception:
         return None
 
 
+# =============================
+#  Все тикеры биржи одним запросом
+# =============================
+def _get_binance_tickers() -> dict[str, float]:
+    data = _provider_get("binance", "/api/v3/ticker/price")
+    return {t["symbol"]: float(t["price"]) for t in data}
+
+
+def _get_mexc_tickers() -> dict[str, float]:
+    data = _provider_get("mexc", "/api/v3/ticker/price")
+    return {t["symbol"]: float(t["price"]) for t in data}
+
+
+# =============================
+#  Потоковые цены (RATES_STREAM=1)
+# =============================
+# одно WebSocket-соединение с mini-ticker вместо REST на каждый курс;
+# пары всех активов подписываются заранее (watch_assets — на старте web и
+# воркера rates, и заново при каждой пересборке графа активов); пара вне
+# справочника добавляется при первом запросе, пока цены нет — REST
+price_stream = PriceStream(STREAM_URL) if os.environ.get("RATES_STREAM") == "1" else None
+
+
+def _streamed_price(pair: str) -> float | None:
+    if price_stream is None:
+        return None
+    px = price_stream.price(pair)
+    if px is None:
+        price_stream.watch([pair])
+        return None
+    return px if _is_sane_price(px) else None
+
+
+def stream_stats() -> dict | None:
+    return price_stream.stats() if price_stream else None
+
+
 # =============================
 #  Безопасное получение курса
 # =============================
+# sequential — биржи по очереди, начиная с самой здоровой; race — обе сразу, первый валидный ответ;
+# median — обе сразу, медиана ответов, успевших к дедлайну
+PRICE_MODE = os.environ.get("RATES_PRICE_MODE", "sequential")
+# такой же порог, как в add_order: курс ниже копейки — мусор
+MIN_RUB_RATE = 0.01
+
+EXCHANGES = {
+    "binance": _get_binance_price,
+    "mexc": _get_mexc_price,
+}
+_pool = ThreadPoolExecutor(max_workers=8, thread_name_prefix="rates")
+
+
+def _is_sane_price(px: float | None) -> bool:
+    """Проверка ответа одной биржи (цена пары к USDT)."""
+    if px is None or not math.isfinite(px) or px <= 0:
+        return False
+    # если курс доллара уже известен — отсекаем цены дешевле MIN_RUB_RATE
+    usd_rub = rate_cache.peek("USD")
+    return usd_rub is None or px * usd_rub >= MIN_RUB_RATE
+
+
+def _checked_price(name: str, symbol: str, px: float | None) -> bool:
+    """_is_sane_price + отметка мусорного ответа на табло провайдеров."""
+    if _is_sane_price(px):
+        return True
+    if px is not None:
+        scoreboard.reject(name, symbol)
+    return False
+
+
+def _sequential_round(symbol: str, deadline: float) -> float | None:
+    # первой спрашиваем биржу, которая сейчас лучше отвечает по этой паре
+    for name in scoreboard.order(EXCHANGES, symbol):
+        px = EXCHANGES[name](symbol, deadline)
+        if _checked_price(name, symbol, px):
+            return px
+    return None
+
+
+def _race_round(symbol: str, deadline: float, median: bool = False) -> float | None:
+    pending = {
+        _pool.submit(fetch, symbol, deadline): name
+        for name, fetch in EXCHANGES.items()
+        if not breakers[name].is_open()
+    }
+    answers = []
+    while pending:
+        timeout = deadline - time.monotonic()
+        if timeout <= 0:
+            break
+        done, _ = wait(pending, timeout=timeout, return_when=FIRST_COMPLETED)
+        for future in done:
+            name = pending.pop(future)
+            px = future.result()
+            if not _checked_price(name, symbol, px):
+                continue
+            if not median:
+                return px
+            answers.append(px)
+    return statistics.median(answers) if answers else None
+
+
 def safe_get_price(symbol: str, attempts: int = 3) -> float | None:
     """
     Безопасно получить цену актива у биржи.
     Возвращает None, если курс нулевой, пустой или API вернул мусор.
+    Весь поиск укладывается в LOOKUP_DEADLINE секунд.
     """
+    deadline = time.monotonic() + LOOKUP_DEADLINE
 
-    for _ in range(attempts):
-        px = _get_binance_price(symbol)
-        if px and px > 0:
+    for attempt in range(attempts):
+        if PRICE_MODE == "sequential":
+            px = _sequential_round(symbol, deadline)
+        else:
+            px = _race_round(symbol, deadline, median=(PRICE_MODE == "median"))
+        if px:
             return px
 
-        px = _get_mexc_price(symbol)
-        if px and px > 0:
-            return px
+        # обе биржи отключены предохранителями — ждать нечего
+        if all(breakers[name].is_open() for name in EXCHANGES):
+            break
+
+        # пауза с джиттером, чтобы воркеры не долбили биржу синхронно
+        delay = BACKOFF_BASE * (2 ** attempt) * random.uniform(0.5, 1.5)
+        if attempt == attempts - 1 or time.monotonic() + delay >= deadline:
+            break
+        time.sleep(delay)
 
     return None  # после всех попыток — неверный курс
 
@@ -214,15 +680,646 @@ NAME_MAP = {
     "WECHAT_CNY": "WeChat Pay",
 }
 
+# =============================
+#  Кэш курсов (TTL + stale-while-revalidate)
+# =============================
+# свежесть по источнику: курс ЦБ меняется раз в день, биржевые — за секунды
+CACHE_TTL = {
+    "cbr": 3600,
+    "exchange": 15,
+}
+# сколько ещё отдаём устаревшее значение, пока оно обновляется в фоне
+CACHE_STALE_TTL = {
+    "cbr": 24 * 3600,
+    "exchange": 300,
+}
+
+
+# =============================
+#  Последние проверенные курсы (переживают рестарт)
+# =============================
+LKG_PATH = os.environ.get(
+    "RATES_LKG_PATH", os.path.join(tempfile.gettempdir(), "exchange_rates_lkg.jsonl")
+)
+LKG_WRITE_INTERVAL = 60     # неизменившийся курс дописываем не чаще раза в минуту
+LKG_MAX_LINES = 5000        # дальше файл сжимается до последних значений
+
+
+class LastGoodStore:
+    """
+    Файл последних проверенных курсов: одна JSON-строка на запись,
+    при чтении побеждает последняя. Из него прогревается кэш на старте
+    и берутся курсы, когда все провайдеры недоступны.
+    Под self._lock — только словари в памяти; файл читается и пишется
+    вне его, под flock (_file_lock).
+    """
+
+    def __init__(self, path: str = LKG_PATH):
+        self.path = path
+        self._values = {}       # key -> (value, fetched_at, source)
+        self._written = {}      # key -> (value, когда дописали в файл)
+        self._lines = 0
+        self._loaded = False
+        self._compacting = False
+        self._lock = threading.Lock()
+
+    def load(self) -> dict:
+        with self._lock:
+            if not self._loaded:
+                self._loaded = True
+                self._read()   # один раз на процесс — остальные подождут
+            values = dict(self._values)
+        self._compact_if_needed()
+        return values
+
+    @contextmanager
+    def _file_lock(self):
+        """
+        flock на соседнем .lock-файле: файл дописывают все воркеры, и сжатие
+        не должно потерять строки, дописанные другими между чтением и os.replace.
+        """
+        try:
+            fd = os.open(self.path + ".lock", os.O_RDWR | os.O_CREAT, 0o644)
+        except OSError:
+            fd = None   # без файла блокировки — как раньше, без защиты
+        try:
+            if fd is not None:
+                fcntl.flock(fd, fcntl.LOCK_EX)
+            yield
+        finally:
+            if fd is not None:
+                os.close(fd)   # закрытие снимает flock
+
+    def _parse(self) -> tuple[dict, int]:
+        """({key: (value, fetched_at, source)}, число строк) из файла; последняя строка побеждает."""
+        values, lines = {}, 0
+        with open(self.path, encoding="utf-8") as f:
+            for line in f:
+                lines += 1
+                try:
+                    row = json.loads(line)
+                    values[row["k"]] = (float(row["v"]), float(row["ts"]), row["src"])
+                except (ValueError, KeyError, TypeError):
+                    continue  # недописанная строка после падения
+        return values, lines
+
+    def _read(self):
+        try:
+            self._values, self._lines = self._parse()
+        except OSError:
+            return
+        self._written = {k: (v[0], v[1]) for k, v in self._values.items()}
+
+    def _compact_if_needed(self):
+        with self._lock:
+            if self._lines <= LKG_MAX_LINES or self._compacting:
+                return
+            self._compacting = True
+            values = dict(self._values)
+        try:
+            with self._file_lock():
+                # перечитываем под блокировкой: в файле могут быть курсы других воркеров
+                try:
+                    on_disk, _ = self._parse()
+                except OSError:
+                    on_disk = {}
+                for key, entry in on_disk.items():
+                    mine = values.get(key)
+                    if mine is None or entry[1] > mine[1]:
+                        values[key] = entry
+                fd, tmp = tempfile.mkstemp(dir=os.path.dirname(self.path) or ".")
+                with os.fdopen(fd, "w", encoding="utf-8") as f:
+                    for key, (value, fetched_at, source) in values.items():
+                        f.write(json.dumps({"k": key, "v": value, "ts": fetched_at, "src": source}) + "\n")
+                os.replace(tmp, self.path)
+        except OSError:
+            values = None   # сожмём в следующий раз
+        finally:
+            with self._lock:
+                self._compacting = False
+        if values is None:
+            return
+        with self._lock:
+            for key, entry in values.items():
+                mine = self._values.get(key)
+                if mine is None or entry[1] > mine[1]:
+                    self._values[key] = entry
+            self._lines = len(values)
+
+    def get(self, key: str):
+        self.load()
+        with self._lock:
+            return self._values.get(key)
+
+    def save(self, key: str, value: float, fetched_at: float, source: str):
+        self.load()
+        with self._lock:
+            self._values[key] = (value, fetched_at, source)
+            last = self._written.get(key)
+            if last and last[0] == value and fetched_at - last[1] < LKG_WRITE_INTERVAL:
+                return
+            self._written[key] = (value, fetched_at)
+        line = json.dumps({"k": key, "v": value, "ts": fetched_at, "src": source}) + "\n"
+        try:
+            with self._file_lock(), open(self.path, "a", encoding="utf-8") as f:
+                f.write(line)
+        except OSError:
+            return  # без файла живём на памяти
+        with self._lock:
+            self._lines += 1
+        self._compact_if_needed()
+
+
+last_good = LastGoodStore()
+
+
+class RateCache:
+    """
+    Кэш курсов внутри процесса.
+    Свежее значение отдаётся сразу, устаревшее — тоже сразу,
+    но параллельно запускается фоновое обновление.
+    На старте прогревается из last_good; если курс не получить ни у кого,
+    отдаётся последний проверенный с пометкой о его возрасте.
+    """
+
+    def __init__(self, store: LastGoodStore | None = None):
+        self._data = {}          # key -> (value, fetched_at, source)
+        self._refreshing = set()
+        self._fallback = {}      # key -> fetched_at курса, отданного из last_good
+        self._store = store
+        self._warmed = store is None
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.stale_hits = 0
+        self.misses = 0
+        self.refresh_errors = 0
+        self.fallbacks = 0
+
+    def _warm(self):
+        saved = self._store.load()
+        with self._lock:
+            if self._warmed:
+                return
+            self._warmed = True
+            for key, entry in saved.items():
+                self._data.setdefault(key, entry)
+
+    def get(self, key: str, source: str, loader):
+        if not self._warmed:
+            self._warm()
+        now = time.time()
+        with self._lock:
+            entry = self._data.get(key)
+            fallback = key in self._fallback
+
+        if entry:
+            value, fetched_at, _ = entry
+            age = now - fetched_at
+            if age < CACHE_TTL[source]:
+                self.hits += 1
+                return value
+            # курс из last_good отдаём в любом возрасте, пока фоновое обновление не удастся
+            if age < CACHE_STALE_TTL[source] or fallback:
+                self.stale_hits += 1
+                self._refresh_async(key, source, loader)
+                return value
+
+        self.misses += 1
+        try:
+            value = loader()
+        except Exception:
+            saved = self.last_good(key)
+            if saved is None:
+                raise
+            # кладём в кэш с исходным fetched_at: следующие запросы получат его сразу
+            # и обновят в фоне, а не будут ждать loader до дедлайна
+            with self._lock:
+                fetched_at = self._fallback.get(key)
+                if fetched_at is not None:
+                    self._data[key] = (saved, fetched_at, source)
+            return saved
+        self.put(key, value, source)
+        return value
+
+    def last_good(self, key: str) -> float | None:
+        """Последний проверенный курс из файла; отмечается как устаревший."""
+        saved = self._store.get(key) if self._store else None
+        if saved is None:
+            return None
+        # все провайдеры молчат — отдаём, но с пометкой о возрасте
+        with self._lock:
+            self.fallbacks += 1
+            self._fallback[key] = saved[1]
+        return saved[0]
+
+    def put(self, key: str, value: float, source: str, fetched_at: float | None = None):
+        """fetched_at — когда значение на самом деле получено у провайдера (по умолчанию — сейчас)."""
+        if fetched_at is None:
+            fetched_at = time.time()
+        with self._lock:
+            self._data[key] = (value, fetched_at, source)
+            self._fallback.pop(key, None)
+        # таблицы тикеров не сохраняем — только отдельные курсы
+        if self._store and isinstance(value, float):
+            self._store.save(key, value, fetched_at, source)
+
+    def staleness(self) -> float | None:
+        """Возраст (сек) самого старого курса, отданного из last_good, или None."""
+        with self._lock:
+            if not self._fallback:
+                return None
+            return time.time() - min(self._fallback.values())
+
+    def fetched_at(self, key: str) -> float | None:
+        """Когда получено значение, лежащее в кэше (или отданное из last_good)."""
+        with self._lock:
+            entry = self._data.get(key)
+            return entry[1] if entry else self._fallback.get(key)
+
+    def peek(self, key: str):
+        """Последнее значение без учёта возраста и без запросов."""
+        with self._lock:
+            entry = self._data.get(key)
+        return entry[0] if entry else None
+
+    def invalidate(self, key: str | None = None):
+        with self._lock:
+            if key is None:
+                self._data.clear()
+                self._fallback.clear()
+            else:
+                self._data.pop(key, None)
+                self._fallback.pop(key, None)
+
+    def _refresh_async(self, key: str, source: str, loader):
+        with self._lock:
+            if key in self._refreshing:
+                return
+            self._refreshing.add(key)
+
+        def run():
+            try:
+                self.put(key, loader(), source)
+            except Exception:
+                # оставляем старое значение — лучше устаревший курс, чем никакого
+                self.refresh_errors += 1
+            finally:
+                with self._lock:
+                    self._refreshing.discard(key)
+
+        threading.Thread(target=run, daemon=True).start()
+
+    def stats(self) -> dict:
+        now = time.time()
+        with self._lock:
+            entries = {
+                key: {
+                    # для таблиц тикеров показываем только размер
+                    "value": len(value) if isinstance(value, dict) else value,
+                    "age": round(now - fetched_at, 1),
+                    "source": source,
+                }
+                for key, (value, fetched_at, source) in self._data.items()
+            }
+            refreshing = len(self._refreshing)
+            fallback = {key: round(now - ts, 1) for key, ts in self._fallback.items()}
+        return {
+            "hits": self.hits,
+            "stale_hits": self.stale_hits,
+            "misses": self.misses,
+            "refresh_errors": self.refresh_errors,
+            "fallbacks": self.fallbacks,
+            "fallback_ages": fallback,
+            "refreshing": refreshing,
+            "entries": entries,
+        }
+
+
+rate_cache = RateCache(last_good)
+
+
+def cache_stats() -> dict:
+    return rate_cache.stats()
+
+
+def rates_staleness() -> float | None:
+    """Насколько устарели курсы, если провайдеры недоступны (для шаблонов)."""
+    return rate_cache.staleness()
+
+
 # =============================
 #  Основная логика курсов
 # =============================
 def price_rub_for_symbol(symbol: str) -> float:
-    """Вернуть цену актива в рублях. Теперь с безопасным API."""
+    """Вернуть цену актива в рублях. Повторные запросы идут из кэша."""
 
     symbol = symbol.upper()
     symbol = ALIAS.get(symbol, symbol)
 
+    # RUB не требует запросов — не засоряем им кэш
+    if symbol == "RUB":
+        return 1.0
+
+    source = "cbr" if symbol in ("USD", "USDT", "USDC") else "exchange"
+    if source == "exchange":
+        px = _streamed_price(f"{symbol}USDT")
+        if px:
+            return px * price_rub_for_symbol("USD")
+    return rate_cache.get(symbol, source, lambda: _price_rub_for_symbol(symbol))
+
+
+def pair_price(pair: str) -> float | None:
+    """Цена торговой пары (pair_symbol актива) через тот же кэш."""
+    pair = pair.upper()
+    px = _streamed_price(pair)
+    if px:
+        return px
+
+    def load():
+        # дедлайн, повторы, порядок бирж по табло и проверка цены — как у остальных курсов
+        px = safe_get_price(pair)
+        if not px:
+            raise ValueError(f"Ошибка: биржа вернула неверный курс для {pair}")
+        return px
+
+    try:
+        return rate_cache.get(f"pair:{pair}", "exchange", load)
+    except ValueError:
+        return None
+
+
+def price_rub_for_asset(asset) -> float:
+    """
+    Цена актива (строки Asset) в рублях:
+    ручной курс → торговая пара → символ через ALIAS.
+    """
+    # 1. если зафиксированный курс
+    if asset.manual_rate is not None:
+        return asset.manual_rate
+
+    # 2. если указана торговая пара
+    if asset.pair_symbol:
+        px = pair_price(asset.pair_symbol)
+        if px:
+            return float(px) * price_rub_for_symbol("USDT")
+
+    # 3. старое поведение (через symbol)
+    return price_rub_for_symbol(asset.symbol)
+
+
+def _tickers(provider: str) -> tuple[dict[str, float], float | None]:
+    """
+    Таблица всех цен биржи; обновляется не чаще TTL биржевых курсов.
+    Второе значение — fetched_at, если таблица скачана именно этим вызовом,
+    иначе None (отдана из кэша, возможно устаревшая).
+    """
+    key = f"tickers:{provider}"
+    fetch = _get_binance_tickers if provider == "binance" else _get_mexc_tickers
+    fetched_by = set()   # потоки, скачавшие таблицу (фоновое обновление — не этот вызов)
+
+    def load():
+        table = fetch()
+        fetched_by.add(threading.get_ident())
+        return table
+
+    try:
+        table = rate_cache.get(key, "exchange", load)
+    except Exception:
+        return {}, None
+    return table, (rate_cache.fetched_at(key) if threading.get_ident() in fetched_by else None)
+
+
+def quote_prices(symbols) -> tuple[dict[str, float | None], dict[str, float]]:
+    """
+    Цены многих пар сразу: из потока цен (если включён), затем одна выгрузка
+    всех тикеров лучшей сейчас биржи, вторая — только если чего-то не нашлось.
+    Второе значение — {пара: когда цена получена на самом деле}.
+    """
+    symbols = {s.upper() for s in symbols}
+    prices = {s: _streamed_price(s) for s in symbols}
+    if not symbols:
+        return prices, {}
+    now = time.time()
+    quoted_at = {s: now for s, px in prices.items() if px is not None}
+    fresh = set(quoted_at)   # получены этим вызовом — только такие пишем как pair:X
+
+    for provider in scoreboard.order(EXCHANGES):
+        missing = [s for s in symbols if prices[s] is None]
+        if not missing:
+            break
+        table, table_fetched_at = _tickers(provider)
+        cached_at = table_fetched_at or rate_cache.fetched_at(f"tickers:{provider}")
+        for s in missing:
+            px = table.get(s)
+            if px and px > 0:
+                prices[s] = px
+                if cached_at is not None:
+                    quoted_at[s] = cached_at
+                if table_fetched_at is not None:
+                    fresh.add(s)
+
+    # свежие пары запоминаем как pair:X; цены из закэшированной таблицы — нет,
+    # иначе устаревший курс получил бы новую метку и попал бы в last_good как свежий
+    for s, px in prices.items():
+        if px is None:
+            prices[s] = rate_cache.last_good(f"pair:{s}")
+            if prices[s] is not None:
+                quoted_at[s] = rate_cache.fetched_at(f"pair:{s}")
+        elif s in fresh:
+            rate_cache.put(f"pair:{s}", px, "exchange", quoted_at[s])
+    return prices, quoted_at
+
+
+def get_prices(symbols) -> dict[str, float | None]:
+    """Цены многих пар сразу (см. quote_prices)."""
+    return quote_prices(symbols)[0]
+
+
+def rate_source(asset) -> str:
+    """Откуда берётся курс актива: manual, rub, cbr или exchange."""
+    if asset.manual_rate is not None:
+        return "manual"
+    if asset.pair_symbol:
+        return "exchange"
+    symbol = ALIAS.get(asset.symbol.upper(), asset.symbol.upper())
+    if symbol == "RUB":
+        return "rub"
+    if symbol in ("USD", "USDT", "USDC"):
+        return "cbr"
+    return "exchange"
+
+
+# =============================
+#  Граф пересчёта активов в рубли
+# =============================
+class ConversionGraph:
+    """
+    Правила пересчёта активов в рубли, скомпилированные из Asset и ALIAS.
+
+    Для каждого актива хранится либо фиксированный курс, либо маршрут —
+    котировки по приоритету: торговая пара (pair_symbol), затем пара
+    <SYMBOL>USDT; "USD" — сам курс доллара, "RUB" — рубль.
+    Граф строится один раз на весь справочник активов (на его версию),
+    любой поднабор оценивается по нему одним проходом по одному набору
+    базовых котировок.
+    """
+
+    def __init__(self, assets, version: int | None = None):
+        self.version = version
+        self.asset_ids = []
+        self.fixed = []     # ручной курс или None
+        self.routes = []    # кортеж котировок по приоритету
+        pairs = set()
+
+        for asset in assets:
+            self.asset_ids.append(asset.id)
+            if asset.manual_rate is not None:
+                self.fixed.append(asset.manual_rate)
+                self.routes.append(())
+                continue
+
+            route = []
+            if asset.pair_symbol:
+                route.append(asset.pair_symbol.upper())
+            symbol = ALIAS.get(asset.symbol.upper(), asset.symbol.upper())
+            if symbol == "RUB":
+                route.append("RUB")
+            elif symbol in ("USD", "USDT", "USDC"):
+                route.append("USD")
+            else:
+                route.append(f"{symbol}USDT")
+
+            pairs.update(q for q in route if q not in ("RUB", "USD"))
+            self.fixed.append(None)
+            self.routes.append(tuple(route))
+
+        self.index = {asset_id: i for i, asset_id in enumerate(self.asset_ids)}
+        self.pairs = frozenset(pairs)
+        self.needs_usd = any(route and route[0] != "RUB" for route in self.routes)
+
+    def _positions(self, asset_ids):
+        if asset_ids is None:
+            return range(len(self.asset_ids))
+        return [self.index[i] for i in asset_ids if i in self.index]
+
+    def pairs_for(self, asset_ids=None) -> frozenset:
+        """Пары, нужные для этих активов (None — для всех)."""
+        if asset_ids is None:
+            return self.pairs
+        return frozenset(q for i in self._positions(asset_ids) for q in self.routes[i]
+                         if q not in ("RUB", "USD"))
+
+    def needs_usd_for(self, asset_ids=None) -> bool:
+        if asset_ids is None:
+            return self.needs_usd
+        return any(self.routes[i] and self.routes[i][0] != "RUB" for i in self._positions(asset_ids))
+
+    def value(self, prices: dict, usd_rub: float | None, asset_ids=None) -> dict[int, float]:
+        """{asset_id: rub} для активов графа (None — для всех); без котировки актив пропускается."""
+        return {asset_id: rub for asset_id, (rub, _) in
+                self.value_at(prices, {}, usd_rub, None, asset_ids).items()}
+
+    def value_at(self, prices: dict, quoted_at: dict, usd_rub: float | None,
+                 usd_at: float | None, asset_ids=None) -> dict[int, tuple[float, float | None]]:
+        """
+        {asset_id: (rub, fetched_at)} — fetched_at самой старой из котировок,
+        по которым посчитан курс; None для ручных курсов и рубля.
+        """
+        result = {}
+        for i in self._positions(asset_ids):
+            fixed = self.fixed[i]
+            if fixed is not None:
+                result[self.asset_ids[i]] = (fixed, None)
+                continue
+            rub, quote = _walk_route(self.routes[i], prices, usd_rub)
+            if rub is None:
+                continue
+            if quote == "RUB":
+                at = None
+            elif quote == "USD":
+                at = usd_at
+            else:
+                times = [t for t in (quoted_at.get(quote), usd_at) if t is not None]
+                at = min(times) if times else None
+            result[self.asset_ids[i]] = (rub, at)
+        return result
+
+
+def _walk_route(route, prices: dict, usd_rub: float | None) -> tuple[float | None, str | None]:
+    """(rub, котировка) по первой доступной котировке маршрута."""
+    for quote in route:
+        if quote == "RUB":
+            return 1.0, quote
+        if usd_rub is None:
+            return None, None
+        if quote == "USD":
+            return usd_rub, quote
+        px = prices.get(quote)
+        if px:
+            return px * usd_rub, quote
+    return None, None
+
+
+_graph: ConversionGraph | None = None
+
+
+def conversion_graph(assets, version: int | None = None) -> ConversionGraph:
+    """
+    Граф по всему справочнику активов; пересобирается, только когда меняется
+    версия справочника (catalogs.py). Без версии (справочник правится в
+    незакоммиченной транзакции) граф строится разово и не кэшируется.
+    """
+    global _graph
+    if version is None:
+        return _watched(ConversionGraph(assets))
+    graph = _graph
+    if graph is None or graph.version != version:
+        graph = _graph = _watched(ConversionGraph(assets, version))
+    return graph
+
+
+def _watched(graph: ConversionGraph) -> ConversionGraph:
+    # справочник изменился — поток цен дописывает новые пары в подписку
+    if price_stream is not None:
+        price_stream.watch(graph.pairs)
+    return graph
+
+
+def watch_assets(assets, version: int | None = None):
+    """Подписать поток цен на пары всех активов до первых запросов (строит граф)."""
+    conversion_graph(assets, version)
+
+
+def price_rub_for_assets(assets, asset_ids=None, version: int | None = None) -> dict[int, float]:
+    """
+    Курсы сразу для многих активов: {asset.id: rub}.
+    assets — весь справочник активов, version — его версия; asset_ids —
+    нужный поднабор (None — все). Все пары берутся из одной выгрузки
+    тикеров; активы, для которых курс не нашёлся, в ответ не попадают.
+    """
+    return {asset_id: rub for asset_id, (rub, _) in
+            price_rub_for_assets_at(assets, asset_ids, version).items()}
+
+
+def price_rub_for_assets_at(assets, asset_ids=None,
+                            version: int | None = None) -> dict[int, tuple[float, float | None]]:
+    """То же, что price_rub_for_assets, но {asset.id: (rub, fetched_at)} (см. ConversionGraph.value_at)."""
+    graph = conversion_graph(assets, version)
+    prices, quoted_at = quote_prices(graph.pairs_for(asset_ids))
+
+    usd_rub = usd_at = None
+    if graph.needs_usd_for(asset_ids):
+        try:
+            usd_rub = price_rub_for_symbol("USD")
+            usd_at = rate_cache.fetched_at("USD")
+        except Exception:
+            pass  # без доллара останутся только рубли и ручные курсы
+    return graph.value_at(prices, quoted_at, usd_rub, usd_at, asset_ids)
+
+
+def _price_rub_for_symbol(symbol: str) -> float:
+    """Посчитать курс без кэша. symbol уже приведён через ALIAS."""
+
     # 1. RUB
     if symbol == "RUB":
         return 1.0
@@ -0,0 +1,93 @@
+"""
+Фоновый воркер курсов.
+
+Раз в POLL_INTERVAL секунд опрашивает ЦБ и биржи и пишет один
+согласованный снимок рублёвых курсов всех активов в rate_snapshots.
+Веб-воркеры читают последний снимок вместо HTTP-запросов к биржам;
+на той же машине — ещё и из общего файла rate_store без запросов к БД.
+Изменившиеся курсы дописываются в rate_history (курсы «на момент»).
+
+Запуск: python rates_worker.py  (процесс `rates` в Procfile)
+"""
+import logging
+import os
+import time
+from datetime import datetime, timedelta
+
+from catalogs import catalog_cache
+from db import SessionLocal, init_db
+from models import RateSnapshot
+from rate_history import RateHistoryWriter
+from rate_store import rate_store
+from rates import price_rub_for_assets_at, rate_cache, rate_source, rates_staleness, watch_assets
+
+POLL_INTERVAL = int(os.environ.get("RATES_POLL_INTERVAL", 30))
+# старые снимки не нужны — храним сутки
+KEEP_SNAPSHOTS = timedelta(days=1)
+
+log = logging.getLogger("rates_worker")
+history = RateHistoryWriter()
+
+
+def take_snapshot(db) -> RateSnapshot:
+    # сбрасываем кэш, чтобы весь снимок посчитался от одного курса USD
+    rate_cache.invalidate()
+
+    # все пары — из одной выгрузки тикеров на биржу; граф — по версии справочника
+    catalog = catalog_cache.get(db, "assets")
+    assets = catalog.rows
+    quoted = price_rub_for_assets_at(assets, version=catalog.version)
+    prices = {asset_id: rub for asset_id, (rub, _) in quoted.items()}
+    rates = {str(asset_id): rub for asset_id, rub in prices.items()}
+    errors = {str(a.id): f"нет курса для {a.symbol}" for a in assets if a.id not in prices}
+
+    snapshot = RateSnapshot(taken_at=datetime.utcnow(), rates=rates, errors=errors or None,
+                            stale_age=rates_staleness())
+    db.add(snapshot)
+    sources = {a.id: rate_source(a) for a in assets}
+    history.record(db, prices, sources, snapshot.taken_at)
+    db.query(RateSnapshot).filter(
+        RateSnapshot.taken_at < snapshot.taken_at - KEEP_SNAPSHOTS
+    ).delete(synchronize_session=False)
+    db.commit()
+
+    # тот же снимок — в общий файл для web-воркеров на этой машине;
+    # время — когда получена котировка (у ручных курсов и рубля — сейчас)
+    now = time.time()
+    try:
+        rate_store.publish({
+            a.id: (quoted[a.id][0], quoted[a.id][1] or now, sources[a.id]) for a in assets if a.id in quoted
+        })
+    except OSError:
+        log.exception("не удалось обновить %s", rate_store.path)
+    return snapshot
+
+
+def run():
+    init_db()
+    # поток цен — сразу на пары всех активов; новые активы допишет пересборка графа
+    db = SessionLocal()
+    try:
+        catalog = catalog_cache.get(db, "assets")
+        watch_assets(catalog.rows, catalog.version)
+    finally:
+        db.close()
+    while True:
+        started = time.monotonic()
+        db = SessionLocal()
+        try:
+            snapshot = take_snapshot(db)
+            log.info("снимок #%s: %s курсов, %s ошибок",
+                     snapshot.id, len(snapshot.rates), len(snapshot.errors or {}))
+        except Exception:
+            db.rollback()
+            history.reset()
+            log.exception("не удалось записать снимок курсов")
+        finally:
+            db.close()
+        time.sleep(max(0.0, POLL_INTERVAL - (time.monotonic() - started)))
+
+
+if __name__ == "__main__":
+    logging.basicConfig(level=logging.INFO)
+    run()